@@ -1,32 +1,65 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # Đo thời gian import module, báo cáo lúc khởi động
+
 import os
 import io
 import base64
+import hashlib
 import re
+import asyncio
+import atexit
+import inspect
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import cache
+from typing import Literal
 from dotenv import load_dotenv
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import logging
 
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, Form
+import jwt
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, status, File, UploadFile, Form, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Connection, make_url
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 
-from supabase import create_client, Client
-from gtts import gTTS
-import speech_recognition as sr
-from pydub import AudioSegment
-
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain.tools import tool
+# supabase, gtts, langchain (agents) và langchain_google_genai nặng => chỉ import khi dùng lần đầu.
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.tools import StructuredTool
 
 # Import hàm xử lý thời gian từ module utils
 from utils.thoi_gian_tu_nhien import parse_natural_time
+from utils.khoang_thoi_gian import (
+    decode_cursor, describe_conflicts, encode_cursor, find_conflicts, find_schedules, find_task_conflicts, free_busy,
+)
+from utils.thu_tu_tool import TOAN_BO, ToolCallOrdering, task_scope
+from utils.xac_thuc_jwt import SupabaseJWTVerifier, VerifiedTokenCache, KhongTheXacThucCucBo
+from utils.tts_cache import TTSAudioCache, TTSCacheCollector
+from utils.tts_nen import AUDIO_FORMATS, AudioKhongTonTai, BackgroundTTS, negotiate_format, parse_range
+from utils.dinh_tuyen_y_dinh import IntentRouter, RoutedIntent, normalize_prompt
+from utils.lich_su_hoi_thoai import ChatHistoryStore, WindowPolicy
+from utils.phien_ban_du_lieu import VersionedCache, get_data_version, get_data_version_state
+from utils.chong_trung_lap import IdempotencyStore, KhoaTrungLapXungDot, request_fingerprint
+from utils.dieu_phoi_yeu_cau import FairScheduler, QuaTai
+from utils.don_vi_cong_viec import UnitOfWork, run_after_commit
+from utils.nhac_lich import ReminderDispatcher
+from utils.do_thoi_gian import LLMTimingCallback, REJECTED_REQUESTS, REQUEST_SECONDS, STARTUP_SECONDS, current_timing, instrument_engine, span, start_request_timing
+from utils.xu_ly_am_thanh import (
+    AmThanhKhongHopLe, DichVuNhanDangLoi, KhongNhanDangDuoc, build_recognizer, encode_opus, opus_available, prepare_audio,
+)
 
 # --- 1. CẤU HÌNH & KẾT NỐI ---
 load_dotenv()
@@ -37,28 +70,189 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+# Xác thực: "local" = tự kiểm tra JWT (fallback Supabase khi thiếu khóa), "remote" = luôn hỏi Supabase.
+AUTH_MODE = os.getenv("AUTH_MODE", "local")
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))
+# Fast-path: câu lệnh đơn giản được gọi thẳng tool, không qua Gemini.
+# Ngưỡng 0.8: lệnh xóa / đánh dấu xong chỉ đi đường tắt khi tiêu đề nằm trong dấu nháy (mẫu không nháy: 0.7).
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+# Lịch sử hội thoại: "memory" (mỗi worker một bản) hoặc "sql" (dùng chung, mặc định lưu trong DATABASE_URL).
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory")
+HISTORY_DATABASE_URL = os.getenv("HISTORY_DATABASE_URL") or DATABASE_URL
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "1000"))
+HISTORY_IDLE_TTL = int(os.getenv("HISTORY_IDLE_TTL", "3600"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "20"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "2000"))
+# Backend "sql": mỗi HISTORY_PURGE_INTERVAL giây xóa lịch sử của phiên không hoạt động quá HISTORY_IDLE_TTL.
+HISTORY_PURGE_INTERVAL = int(os.getenv("HISTORY_PURGE_INTERVAL", "600"))
+# Thời gian tối đa (giây) giữ bản tóm tắt tiến độ khi dữ liệu không đổi.
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", "300"))
+# Lịch trình: số dòng mỗi trang của `tim_lich_trinh`; khung giờ trong ngày dùng để tìm giờ rảnh.
+SCHEDULE_PAGE_SIZE = int(os.getenv("SCHEDULE_PAGE_SIZE", "20"))
+FREE_SLOT_DAY_START = os.getenv("FREE_SLOT_DAY_START", "07:00")
+FREE_SLOT_DAY_END = os.getenv("FREE_SLOT_DAY_END", "22:00")
+FREE_BUSY_MAX_DAYS = int(os.getenv("FREE_BUSY_MAX_DAYS", "62"))
+# Cache câu trả lời cho câu hỏi chỉ đọc, theo phiên bản dữ liệu. TTL = 0 để tắt.
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Idempotency-Key của /chat: giữ kết quả bao lâu (giây) và tối đa bao nhiêu MB (audio base64 chiếm phần lớn).
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_CACHE_MB = int(os.getenv("IDEMPOTENCY_CACHE_MB", "32"))
+# Điều phối lượt hội thoại: số lượt gọi LLM cùng lúc, tổng số lượt được chờ, số lượt chờ tối đa của một user.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+TURN_QUEUE_MAX = int(os.getenv("TURN_QUEUE_MAX", "64"))
+TURN_QUEUE_MAX_PER_USER = int(os.getenv("TURN_QUEUE_MAX_PER_USER", "4"))
+
+# Engine async dùng psycopg 3 (chịu được sslmode và pgbouncer của Supabase).
+# Có thể ghi đè bằng ASYNC_DATABASE_URL nếu cần driver khác.
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+# Số luồng tối đa cho gTTS / nhận dạng giọng nói, để không chặn event loop.
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "4"))
+# Số tiến trình giải mã audio (ffmpeg/resample/VAD tốn CPU). 0 = giải mã ngay trong `audio_executor`.
+AUDIO_DECODE_WORKERS = int(os.getenv("AUDIO_DECODE_WORKERS", "2"))
+# Bộ nhận dạng giọng nói: "google" hoặc tên đã đăng ký qua `register_recognizer`.
+STT_BACKEND = os.getenv("STT_BACKEND", "google")
+STT_LANGUAGE = "vi-VN"
+# Cache audio TTS: ngân sách RAM (MB) và thư mục cache trên đĩa (để trống = tắt).
+TTS_CACHE_MB = int(os.getenv("TTS_CACHE_MB", "32"))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR") or None
+TTS_LANG = "vi"
+TTS_SLOW = False
+# Audio trả lời của /chat: "inline" (audio_base64 trong JSON), "deferred" (trả `audio_url` ngay, audio tạo
+# nền và lấy qua GET /audio/{id}) hoặc "none". Client chọn riêng từng request bằng field `audio` của form.
+CHAT_AUDIO_MODE = os.getenv("CHAT_AUDIO_MODE", "inline")
+AUDIO_JOB_TTL = int(os.getenv("AUDIO_JOB_TTL", "600"))
+AUDIO_JOBS_MAX = int(os.getenv("AUDIO_JOBS_MAX", "500"))
+# Nhắc lịch (utils/nhac_lich.py, cần migrations/005): ghi thông báo vào bảng `notifications` trước giờ bắt đầu
+# REMINDER_LEAD_MINUTES phút. Mỗi REMINDER_REFRESH_SECONDS giây nạp lại REMINDER_WINDOW_MINUTES phút tới
+# (tối đa REMINDER_MAX_ENTRIES nhắc nhở trong RAM). Chỉ cần bật trên một tiến trình: bật nhiều nơi vẫn không
+# gửi trùng nhưng mỗi nơi đều nạp cả khung.
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "0") == "1"
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "15"))
+REMINDER_WINDOW_MINUTES = int(os.getenv("REMINDER_WINDOW_MINUTES", "30"))
+REMINDER_REFRESH_SECONDS = int(os.getenv("REMINDER_REFRESH_SECONDS", "60"))
+REMINDER_MAX_ENTRIES = int(os.getenv("REMINDER_MAX_ENTRIES", "100000"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+# Khởi động: PREWARM=1 tạo sẵn kết nối DB, LLM/agent, STT/TTS trước khi nhận request đầu tiên.
+PREWARM = os.getenv("PREWARM", "0") == "1"
+PREWARM_DB_CONNECTIONS = int(os.getenv("PREWARM_DB_CONNECTIONS", "2"))
+# Pool kết nối DB: mỗi lượt hội thoại giữ một kết nối từ lần gọi tool đầu tiên tới hết lượt,
+# nên DB_POOL_SIZE + DB_MAX_OVERFLOW nên >= LLM_MAX_CONCURRENCY + số request REST đồng thời.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# psycopg 3 prepare phía server câu lệnh chạy tới lần thứ N trên mỗi kết nối; "none" = tắt
+# (khi đi qua pgbouncer chế độ transaction không hỗ trợ prepared statement).
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "1")
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "1") == "1"
+
+def check_config() -> None:
+    if not all([DATABASE_URL, SUPABASE_URL, SUPABASE_KEY, GEMINI_API_KEY]):
+        raise ValueError("❌ Thiếu các biến môi trường cần thiết trong file .env")
+
+# Các client được tạo ở lần dùng đầu tiên (hoặc lúc prewarm), không phải lúc import module.
+audio_executor = ThreadPoolExecutor(max_workers=AUDIO_WORKERS, thread_name_prefix="audio")
+audio_decode_executor = ProcessPoolExecutor(max_workers=AUDIO_DECODE_WORKERS) if AUDIO_DECODE_WORKERS > 0 else audio_executor
+
+@atexit.register
+def _shutdown_audio_executors() -> None:
+    """Hai executor audio sống cùng tiến trình, dùng chung cho mọi app của `create_app()`: chỉ tắt khi thoát."""
+    audio_executor.shutdown(wait=False, cancel_futures=True)
+    if audio_decode_executor is not audio_executor:
+        audio_decode_executor.shutdown(wait=False, cancel_futures=True)
+
+tts_cache = TTSAudioCache(max_bytes=TTS_CACHE_MB * 1024 * 1024, disk_dir=TTS_CACHE_DIR)
+REGISTRY.register(TTSCacheCollector(tts_cache))  # Hit/miss của cache TTS trên /metrics
+tts_backend = None  # Lớp tổng hợp giọng nói có giao diện như gTTS; None = nạp gTTS khi cần
+llm_brain: BaseChatModel | None = None  # Có thể truyền model khác qua create_app(llm=...)
+reminder_dispatcher: ReminderDispatcher | None = None  # Chạy khi REMINDERS_ENABLED=1 (tạo lúc khởi động)
+
+@cache
+def get_engine() -> Engine:
+    engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300,
+                           pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    instrument_engine(engine)
+    return engine
 
-if not all([DATABASE_URL, SUPABASE_URL, SUPABASE_KEY, GEMINI_API_KEY]):
-    raise ValueError("❌ Thiếu các biến môi trường cần thiết trong file .env")
+@cache
+def get_async_engine() -> AsyncEngine:
+    url = make_url(ASYNC_DATABASE_URL or make_url(DATABASE_URL).set(drivername="postgresql+psycopg"))
+    connect_args = {}
+    if url.get_driver_name() == "psycopg":
+        connect_args["prepare_threshold"] = None if DB_PREPARE_THRESHOLD == "none" else int(DB_PREPARE_THRESHOLD)
+    async_engine = create_async_engine(url, pool_pre_ping=True, pool_recycle=300, connect_args=connect_args,
+                                       pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    instrument_engine(async_engine.sync_engine)
+    return async_engine
 
-engine: Engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-llm_brain = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=GEMINI_API_KEY, temperature=0.7)
+@cache
+def get_supabase():
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@cache
+def get_speech_recognizer():
+    return build_recognizer(STT_BACKEND)
+
+def get_tts_backend():
+    global tts_backend
+    if tts_backend is None:
+        from gtts import gTTS
+        tts_backend = gTTS
+    return tts_backend
+
+def get_llm() -> BaseChatModel:
+    global llm_brain
+    if llm_brain is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        llm_brain = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=GEMINI_API_KEY, temperature=0.7)
+    return llm_brain
 
 # --- 2. XÁC THỰC NGƯỜI DÙNG ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@cache
+def get_jwt_verifier() -> SupabaseJWTVerifier:
+    return SupabaseJWTVerifier(SUPABASE_URL, jwt_secret=SUPABASE_JWT_SECRET)
+
+token_cache = VerifiedTokenCache(maxsize=10_000, ttl=AUTH_CACHE_TTL)
+
+def _verify_token_remote(token: str) -> tuple[str, float]:
+    """Hỏi Supabase Auth (1 round trip). Trả về (user_id, thời điểm hết hạn)."""
+    user_response = get_supabase().auth.get_user(token)
+    try:
+        # Supabase đã xác nhận token, chỉ đọc `exp` để biết được cache đến khi nào.
+        exp = float(jwt.decode(token, options={"verify_signature": False})["exp"])
+    except Exception:
+        exp = time.time() + AUTH_CACHE_TTL
+    return str(user_response.user.id), exp
+
+def _verify_token(token: str) -> tuple[str, float]:
+    if AUTH_MODE == "local":
+        try:
+            claims = get_jwt_verifier().verify(token)
+            return str(claims["sub"]), float(claims["exp"])
+        except KhongTheXacThucCucBo as e:
+            logger.warning(f"⚠️ Không tự xác thực được token, chuyển sang Supabase: {e}")
+    return _verify_token_remote(token)
+
 def get_current_user_id(token: str = Depends(oauth2_scheme)) -> str:
+    with span("auth", "cache"):
+        cached_user_id = token_cache.get(token)
+    if cached_user_id:
+        return cached_user_id
     try:
-        user_response = supabase.auth.get_user(token)
-        user_id = user_response.user.id
-        logger.info(f"👤 User ID đã xác thực: {user_id}")
-        return str(user_id)
+        with span("auth", AUTH_MODE):
+            user_id, exp = _verify_token(token)
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token không hợp lệ hoặc đã hết hạn.",
         )
+    token_cache.put(token, user_id, exp)
+    logger.info(f"👤 User ID đã xác thực: {user_id}")
+    return user_id
 
 # --- 3. CÁC HÀM XỬ LÝ GIỌNG NÓI (Giữ nguyên) ---
 def clean_text_for_speech(text: str) -> str:
@@ -67,375 +261,807 @@ def clean_text_for_speech(text: str) -> str:
     cleaned_text = re.sub(r'^\s*-\s*', '. ', cleaned_text, flags=re.MULTILINE)
     return cleaned_text
 
+def synthesize_speech(text: str) -> bytes:
+    """Trả về MP3 của câu trả lời, lấy từ `tts_cache` nếu câu này đã từng được đọc."""
+    speech_text = clean_text_for_speech(text)
+    cache_key = tts_cache.make_key(speech_text, lang=TTS_LANG, slow=TTS_SLOW)
+    audio_bytes = tts_cache.get(cache_key)
+    if audio_bytes is not None:
+        return audio_bytes
+
+    tts = get_tts_backend()(speech_text, lang=TTS_LANG, slow=TTS_SLOW)
+    audio_fp = io.BytesIO()
+    tts.write_to_fp(audio_fp)
+    audio_bytes = audio_fp.getvalue()
+    tts_cache.put(cache_key, audio_bytes)
+    return audio_bytes
+
 def text_to_base64_audio(text: str) -> str:
     try:
-        speech_text = clean_text_for_speech(text)
-        tts = gTTS(speech_text, lang='vi', slow=False)
-        audio_fp = io.BytesIO()
-        tts.write_to_fp(audio_fp)
-        audio_fp.seek(0)
-        audio_bytes = audio_fp.read()
+        audio_bytes = synthesize_speech(text)
         return base64.b64encode(audio_bytes).decode('utf-8')
     except Exception as e:
         logger.error(f"Lỗi TTS: {e}")
         return ""
 
-async def audio_to_text(audio_file: UploadFile) -> str:
-    r = sr.Recognizer()
+# Audio "deferred": MP3 tạo trong `audio_executor` ngay khi có câu trả lời; Opus chỉ mã hóa khi client xin.
+background_tts = BackgroundTTS(
+    synthesize_speech, audio_executor,
+    encoders={"opus": encode_opus} if opus_available() else None,
+    max_jobs=AUDIO_JOBS_MAX, ttl=AUDIO_JOB_TTL,
+)
+
+async def audio_to_text(audio_bytes: bytes) -> str:
+    """
+    Giải mã thẳng về PCM 16 kHz mono và cắt khoảng lặng trong `audio_decode_executor` (đa tiến trình),
+    rồi đưa PCM cho bộ nhận dạng (`get_speech_recognizer()`) trong `audio_executor`.
+    """
     try:
-        audio_bytes = await audio_file.read()
-        audio_fp = io.BytesIO(audio_bytes)
-        sound = AudioSegment.from_file(audio_fp)
+        loop = asyncio.get_running_loop()
+        with span("stt", "decode"):
+            prepared = await loop.run_in_executor(audio_decode_executor, prepare_audio, audio_bytes)
+        del audio_bytes
 
-        if len(sound) < 500:
+        if prepared.original_ms < 500:
             raise HTTPException(status_code=400, detail="File âm thanh quá ngắn. Vui lòng nhấn giữ nút micro để nói.")
+        if not prepared.pcm:
+            raise KhongNhanDangDuoc()
 
-        wav_fp = io.BytesIO()
-        sound.export(wav_fp, format="wav")
-        wav_fp.seek(0)
-
-        with sr.AudioFile(wav_fp) as source:
-            audio_data = r.record(source)
-            try:
-                text = r.recognize_google(audio_data, language="vi-VN")
-                logger.info(f"🎤 Văn bản nhận dạng được: {text}")
-                return text
-            except sr.UnknownValueError:
-                raise HTTPException(status_code=400, detail="Rất tiếc, tôi không nghe rõ bạn nói. Vui lòng thử nói chậm và rõ ràng hơn.")
-            except sr.RequestError as e:
-                raise HTTPException(status_code=503, detail=f"Dịch vụ nhận dạng giọng nói tạm thời không khả dụng. Lỗi: {e}")
-
+        with span("stt", STT_BACKEND):
+            text = await loop.run_in_executor(audio_executor, get_speech_recognizer().recognize, prepared, STT_LANGUAGE)
+        logger.info(f"🎤 Văn bản nhận dạng được ({prepared.speech_ms}/{prepared.original_ms} ms có tiếng nói): {text}")
+        return text
+    except HTTPException:
+        raise
+    except KhongNhanDangDuoc:
+        raise HTTPException(status_code=400, detail="Rất tiếc, tôi không nghe rõ bạn nói. Vui lòng thử nói chậm và rõ ràng hơn.")
+    except DichVuNhanDangLoi as e:
+        raise HTTPException(status_code=503, detail=f"Dịch vụ nhận dạng giọng nói tạm thời không khả dụng. Lỗi: {e}")
+    except AmThanhKhongHopLe as e:
+        logger.error(f"Lỗi giải mã audio: {e}")
+        raise HTTPException(status_code=400, detail="Không đọc được file âm thanh. Vui lòng thử ghi âm lại.")
     except Exception as e:
-        if isinstance(e, HTTPException):
-            raise e
         logger.error(f"Lỗi xử lý audio: {e}")
         raise HTTPException(status_code=500, detail=f"Đã xảy ra lỗi không mong muốn khi xử lý file âm thanh.")
 
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+def split_sentences(buffer: str) -> tuple[list[str], str]:
+    """
+    Tách các câu đã hoàn chỉnh khỏi đoạn văn bản đang được stream.
+    Trả về (các câu hoàn chỉnh, phần còn dở dang chờ thêm token).
+    """
+    parts = SENTENCE_END.split(buffer)
+    sentences = [s.strip() for s in parts[:-1] if s.strip()]
+    return sentences, parts[-1]
+
+async def text_to_base64_audio_async(text: str) -> str:
+    """Bản async của `text_to_base64_audio`: gTTS chạy trong `audio_executor`."""
+    loop = asyncio.get_running_loop()
+    with span("tts", "gtts"):
+        return await loop.run_in_executor(audio_executor, text_to_base64_audio, text)
+
 # --- 4. HÀM HỖ TRỢ NGHIỆP VỤ (MỚI) ---
 
+# Tìm task theo tiêu đề trong MỘT truy vấn, dựa trên cột `title_search` (lower + unaccent)
+# và index trigram (xem migrations/001_task_title_search.sql). Kết quả được xếp hạng:
+# 3 = trùng khớp, 2 = trùng khi bỏ dấu, 1 = tiền tố, 0 = chứa, -1 = chỉ gần giống (trigram).
+_TASK_MATCH_SQL = """
+    WITH q AS (SELECT lower(public.immutable_unaccent(:title)) AS needle,
+                      lower(public.immutable_unaccent(:title_like)) AS needle_like)
+    SELECT t.id, t.title, t.is_completed, {extra_columns}
+           CASE WHEN lower(t.title) = lower(:title) THEN 3
+                WHEN t.title_search = q.needle THEN 2
+                WHEN t.title_search LIKE q.needle_like || '%' THEN 1
+                WHEN t.title_search LIKE '%' || q.needle_like || '%' THEN 0
+                ELSE -1 END AS rank,
+           similarity(t.title_search, q.needle) AS score
+    FROM tasks t CROSS JOIN q {extra_join}
+    WHERE t.user_id = :user_id
+      AND (t.title_search LIKE '%' || q.needle_like || '%' OR t.title_search % q.needle)
+    ORDER BY rank DESC, t.is_completed ASC, score DESC, t.created_at DESC
+    LIMIT 5;
+"""
+TASK_MATCH_QUERY = text(_TASK_MATCH_SQL.format(extra_columns="", extra_join=""))
+SCHEDULED_TASK_MATCH_QUERY = text(_TASK_MATCH_SQL.format(
+    extra_columns="s.start_time,",
+    extra_join="JOIN LATERAL (SELECT start_time FROM schedules WHERE task_id = t.id ORDER BY start_time DESC LIMIT 1) s ON TRUE",
+))
+# Hai ứng viên cùng hạng, cùng trạng thái mà điểm tương đồng chênh nhau ít hơn mức này => hỏi lại người dùng.
+AMBIGUITY_MARGIN = 0.2
+
+class AmbiguousTaskTitle(Exception):
+    """Nhiều công việc khớp ngang nhau với tiêu đề; tool sẽ trả danh sách để agent hỏi lại."""
+
+    def __init__(self, title: str, candidates: list[str]):
+        super().__init__(title)
+        self.title = title
+        self.candidates = candidates
+
+    def message(self) -> str:
+        options = ", ".join(f"'{c}'" for c in self.candidates)
+        return f"🤔 Có nhiều công việc khớp với '{self.title}': {options}. Hãy hỏi người dùng muốn chọn công việc nào rồi gọi lại tool với đúng tiêu đề."
+
+class UnconfirmedTaskTitle(AmbiguousTaskTitle):
+    """Không task nào chứa tiêu đề, chỉ có task gần giống; tool ghi / xóa không tự chọn mà để agent hỏi lại."""
+
+    def message(self) -> str:
+        options = ", ".join(f"'{c}'" for c in self.candidates)
+        return f"🤔 Không có công việc nào tên '{self.title}', chỉ có công việc gần giống: {options}. Hãy hỏi người dùng xác nhận rồi gọi lại tool với đúng tiêu đề."
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _find_task_candidates(connection, user_id: str, title: str, with_schedule: bool = False) -> list:
+    query = SCHEDULED_TASK_MATCH_QUERY if with_schedule else TASK_MATCH_QUERY
+    return connection.execute(query, {"user_id": user_id, "title": title, "title_like": _escape_like(title)}).fetchall()
+
+def _pick_task(candidates: list, title: str):
+    """
+    Chọn ứng viên tốt nhất, hoặc ném `AmbiguousTaskTitle` nếu không phân định được.
+    Mọi nơi gọi đều sắp ghi / xóa task đó, nên ứng viên chỉ gần giống (rank -1) không bao giờ được tự chọn.
+    """
+    if not candidates:
+        return None
+    best = candidates[0]
+    if best.rank < 0:
+        raise UnconfirmedTaskTitle(title, [c.title for c in candidates[:3]])
+    if best.rank >= 2:
+        return best
+    rivals = [
+        c for c in candidates[1:]
+        if c.rank == best.rank and c.is_completed == best.is_completed and best.score - c.score < AMBIGUITY_MARGIN
+    ]
+    if rivals:
+        raise AmbiguousTaskTitle(title, [best.title] + [c.title for c in rivals])
+    return best
+
 def _get_task_id_from_title(connection, user_id: str, title: str) -> int | None:
     """
     Hàm nội bộ tìm task_id dựa trên tiêu đề.
-    Ưu tiên tìm task chưa hoàn thành và khớp nhất.
-    """
-    # 1. Thử tìm khớp chính xác (case-insensitive)
-    query_exact = text("SELECT id FROM tasks WHERE user_id = :user_id AND lower(title) = lower(:title) ORDER BY is_completed ASC, created_at DESC LIMIT 1;")
-    result = connection.execute(query_exact, {"user_id": user_id, "title": title}).fetchone()
-    if result:
-        return result.id
-
-    # 2. Thử tìm khớp ILIKE (chứa)
-    query_like = text("SELECT id FROM tasks WHERE user_id = :user_id AND unaccent(title) ILIKE unaccent(:title_like) ORDER BY is_completed ASC, created_at DESC LIMIT 1;")
-    result = connection.execute(query_like, {"user_id": user_id, "title_like": f"%{title}%"}).fetchone()
-    if result:
-        return result.id
-    
-    return None
+    Ưu tiên task khớp nhất và chưa hoàn thành; ném `AmbiguousTaskTitle` khi có nhiều task khớp ngang nhau.
+    Trong một lượt hội thoại, tiêu đề đã tìm thấy được nhớ lại (`UnitOfWork.task_ids`).
+    """
+    unit = _turn_unit.get()
+    key = (user_id, title.strip())
+    if unit is not None and key in unit.task_ids:
+        return unit.task_ids[key]
+    best = _pick_task(_find_task_candidates(connection, user_id, title), title)
+    if best is None:
+        return None
+    if unit is not None:
+        unit.task_ids[key] = best.id
+    return best.id
+
+# Kết nối + transaction dùng chung của lượt hội thoại hiện tại (None = mỗi tool tự mở kết nối).
+_turn_unit: ContextVar[UnitOfWork | None] = ContextVar("turn_unit", default=None)
+
+@asynccontextmanager
+async def turn_unit_of_work():
+    """Các tool gọi trong khối này dùng chung một kết nối; ghi tất cả khi khối kết thúc, lỗi thì rollback."""
+    unit = UnitOfWork(get_async_engine())
+    token = _turn_unit.set(unit)
+    try:
+        yield unit
+    except BaseException:
+        await unit.close(commit=False)
+        raise
+    else:
+        await unit.close(commit=True)
+    finally:
+        _turn_unit.reset(token)
+
+# Callback sau commit của tool đang tự mở transaction (ngoài `turn_unit_of_work()`).
+_tool_after_commit: ContextVar[list | None] = ContextVar("tool_after_commit", default=None)
+
+def _after_commit(callback) -> None:
+    """Chạy `callback` khi dữ liệu tool đang ghi đã được commit: cuối lượt nếu trong UnitOfWork, hết tool nếu không."""
+    if (unit := _turn_unit.get()) is not None:
+        unit.after_commit(callback)
+    elif (callbacks := _tool_after_commit.get()) is not None:
+        callbacks.append(callback)
+    else:
+        callback()
+
+@contextmanager
+def _after_commit_scope():
+    """Bao quanh transaction của một tool: callback `_after_commit` chỉ chạy khi khối kết thúc không lỗi."""
+    callbacks = []
+    token = _tool_after_commit.set(callbacks)
+    try:
+        yield
+    finally:
+        _tool_after_commit.reset(token)
+    run_after_commit(callbacks)
+
+def _reminders_changed(schedules=(), removed_task_ids=()) -> None:
+    """
+    Báo bộ nhắc lịch (nếu đang chạy) sau khi commit: `schedules` là các (schedule_id, task_id, start_time)
+    vừa tạo / dời, `removed_task_ids` là task vừa bị xóa / hoàn thành.
+    """
+    dispatcher = reminder_dispatcher
+    if dispatcher is None:
+        return
+    schedules = [tuple(row) for row in schedules]
+    removed_task_ids = list(removed_task_ids)
+
+    def notify():
+        for schedule_id, task_id, start_time in schedules:
+            dispatcher.schedule_changed(schedule_id, task_id, start_time)
+        for task_id in removed_task_ids:
+            dispatcher.task_removed(task_id)
+    _after_commit(notify)
+
+# Tên các tool bị lỗi trong lượt hội thoại hiện tại (lỗi được trả về agent dưới dạng văn bản).
+_turn_tool_errors: ContextVar[list[str] | None] = ContextVar("turn_tool_errors", default=None)
+
+def _note_tool_error(tool_name: str) -> None:
+    errors = _turn_tool_errors.get()
+    if errors is not None:
+        errors.append(tool_name)
+
+# Thứ tự các lượt gọi tool chạy đồng thời trong lượt hội thoại hiện tại.
+_turn_tool_order: ContextVar[ToolCallOrdering | None] = ContextVar("turn_tool_order", default=None)
+
+# id của tool call (từ model) mà coroutine hiện tại đang chạy, để tìm chỗ đã giữ trong `ToolCallOrdering`.
+_tool_call_key: ContextVar[str | None] = ContextVar("tool_call_key", default=None)
+
+def _start_turn() -> list[str]:
+    """Bắt đầu một lượt hội thoại: trả về danh sách sẽ chứa tên các tool bị lỗi trong lượt."""
+    errors: list[str] = []
+    _turn_tool_errors.set(errors)
+    _turn_tool_order.set(ToolCallOrdering())
+    return errors
+
+_TITLE_ARGS = ("tieu_de", "task_tieu_de", "tieu_de_cu")
+
+def _call_scope(kwargs: dict, doc_toan_bo: bool):
+    if doc_toan_bo:
+        return TOAN_BO
+    titles = [kwargs.get(name) for name in _TITLE_ARGS]
+    titles += [item.get("tieu_de") if isinstance(item, dict) else getattr(item, "tieu_de", None)
+               for item in kwargs.get("danh_sach") or []]
+    return task_scope(titles)
+
+def _reserve_tool_call(action) -> None:
+    """Giữ chỗ cho một tool call của model (gọi đồng bộ, theo thứ tự model trả về)."""
+    ordering = _turn_tool_order.get()
+    key = getattr(action, "tool_call_id", None)
+    tool = tools_by_name.get(action.tool)
+    if ordering is None or not key or tool is None or not isinstance(action.tool_input, dict):
+        return
+    metadata = tool.metadata or {}
+    ordering.reserve(key, _call_scope(action.tool_input, metadata.get("doc_toan_bo", False)), metadata.get("write", True))
+
+def db_tool(write: bool = False, loi: str = "❌ Lỗi: {e}", doc_toan_bo: bool = False, doi_task: bool = False):
+    """
+    Biến một hàm nghiệp vụ `fn(connection, ...)` thành tool cho agent, có cả bản sync và async.
+    - Bản sync chạy trên `get_engine()` (psycopg2), bản async chạy trên `get_async_engine()` qua `run_sync`,
+      nên phần SQL chỉ viết một lần.
+    - `write=True`: cả hàm chạy trong một transaction, lỗi sẽ rollback toàn bộ. Phiên bản dữ liệu
+      của người dùng (user_data_versions) do trigger của migrations/004 tăng trong cùng transaction,
+      chỉ khi có dòng thực sự thay đổi, nên tool ghi không tìm thấy gì không làm các cache hết hiệu lực.
+    - `loi`: câu trả về cho agent khi có lỗi, `{e}` là nội dung lỗi.
+    - `doc_toan_bo=True`: tool đọc toàn bộ dữ liệu của người dùng (tìm lịch, tóm tắt).
+    - `doi_task=True`: tool tạo / xóa task => quên các task_id đã nhớ theo tiêu đề trong lượt.
+    - Việc cần dữ liệu đã ghi xong (báo bộ nhắc lịch) đăng ký bằng `_after_commit`, chạy sau khi transaction commit.
+    Trong `turn_unit_of_work()` (mọi lượt /chat), bản async chạy trên kết nối và transaction chung của lượt
+    (`UnitOfWork`), mỗi lượt gọi một SAVEPOINT; ngoài khối đó mỗi lượt gọi tự mở kết nối như bản sync.
+    Khi model gọi nhiều tool trong một lượt, các bản async chạy đồng thời (phần SQL vẫn lần lượt trên kết nối
+    của `UnitOfWork`); tool chạm cùng task (theo tiêu đề) với một tool ghi gọi trước nó sẽ chờ tool đó xong
+    (`ToolCallOrdering`, thứ tự được giữ chỗ bởi `TurnAgentExecutor`).
+    Tool giữ cờ `metadata["write"]` (để biết lượt hội thoại nào chỉ đọc dữ liệu) và `metadata["doc_toan_bo"]`.
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        params = list(signature.parameters.values())[1:]  # Bỏ tham số `connection`
+
+        def _call(connection: Connection, **kwargs) -> str:
+            result = fn(connection, **kwargs)
+            if doi_task and (unit := _turn_unit.get()) is not None:
+                unit.forget_task_ids()
+            return result
+
+        def _sync(**kwargs) -> str:
+            try:
+                engine = get_engine()
+                with _after_commit_scope(), span("tool", fn.__name__), \
+                        (engine.begin() if write else engine.connect()) as connection:
+                    return _call(connection, **kwargs)
+            except AmbiguousTaskTitle as e:
+                return e.message()
+            except Exception as e:
+                _note_tool_error(fn.__name__)
+                return loi.format(e=e)
+
+        async def _async(**kwargs) -> str:
+            ordering = _turn_tool_order.get() or ToolCallOrdering()
+            try:
+                async with ordering.turn(_call_scope(kwargs, doc_toan_bo), write, key=_tool_call_key.get()):
+                    with span("tool", fn.__name__):
+                        if (unit := _turn_unit.get()) is not None:
+                            return await unit.run(_call, **kwargs)
+                        async_engine = get_async_engine()
+                        with _after_commit_scope():
+                            async with (async_engine.begin() if write else async_engine.connect()) as connection:
+                                return await connection.run_sync(_call, **kwargs)
+            except AmbiguousTaskTitle as e:
+                return e.message()
+            except Exception as e:
+                _note_tool_error(fn.__name__)
+                return loi.format(e=e)
+
+        for wrapper in (_sync, _async):
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__ = fn.__doc__
+            wrapper.__signature__ = signature.replace(parameters=params)
+            wrapper.__annotations__ = {k: v for k, v in fn.__annotations__.items() if k != "connection"}
+
+        return StructuredTool.from_function(func=_sync, coroutine=_async, metadata={"write": write, "doc_toan_bo": doc_toan_bo})
+    return decorator
 
 # --- 5. CÁC CÔNG CỤ (TOOLS) CHO AGENT (NÂNG CẤP) ---
 
-@tool
-def lay_ten_nguoi_dung(user_id: str) -> str:
+@db_tool(loi="Lỗi khi lấy tên người dùng: {e}. Cứ trả lời bình thường.")
+def lay_ten_nguoi_dung(connection: Connection, user_id: str) -> str:
     """Lấy tên của người dùng hiện tại từ cơ sở dữ liệu để cá nhân hóa cuộc trò chuyện."""
-    try:
-        with engine.connect() as connection:
-            query = text("SELECT name FROM public.profiles WHERE id = :user_id;")
-            result = connection.execute(query, {"user_id": user_id}).fetchone()
-            if result and result.name:
-                return f"Tên của người dùng là {result.name}."
-            else:
-                return "Không tìm thấy tên người dùng. Cứ trả lời bình thường mà không cần gọi tên."
-    except Exception as e:
-        return f"Lỗi khi lấy tên người dùng: {e}. Cứ trả lời bình thường."
+    query = text("SELECT name FROM public.profiles WHERE id = :user_id;")
+    result = connection.execute(query, {"user_id": user_id}).fetchone()
+    if result and result.name:
+        return f"Tên của người dùng là {result.name}."
+    else:
+        return "Không tìm thấy tên người dùng. Cứ trả lời bình thường mà không cần gọi tên."
 
-@tool
-def tao_task_don_le(tieu_de: str, user_id: str, mo_ta: str | None = None, deadline: str | None = None, priority: str | None = None) -> str:
+@db_tool(write=True, loi="❌ Lỗi khi tạo công việc: {e}", doi_task=True)
+def tao_task_don_le(connection: Connection, tieu_de: str, user_id: str, mo_ta: str | None = None, deadline: str | None = None, priority: str | None = None) -> str:
     """
     Tạo một CÔNG VIỆC (task) mới mà KHÔNG cần lịch trình (schedule) cụ thể.
     Chỉ dùng khi người dùng nói 'tạo task', 'thêm việc cần làm', 'tạo nhiệm vụ', 'deadline'.
     Không dùng khi người dùng nói 'đặt lịch', 'hẹn'.
     priority phải là một trong ['low', 'medium', 'high'].
     """
-    try:
-        # Xử lý deadline (nếu có)
-        deadline_iso = None
-        if deadline:
-            parsed_time = parse_natural_time(deadline)
-            deadline_iso = parsed_time[0].isoformat() # Lấy start_time làm deadline
-
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                query = text("""
-                    INSERT INTO tasks (user_id, title, description, deadline, priority, status)
-                    VALUES (:user_id, :title, :description, :deadline, :priority, 'todo')
-                    RETURNING id;
-                """)
-                result = connection.execute(
-                    query,
-                    {
-                        "user_id": user_id,
-                        "title": tieu_de,
-                        "description": mo_ta,
-                        "deadline": deadline_iso,
-                        "priority": priority if priority in ['low', 'medium', 'high'] else None
-                    }
-                )
-                task_id = result.scalar_one_or_none()
-                transaction.commit()
-                return f"✅ Đã tạo công việc mới: '{tieu_de}' (ID: {task_id})."
-    except Exception as e:
-        return f"❌ Lỗi khi tạo công việc: {e}"
+    # Xử lý deadline (nếu có)
+    deadline_iso = None
+    if deadline:
+        parsed_time = parse_natural_time(deadline, base_date=datetime.now())
+        deadline_iso = parsed_time[0].isoformat() # Lấy start_time làm deadline
+
+    query = text("""
+        INSERT INTO tasks (user_id, title, description, deadline, priority, status)
+        VALUES (:user_id, :title, :description, :deadline, :priority, 'todo')
+        RETURNING id;
+    """)
+    result = connection.execute(
+        query,
+        {
+            "user_id": user_id,
+            "title": tieu_de,
+            "description": mo_ta,
+            "deadline": deadline_iso,
+            "priority": priority if priority in ['low', 'medium', 'high'] else None
+        }
+    )
+    task_id = result.scalar_one_or_none()
+    return f"✅ Đã tạo công việc mới: '{tieu_de}' (ID: {task_id})."
 
-@tool
-def tao_lich_trinh(tieu_de: str, thoi_gian_bat_dau: str, thoi_gian_ket_thuc: str, user_id: str) -> str:
+@db_tool(write=True, loi="❌ Lỗi khi tạo lịch trình: {e}", doi_task=True)
+def tao_lich_trinh(connection: Connection, tieu_de: str, thoi_gian_bat_dau: str, thoi_gian_ket_thuc: str, user_id: str) -> str:
     """
     Tạo một LỊCH TRÌNH (schedule) MỚI.
     Dùng khi người dùng nói 'đặt lịch', 'thêm lịch hẹn', 'tạo sự kiện'.
     Hàm này sẽ tự động tạo một CÔNG VIỆC (task) và một LỊCH TRÌNH (schedule) liên kết với nhau.
     """
-    try:
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                # 1. Tạo task trước
-                task_query = text("""
-                    INSERT INTO tasks (user_id, title, status) 
-                    VALUES (:user_id, :title, 'todo') 
-                    RETURNING id;
-                """)
-                result = connection.execute(task_query, {"user_id": user_id, "title": tieu_de})
-                task_id = result.scalar_one_or_none()
-                if not task_id:
-                    raise Exception("Không thể tạo task liên kết.")
-
-                # 2. Tạo schedule liên kết với task_id
-                schedule_query = text("""
-                    INSERT INTO schedules (user_id, task_id, start_time, end_time) 
-                    VALUES (:user_id, :task_id, :start_time, :end_time);
-                """)
-                connection.execute(
-                    schedule_query,
-                    {
-                        "user_id": user_id,
-                        "task_id": task_id,
-                        "start_time": thoi_gian_bat_dau,
-                        "end_time": thoi_gian_ket_thuc
-                    }
-                )
-                transaction.commit()
-                return f"✅ Đã lên lịch '{tieu_de}' lúc {thoi_gian_bat_dau}."
-    except Exception as e:
-        return f"❌ Lỗi khi tạo lịch trình: {e}"
+    # 1. Tạo task trước
+    task_query = text("""
+        INSERT INTO tasks (user_id, title, status) 
+        VALUES (:user_id, :title, 'todo') 
+        RETURNING id;
+    """)
+    result = connection.execute(task_query, {"user_id": user_id, "title": tieu_de})
+    task_id = result.scalar_one_or_none()
+    if not task_id:
+        raise Exception("Không thể tạo task liên kết.")
+
+    # 2. Lịch đã có chồng lên khoảng thời gian mới (vẫn tạo, nhưng báo để agent nhắc người dùng)
+    conflicts = find_conflicts(connection, user_id, thoi_gian_bat_dau, thoi_gian_ket_thuc)
+
+    # 3. Tạo schedule liên kết với task_id
+    schedule_query = text("""
+        INSERT INTO schedules (user_id, task_id, start_time, end_time) 
+        VALUES (:user_id, :task_id, :start_time, :end_time)
+        RETURNING id, task_id, start_time;
+    """)
+    schedule = connection.execute(
+        schedule_query,
+        {
+            "user_id": user_id,
+            "task_id": task_id,
+            "start_time": thoi_gian_bat_dau,
+            "end_time": thoi_gian_ket_thuc
+        }
+    ).one()
+    _reminders_changed(schedules=[schedule])
+    message = f"✅ Đã lên lịch '{tieu_de}' lúc {thoi_gian_bat_dau}."
+    if conflicts:
+        message += f"\n⚠️ Trùng giờ với: {describe_conflicts(conflicts)}."
+    return message
 
-@tool
-def tao_ghi_chu(noi_dung: str, user_id: str, task_tieu_de: str | None = None) -> str:
+@db_tool(write=True, loi="❌ Lỗi khi tạo ghi chú: {e}")
+def tao_ghi_chu(connection: Connection, noi_dung: str, user_id: str, task_tieu_de: str | None = None) -> str:
     """
     Tạo một GHI CHÚ (note) mới.
     Nếu `task_tieu_de` được cung cấp, ghi chú sẽ được liên kết với công việc đó.
     Nếu không, ghi chú sẽ được tạo độc lập.
     """
-    try:
-        task_id = None
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                if task_tieu_de:
-                    task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
-                    if not task_id:
-                        return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để đính kèm ghi chú."
-
-                query = text("""
-                    INSERT INTO notes (user_id, content, task_id) 
-                    VALUES (:user_id, :content, :task_id);
-                """)
-                connection.execute(query, {"user_id": user_id, "content": noi_dung, "task_id": task_id})
-                transaction.commit()
-                
-                if task_id:
-                    return f"✅ Đã tạo ghi chú và đính kèm vào công việc '{task_tieu_de}'."
-                else:
-                    return f"✅ Đã tạo ghi chú mới."
-    except Exception as e:
-        return f"❌ Lỗi khi tạo ghi chú: {e}"
+    task_id = None
+    if task_tieu_de:
+        task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
+        if not task_id:
+            return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để đính kèm ghi chú."
+
+    query = text("""
+        INSERT INTO notes (user_id, content, task_id) 
+        VALUES (:user_id, :content, :task_id);
+    """)
+    connection.execute(query, {"user_id": user_id, "content": noi_dung, "task_id": task_id})
+    
+    if task_id:
+        return f"✅ Đã tạo ghi chú và đính kèm vào công việc '{task_tieu_de}'."
+    else:
+        return f"✅ Đã tạo ghi chú mới."
 
-@tool
-def them_muc_vao_checklist(task_tieu_de: str, noi_dung_muc: str, user_id: str) -> str:
+@db_tool(write=True, loi="❌ Lỗi khi thêm checklist: {e}")
+def them_muc_vao_checklist(connection: Connection, task_tieu_de: str, noi_dung_muc: str, user_id: str) -> str:
     """Thêm một mục (item) mới vào CHECKLIST của một CÔNG VIỆC (task) đã có."""
-    try:
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
-                if not task_id:
-                    return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để thêm checklist."
-                
-                query = text("""
-                    INSERT INTO checklist_items (task_id, content, is_checked)
-                    VALUES (:task_id, :content, FALSE);
-                """)
-                connection.execute(query, {"task_id": task_id, "content": noi_dung_muc})
-                transaction.commit()
-                return f"✅ Đã thêm '{noi_dung_muc}' vào checklist của công việc '{task_tieu_de}'."
-    except Exception as e:
-        return f"❌ Lỗi khi thêm checklist: {e}"
+    task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
+    if not task_id:
+        return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để thêm checklist."
+    
+    query = text("""
+        INSERT INTO checklist_items (task_id, content, is_checked)
+        VALUES (:task_id, :content, FALSE);
+    """)
+    connection.execute(query, {"task_id": task_id, "content": noi_dung_muc})
+    return f"✅ Đã thêm '{noi_dung_muc}' vào checklist của công việc '{task_tieu_de}'."
 
-@tool
-def xoa_task_hoac_lich_trinh(tieu_de: str, user_id: str) -> str:
+@db_tool(write=True, loi="❌ Lỗi khi xóa: {e}", doi_task=True)
+def xoa_task_hoac_lich_trinh(connection: Connection, tieu_de: str, user_id: str) -> str:
     """
     Xóa một CÔNG VIỆC (task) hoặc LỊCH TRÌNH (schedule) dựa trên tiêu đề.
     Do CSDL thiết kế ON DELETE CASCADE, xóa task sẽ tự động xóa schedule, checklist, reminder liên quan.
     """
-    try:
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                task_id = _get_task_id_from_title(connection, user_id, tieu_de)
-                if not task_id:
-                    return f"⚠️ Không tìm thấy '{tieu_de}' để xóa."
-
-                query = text("DELETE FROM tasks WHERE id = :task_id;")
-                result = connection.execute(query, {"task_id": task_id})
-                transaction.commit()
-                
-                if result.rowcount > 0:
-                    return f"🗑️ Đã xóa thành công '{tieu_de}' và tất cả dữ liệu liên quan."
-                else:
-                    return f"⚠️ Không thể xóa '{tieu_de}'."
-    except Exception as e:
-        return f"❌ Lỗi khi xóa: {e}"
+    task_id = _get_task_id_from_title(connection, user_id, tieu_de)
+    if not task_id:
+        return f"⚠️ Không tìm thấy '{tieu_de}' để xóa."
 
-@tool
-def tim_lich_trinh(ngay_bat_dau: str, ngay_ket_thuc: str, user_id: str) -> str:
-    """Tìm các lịch trình trong một khoảng ngày được chỉ định cho một user cụ thể."""
+    query = text("DELETE FROM tasks WHERE id = :task_id;")
+    result = connection.execute(query, {"task_id": task_id})
+    
+    if result.rowcount > 0:
+        _reminders_changed(removed_task_ids=[task_id])
+        return f"🗑️ Đã xóa thành công '{tieu_de}' và tất cả dữ liệu liên quan."
+    else:
+        return f"⚠️ Không thể xóa '{tieu_de}'."
+
+@db_tool(loi="❌ Lỗi khi tìm lịch: {e}", doc_toan_bo=True)
+def tim_lich_trinh(connection: Connection, ngay_bat_dau: str, ngay_ket_thuc: str, user_id: str, trang_sau: str | None = None) -> str:
+    """
+    Tìm các lịch trình trong một khoảng ngày được chỉ định cho một user cụ thể.
+    Nếu kết quả báo còn lịch trình, gọi lại với `trang_sau` là mã được trả về để xem tiếp.
+    """
+    results, next_cursor = find_schedules(connection, user_id, ngay_bat_dau, ngay_ket_thuc,
+                                          cursor=trang_sau, limit=SCHEDULE_PAGE_SIZE)
+    if not results:
+        if trang_sau:
+            return f"📭 Không còn lịch trình nào khác từ {ngay_bat_dau} đến {ngay_ket_thuc}."
+        return f"📭 Bạn không có lịch trình nào từ {ngay_bat_dau} đến {ngay_ket_thuc}."
+    events = [f"- '{row.title}' lúc {row.start_time.strftime('%H:%M ngày %d/%m/%Y')}" for row in results]
+    message = f"🔎 Bạn có {len(events)} lịch trình{' tiếp theo' if trang_sau else ''}:\n" + "\n".join(events)
+    if next_cursor:
+        message += f"\n… Vẫn còn lịch trình khác. Gọi lại `tim_lich_trinh` với trang_sau='{next_cursor}' để xem tiếp."
+    return message
+
+@db_tool(loi="❌ Lỗi khi tìm giờ rảnh: {e}", doc_toan_bo=True)
+def tim_gio_ranh(connection: Connection, ngay_bat_dau: str, ngay_ket_thuc: str, user_id: str, thoi_luong_phut: int = 60) -> str:
+    """
+    Tìm các khoảng thời gian RẢNH (không có lịch trình) dài ít nhất `thoi_luong_phut` phút trong khoảng ngày cho trước.
+    Dùng khi người dùng hỏi 'khi nào tôi rảnh', 'tìm giờ trống để họp'. Ngày theo định dạng 'YYYY-MM-DD'.
+    """
     try:
-        with engine.connect() as connection:
-            query = text("""
-                SELECT t.title, s.start_time 
-                FROM schedules s 
-                JOIN tasks t ON s.task_id = t.id 
-                WHERE s.user_id = :user_id 
-                AND s.start_time::date BETWEEN :start_date AND :end_date 
-                ORDER BY s.start_time LIMIT 10;
-            """)
-            results = connection.execute(query, {"user_id": user_id, "start_date": ngay_bat_dau, "end_date": ngay_ket_thuc}).fetchall()
-            if not results:
-                return f"📭 Bạn không có lịch trình nào từ {ngay_bat_dau} đến {ngay_ket_thuc}."
-            events = [f"- '{row.title}' lúc {row.start_time.strftime('%H:%M ngày %d/%m/%Y')}" for row in results]
-            return f"🔎 Bạn có {len(events)} lịch trình:\n" + "\n".join(events)
-    except Exception as e:
-        return f"❌ Lỗi khi tìm lịch: {e}"
+        start_date, end_date = date.fromisoformat(ngay_bat_dau), date.fromisoformat(ngay_ket_thuc)
+    except ValueError:
+        return f"⚠️ Ngày '{ngay_bat_dau}' – '{ngay_ket_thuc}' không đúng định dạng YYYY-MM-DD."
+    # Cùng giới hạn với GET /free-busy: khoảng dài thì truy vấn sinh quá nhiều ngày / khoảng trống.
+    if end_date < start_date:
+        return f"⚠️ Ngày kết thúc {ngay_ket_thuc} đứng trước ngày bắt đầu {ngay_bat_dau}."
+    if (end_date - start_date).days >= FREE_BUSY_MAX_DAYS:
+        return (f"⚠️ Chỉ tìm giờ rảnh được trong tối đa {FREE_BUSY_MAX_DAYS} ngày mỗi lần "
+                f"({ngay_bat_dau} – {ngay_ket_thuc} dài {(end_date - start_date).days + 1} ngày). "
+                "Hãy hỏi người dùng khoảng ngắn hơn hoặc chia thành nhiều lần tìm.")
+    result = free_busy(connection, user_id, start_date, end_date, min_minutes=thoi_luong_phut,
+                       day_start=FREE_SLOT_DAY_START, day_end=FREE_SLOT_DAY_END)
+    if not result.free:
+        return f"📭 Không có khoảng trống nào dài {thoi_luong_phut} phút từ {ngay_bat_dau} đến {ngay_ket_thuc}."
+    slots = [f"- {start:%H:%M}–{end:%H:%M} ngày {start:%d/%m/%Y}" for start, end in result.free[:10]]
+    more = f"\n(và {len(result.free) - 10} khoảng trống khác)" if len(result.free) > 10 else ""
+    return f"🟢 Các khoảng thời gian rảnh:\n" + "\n".join(slots) + more
 
-@tool
-def doi_lich_trinh(tieu_de_cu: str, thoi_gian_moi: str, user_id: str) -> str:
+@db_tool(write=True, loi="❌ Lỗi khi chỉnh sửa: {e}")
+def doi_lich_trinh(connection: Connection, tieu_de_cu: str, thoi_gian_moi: str, user_id: str) -> str:
     """Chỉnh sửa thời gian của một LỊCH TRÌNH (schedule) đã có."""
-    try:
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                find_query = text("""
-                    SELECT t.id, s.start_time 
-                    FROM tasks t 
-                    JOIN schedules s ON t.id = s.task_id 
-                    WHERE t.user_id = :user_id AND unaccent(t.title) ILIKE unaccent(:title_like)
-                    ORDER BY t.is_completed ASC, s.start_time DESC
-                    LIMIT 1;
-                """)
-                original_task = connection.execute(find_query, {"user_id": user_id, "title_like": f"%{tieu_de_cu}%"}).fetchone()
-                
-                if not original_task:
-                    return f"⚠️ Không tìm thấy lịch trình '{tieu_de_cu}' để dời."
-
-                task_id, old_start_time = original_task.id, original_task.start_time
-                new_start, new_end = parse_natural_time(thoi_gian_moi, base_date=old_start_time)
-
-                update_query = text("UPDATE schedules SET start_time = :start_time, end_time = :end_time WHERE task_id = :task_id;")
-                result = connection.execute(update_query, {"start_time": new_start, "end_time": new_end, "task_id": task_id})
-                transaction.commit()
-
-                if result.rowcount > 0:
-                    return f"✅ Đã dời '{tieu_de_cu}' sang {new_start.strftime('%H:%M %d/%m/%Y')}."
-                else:
-                    return f"⚠️ Không thể cập nhật '{tieu_de_cu}'."
-    except Exception as e:
-        return f"❌ Lỗi khi chỉnh sửa: {e}"
+    original_task = _pick_task(_find_task_candidates(connection, user_id, tieu_de_cu, with_schedule=True), tieu_de_cu)
+    
+    if not original_task:
+        return f"⚠️ Không tìm thấy lịch trình '{tieu_de_cu}' để dời."
+
+    task_id, old_start_time = original_task.id, original_task.start_time
+    new_start, new_end = parse_natural_time(thoi_gian_moi, base_date=old_start_time)
+
+    update_query = text("""
+        UPDATE schedules SET start_time = :start_time, end_time = :end_time WHERE task_id = :task_id
+        RETURNING id, task_id, start_time;
+    """)
+    moved = connection.execute(update_query, {"start_time": new_start, "end_time": new_end, "task_id": task_id}).fetchall()
 
-@tool
-def danh_dau_task_hoan_thanh(tieu_de: str, user_id: str) -> str:
+    if moved:
+        _reminders_changed(schedules=moved)
+        message = f"✅ Đã dời '{tieu_de_cu}' sang {new_start.strftime('%H:%M %d/%m/%Y')}."
+        conflicts = find_conflicts(connection, user_id, new_start, new_end, exclude_task_id=task_id)
+        if conflicts:
+            message += f"\n⚠️ Trùng giờ với: {describe_conflicts(conflicts)}."
+        return message
+    else:
+        return f"⚠️ Không thể cập nhật '{tieu_de_cu}'."
+
+@db_tool(write=True, loi="❌ Lỗi khi đánh dấu hoàn thành: {e}")
+def danh_dau_task_hoan_thanh(connection: Connection, tieu_de: str, user_id: str) -> str:
     """Đánh dấu một CÔNG VIỆC (task) là đã hoàn thành (is_completed = TRUE)."""
-    try:
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                task_id = _get_task_id_from_title(connection, user_id, tieu_de)
-                if not task_id:
-                    return f"🤔 Không tìm thấy công việc nào có tên '{tieu_de}' để đánh dấu."
-
-                query = text("UPDATE tasks SET is_completed = TRUE, status = 'done' WHERE id = :task_id;")
-                result = connection.execute(query, {"task_id": task_id})
-                transaction.commit()
-
-                if result.rowcount > 0:
-                    return f"👍 Rất tốt! Đã đánh dấu '{tieu_de}' là đã hoàn thành."
-                else:
-                    return f"⚠️ Không thể cập nhật '{tieu_de}'."
-    except Exception as e:
-        return f"❌ Lỗi khi đánh dấu hoàn thành: {e}"
+    task_id = _get_task_id_from_title(connection, user_id, tieu_de)
+    if not task_id:
+        return f"🤔 Không tìm thấy công việc nào có tên '{tieu_de}' để đánh dấu."
+
+    query = text("UPDATE tasks SET is_completed = TRUE, status = 'done' WHERE id = :task_id;")
+    result = connection.execute(query, {"task_id": task_id})
 
-@tool
-def gan_the_vao_task(task_tieu_de: str, ten_the: str, user_id: str) -> str:
+    if result.rowcount > 0:
+        _reminders_changed(removed_task_ids=[task_id])
+        return f"👍 Rất tốt! Đã đánh dấu '{tieu_de}' là đã hoàn thành."
+    else:
+        return f"⚠️ Không thể cập nhật '{tieu_de}'."
+
+@db_tool(write=True, loi="❌ Lỗi khi gắn thẻ: {e}")
+def gan_the_vao_task(connection: Connection, task_tieu_de: str, ten_the: str, user_id: str) -> str:
     """Gắn một THẺ (tag) vào một CÔNG VIỆC (task) đã có."""
-    try:
-        with engine.connect() as connection:
-            with connection.begin() as transaction:
-                task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
-                if not task_id:
-                    return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để gắn thẻ."
-
-                # Tìm hoặc tạo thẻ (tag)
-                tag_query = text("""
-                    INSERT INTO tags (user_id, name) 
-                    VALUES (:user_id, :name) 
-                    ON CONFLICT (user_id, name) DO UPDATE SET name = EXCLUDED.name 
-                    RETURNING id;
-                """)
-                tag_id = connection.execute(tag_query, {"user_id": user_id, "name": ten_the}).scalar_one()
-
-                # Gắn thẻ vào task
-                task_tag_query = text("""
-                    INSERT INTO task_tags (task_id, tag_id)
-                    VALUES (:task_id, :tag_id)
-                    ON CONFLICT (task_id, tag_id) DO NOTHING;
-                """)
-                connection.execute(task_tag_query, {"task_id": task_id, "tag_id": tag_id})
-                transaction.commit()
-                return f"✅ Đã gắn thẻ '{ten_the}' cho công việc '{task_tieu_de}'."
-    except Exception as e:
-        return f"❌ Lỗi khi gắn thẻ: {e}"
+    task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
+    if not task_id:
+        return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để gắn thẻ."
+
+    # Tìm hoặc tạo thẻ (tag)
+    tag_query = text("""
+        INSERT INTO tags (user_id, name) 
+        VALUES (:user_id, :name) 
+        ON CONFLICT (user_id, name) DO UPDATE SET name = EXCLUDED.name 
+        RETURNING id;
+    """)
+    tag_id = connection.execute(tag_query, {"user_id": user_id, "name": ten_the}).scalar_one()
 
-@tool
-def tom_tat_tien_do(user_id: str) -> str:
+    # Gắn thẻ vào task
+    task_tag_query = text("""
+        INSERT INTO task_tags (task_id, tag_id)
+        VALUES (:task_id, :tag_id)
+        ON CONFLICT (task_id, tag_id) DO NOTHING;
+    """)
+    connection.execute(task_tag_query, {"task_id": task_id, "tag_id": tag_id})
+    return f"✅ Đã gắn thẻ '{ten_the}' cho công việc '{task_tieu_de}'."
+
+PROGRESS_SUMMARY_QUERY = text("""
+    SELECT c.total_tasks, c.completed_tasks, u.title, u.start_time
+    FROM (
+        SELECT COUNT(*) AS total_tasks, COUNT(*) FILTER (WHERE is_completed) AS completed_tasks
+        FROM tasks WHERE user_id = :user_id
+    ) c
+    LEFT JOIN LATERAL (
+        SELECT t.title, s.start_time
+        FROM schedules s
+        JOIN tasks t ON s.task_id = t.id
+        WHERE s.user_id = :user_id AND s.start_time > NOW() AND t.is_completed = FALSE
+        ORDER BY s.start_time ASC LIMIT 3
+    ) u ON TRUE
+    ORDER BY u.start_time;
+""")
+# Giờ bắt đầu (epoch) của lịch sắp tới sớm nhất, 0 nếu không có; thay đổi đúng lúc danh sách "sắp tới" đổi.
+NEXT_START_QUERY = text("""
+    SELECT COALESCE(EXTRACT(EPOCH FROM MIN(start_time))::bigint, 0)
+    FROM schedules WHERE user_id = :user_id AND start_time > NOW();
+""")
+progress_cache = VersionedCache()
+
+@db_tool(loi="❌ Lỗi khi tóm tắt: {e}", doc_toan_bo=True)
+def tom_tat_tien_do(connection: Connection, user_id: str) -> str:
     """Cung cấp tóm tắt về lịch trình và công việc của người dùng. Dùng khi người dùng hỏi chung chung."""
-    try:
-        with engine.connect() as connection:
-            total_query = text("SELECT COUNT(*) FROM tasks WHERE user_id = :user_id;")
-            total_tasks = connection.execute(total_query, {"user_id": user_id}).scalar_one()
-
-            completed_query = text("SELECT COUNT(*) FROM tasks WHERE user_id = :user_id AND is_completed = TRUE;")
-            completed_tasks = connection.execute(completed_query, {"user_id": user_id}).scalar_one()
-            
-            todo_tasks = total_tasks - completed_tasks
-
-            upcoming_query = text("""
-                SELECT t.title, s.start_time 
-                FROM schedules s 
-                JOIN tasks t ON s.task_id = t.id 
-                WHERE s.user_id = :user_id AND s.start_time > NOW() AND t.is_completed = FALSE 
-                ORDER BY s.start_time ASC LIMIT 3;
-            """)
-            upcoming_results = connection.execute(upcoming_query, {"user_id": user_id}).fetchall()
-
-            summary = f"Tổng quan của bạn:\n- 📊 Bạn có tổng cộng {total_tasks} công việc.\n- ✅ {completed_tasks} đã hoàn thành.\n- ⏳ {todo_tasks} chưa hoàn thành.\n"
-            if upcoming_results:
-                summary += "- 🗓️ Các lịch trình chưa hoàn thành sắp tới:\n" + "\n".join([f"  - '{row.title}' lúc {row.start_time.strftime('%H:%M %d/%m')}" for row in upcoming_results])
-            else:
-                summary += "- 🗓️ Bạn không có lịch trình nào sắp tới hoặc tất cả đều đã hoàn thành."
-            return summary
-    except Exception as e:
-        return f"❌ Lỗi khi tóm tắt: {e}"
+    # Dữ liệu chưa đổi kể từ lần tóm tắt trước => dùng lại, chỉ tốn một lần đọc theo khóa chính.
+    version, pending = get_data_version_state(connection, user_id)
+    cached_summary = progress_cache.get(user_id, version)
+    if cached_summary is not None:
+        return cached_summary
+
+    rows = connection.execute(PROGRESS_SUMMARY_QUERY, {"user_id": user_id}).fetchall()
+    total_tasks, completed_tasks = rows[0].total_tasks, rows[0].completed_tasks
+    todo_tasks = total_tasks - completed_tasks
+    upcoming_results = [row for row in rows if row.title is not None]
+
+    summary = f"Tổng quan của bạn:\n- 📊 Bạn có tổng cộng {total_tasks} công việc.\n- ✅ {completed_tasks} đã hoàn thành.\n- ⏳ {todo_tasks} chưa hoàn thành.\n"
+    if upcoming_results:
+        summary += "- 🗓️ Các lịch trình chưa hoàn thành sắp tới:\n" + "\n".join([f"  - '{row.title}' lúc {row.start_time.strftime('%H:%M %d/%m')}" for row in upcoming_results])
+    else:
+        summary += "- 🗓️ Bạn không có lịch trình nào sắp tới hoặc tất cả đều đã hoàn thành."
+
+    # Bản tóm tắt hết hạn sớm hơn nếu lịch trình sắp tới đầu tiên đã bắt đầu.
+    expires_at = time.time() + SUMMARY_CACHE_TTL
+    if upcoming_results:
+        expires_at = min(expires_at, upcoming_results[0].start_time.timestamp())
+    # Lượt hiện tại đã ghi mà chưa commit => version có thể bị rollback, không lưu để khỏi làm bẩn cache.
+    if not pending:
+        progress_cache.put(user_id, version, summary, expires_at)
+    return summary
+
+# --- 5b. CÔNG CỤ TẠO HÀNG LOẠT (một transaction, INSERT nhiều dòng) ---
+MAX_BATCH_SIZE = 50
+
+class TaskMoi(BaseModel):
+    tieu_de: str
+    mo_ta: str | None = None
+    deadline: str | None = None
+    priority: str | None = None
+
+class LichTrinhMoi(BaseModel):
+    tieu_de: str
+    thoi_gian_bat_dau: str
+    thoi_gian_ket_thuc: str
+
+def _values_rows(row_template: str, count: int) -> str:
+    """Sinh phần VALUES cho INSERT nhiều dòng, ví dụ "(:user_id, :title_0), (:user_id, :title_1)"."""
+    return ", ".join(row_template.format(i=i) for i in range(count))
+
+def _bulk_params(items: list[dict], **shared) -> dict:
+    params = {f"{key}_{i}": value for i, item in enumerate(items) for key, value in item.items()}
+    params.update(shared)
+    return params
+
+def _unique(values: list[str]) -> list[str]:
+    """Bỏ phần tử rỗng / trùng lặp nhưng giữ nguyên thứ tự."""
+    return list(dict.fromkeys(v.strip() for v in values if v and v.strip()))
+
+@db_tool(write=True, loi="❌ Lỗi khi tạo nhiều công việc: {e}", doi_task=True)
+def tao_nhieu_task(connection: Connection, danh_sach: list[TaskMoi], user_id: str) -> str:
+    """
+    Tạo NHIỀU CÔNG VIỆC (task) cùng lúc, trong MỘT lần gọi.
+    Dùng khi người dùng liệt kê nhiều việc (ví dụ: "tạo 5 task cho tuần này: ...").
+    Mỗi phần tử có `tieu_de` và tùy chọn `mo_ta`, `deadline`, `priority` ('low', 'medium', 'high').
+    """
+    if not danh_sach:
+        return "⚠️ Danh sách công việc trống."
+    if len(danh_sach) > MAX_BATCH_SIZE:
+        return f"⚠️ Chỉ tạo được tối đa {MAX_BATCH_SIZE} công việc mỗi lần."
+
+    now = datetime.now()
+    items = [
+        {
+            "title": task.tieu_de,
+            "description": task.mo_ta,
+            "deadline": parse_natural_time(task.deadline, base_date=now)[0] if task.deadline else None,
+            "priority": task.priority if task.priority in ['low', 'medium', 'high'] else None,
+        }
+        for task in danh_sach
+    ]
+    query = text(f"""
+        INSERT INTO tasks (user_id, title, description, deadline, priority, status)
+        VALUES {_values_rows("(:user_id, :title_{i}, :description_{i}, :deadline_{i}, :priority_{i}, 'todo')", len(items))}
+        RETURNING id, title;
+    """)
+    rows = connection.execute(query, _bulk_params(items, user_id=user_id)).fetchall()
+    return f"✅ Đã tạo {len(rows)} công việc mới:\n" + "\n".join(f"- '{row.title}' (ID: {row.id})" for row in rows)
+
+@db_tool(write=True, loi="❌ Lỗi khi tạo nhiều lịch trình: {e}", doi_task=True)
+def tao_nhieu_lich_trinh(connection: Connection, danh_sach: list[LichTrinhMoi], user_id: str) -> str:
+    """
+    Tạo NHIỀU LỊCH TRÌNH (schedule) cùng lúc, trong MỘT lần gọi.
+    Mỗi phần tử có `tieu_de`, `thoi_gian_bat_dau`, `thoi_gian_ket_thuc`; mỗi lịch trình đi kèm một task như `tao_lich_trinh`.
+    """
+    if not danh_sach:
+        return "⚠️ Danh sách lịch trình trống."
+    if len(danh_sach) > MAX_BATCH_SIZE:
+        return f"⚠️ Chỉ tạo được tối đa {MAX_BATCH_SIZE} lịch trình mỗi lần."
+
+    # Một câu lệnh: chèn task theo thứ tự đầu vào (unnest ... WITH ORDINALITY => `idx`) và lấy id từ RETURNING.
+    # RETURNING không kèm `idx`, nhưng id do identity / sequence cấp tăng dần theo thứ tự dòng được chèn
+    # (ORDER BY idx), nên id nhỏ thứ k là task của dòng thứ k; không ghi id tường minh (cột GENERATED ALWAYS).
+    query = text("""
+        WITH input AS MATERIALIZED (
+            SELECT v.idx, v.title, v.start_time, v.end_time
+            FROM unnest(CAST(:titles AS text[]), CAST(:start_times AS timestamptz[]), CAST(:end_times AS timestamptz[]))
+                WITH ORDINALITY AS v(title, start_time, end_time, idx)
+        ), new_tasks AS (
+            INSERT INTO tasks (user_id, title, status)
+            SELECT :user_id, title, 'todo' FROM input ORDER BY idx
+            RETURNING id
+        ), task_ids AS (
+            SELECT id, row_number() OVER (ORDER BY id) AS idx FROM new_tasks
+        ), new_schedules AS (
+            INSERT INTO schedules (user_id, task_id, start_time, end_time)
+            SELECT :user_id, t.id, i.start_time, i.end_time FROM input i JOIN task_ids t ON t.idx = i.idx
+            RETURNING id, task_id, start_time
+        )
+        SELECT t.id, i.title, s.id AS schedule_id, s.start_time
+        FROM new_schedules s JOIN task_ids t ON t.id = s.task_id JOIN input i ON i.idx = t.idx ORDER BY i.idx;
+    """)
+    rows = connection.execute(query, {
+        "user_id": user_id,
+        "titles": [item.tieu_de for item in danh_sach],
+        "start_times": [item.thoi_gian_bat_dau for item in danh_sach],
+        "end_times": [item.thoi_gian_ket_thuc for item in danh_sach],
+    }).fetchall()
+    _reminders_changed(schedules=[(row.schedule_id, row.id, row.start_time) for row in rows])
+    message = f"✅ Đã lên {len(rows)} lịch trình:\n" + "\n".join(
+        f"- '{row.title}' lúc {row.start_time.strftime('%H:%M %d/%m/%Y')}" for row in rows
+    )
+    conflicts = find_task_conflicts(connection, user_id, [row.id for row in rows])
+    if conflicts:
+        message += "\n⚠️ Trùng giờ:\n" + "\n".join(
+            f"- '{row.title}' với {describe_conflicts([row], 'other_title', 'other_start_time', 'other_end_time')}"
+            for row in conflicts
+        )
+    return message
+
+@db_tool(write=True, loi="❌ Lỗi khi thêm checklist: {e}")
+def them_nhieu_muc_vao_checklist(connection: Connection, task_tieu_de: str, danh_sach_muc: list[str], user_id: str) -> str:
+    """
+    Thêm NHIỀU mục vào CHECKLIST của một CÔNG VIỆC (task) đã có, trong MỘT lần gọi.
+    Ví dụ: "thêm sữa, trứng, bánh mì vào checklist đi chợ" => danh_sach_muc = ["sữa", "trứng", "bánh mì"].
+    """
+    contents = _unique(danh_sach_muc)
+    if not contents:
+        return "⚠️ Danh sách mục checklist trống."
+    if len(contents) > MAX_BATCH_SIZE:
+        return f"⚠️ Chỉ thêm được tối đa {MAX_BATCH_SIZE} mục mỗi lần."
+
+    task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
+    if not task_id:
+        return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để thêm checklist."
+
+    query = text(f"""
+        INSERT INTO checklist_items (task_id, content, is_checked)
+        VALUES {_values_rows("(:task_id, :content_{i}, FALSE)", len(contents))};
+    """)
+    connection.execute(query, _bulk_params([{"content": c} for c in contents], task_id=task_id))
+    return f"✅ Đã thêm {len(contents)} mục vào checklist của công việc '{task_tieu_de}': " + ", ".join(f"'{c}'" for c in contents) + "."
+
+@db_tool(write=True, loi="❌ Lỗi khi gắn thẻ: {e}")
+def gan_nhieu_the_vao_task(connection: Connection, task_tieu_de: str, danh_sach_the: list[str], user_id: str) -> str:
+    """Gắn NHIỀU THẺ (tag) vào một CÔNG VIỆC (task) đã có, trong MỘT lần gọi."""
+    names = _unique(danh_sach_the)
+    if not names:
+        return "⚠️ Danh sách thẻ trống."
+    if len(names) > MAX_BATCH_SIZE:
+        return f"⚠️ Chỉ gắn được tối đa {MAX_BATCH_SIZE} thẻ mỗi lần."
+
+    task_id = _get_task_id_from_title(connection, user_id, task_tieu_de)
+    if not task_id:
+        return f"⚠️ Không tìm thấy công việc '{task_tieu_de}' để gắn thẻ."
+
+    query = text(f"""
+        WITH tag_ids AS (
+            INSERT INTO tags (user_id, name)
+            VALUES {_values_rows("(:user_id, :name_{i})", len(names))}
+            ON CONFLICT (user_id, name) DO UPDATE SET name = EXCLUDED.name
+            RETURNING id
+        )
+        INSERT INTO task_tags (task_id, tag_id)
+        SELECT :task_id, id FROM tag_ids
+        ON CONFLICT (task_id, tag_id) DO NOTHING;
+    """)
+    connection.execute(query, _bulk_params([{"name": n} for n in names], user_id=user_id, task_id=task_id))
+    return f"✅ Đã gắn {len(names)} thẻ " + ", ".join(f"'{n}'" for n in names) + f" cho công việc '{task_tieu_de}'."
 
 # --- 6. LẮP RÁP AGENT & BỘ NHỚ ---
 tools_list = [
@@ -447,15 +1073,22 @@ tools_list = [
     gan_the_vao_task,
     xoa_task_hoac_lich_trinh,
     tim_lich_trinh,
+    tim_gio_ranh,
     doi_lich_trinh,
     danh_dau_task_hoan_thanh,
-    tom_tat_tien_do
+    tom_tat_tien_do,
+    tao_nhieu_task,
+    tao_nhieu_lich_trinh,
+    them_nhieu_muc_vao_checklist,
+    gan_nhieu_the_vao_task,
 ]
 
-today = date.today()
-system_prompt_template = f"""
+# Phần đầu prompt (system + schema các tool) giống hệt nhau từng byte ở mọi request, mọi ngày:
+# Gemini tự cache phần tiền tố chung này (implicit context caching), chỉ tính phí / xử lý lại phần sau.
+# Ngày hôm nay và user_id nằm trong tin nhắn của người dùng ở lượt hiện tại (lịch sử chỉ lưu câu gốc).
+system_prompt_template = """
 Bạn là một trợ lý AI quản lý công việc và lịch trình cá nhân tên là Skedule.
-BỐI CẢNH: Hôm nay là {today.strftime('%A, %d/%m/%Y')}.
+BỐI CẢNH: Ngày hôm nay (HÔM NAY) và USER_ID được ghi ở đầu tin nhắn mới nhất của người dùng.
 QUY TẮC NGHIỆP VỤ (Rất quan trọng):
 1.  **Phân biệt rõ ràng:**
     * 'Lịch trình', 'lịch hẹn', 'sự kiện' (ví dụ: "hẹn bác sĩ lúc 5h") => Dùng tool `tao_lich_trinh`. Cần có thời gian bắt đầu và kết thúc.
@@ -467,72 +1100,810 @@ QUY TẮC NGHIỆP VỤ (Rất quan trọng):
     * 'Xóa', 'hủy' (ví dụ: "xóa lịch họp 5h") => Dùng tool `xoa_task_hoac_lich_trinh`.
     * 'Dời', 'đổi' (ví dụ: "dời lịch họp sang 6h") => Dùng tool `doi_lich_trinh`.
     * 'Tìm', 'có gì' (ví dụ: "ngày mai tôi có gì") => Dùng tool `tim_lich_trinh`.
+    * 'Rảnh', 'giờ trống' (ví dụ: "chiều mai tôi rảnh lúc nào") => Dùng tool `tim_gio_ranh`.
+    * Nhiều mục cùng lúc (ví dụ: "thêm sữa, trứng, bánh mì vào checklist đi chợ", "tạo 5 task cho tuần này") => Dùng `tao_nhieu_task`, `tao_nhieu_lich_trinh`, `them_nhieu_muc_vao_checklist`, `gan_nhieu_the_vao_task` với CẢ danh sách trong MỘT lần gọi, không gọi tool đơn lẻ nhiều lần.
 
 2.  **Luôn gọi tool:** Luôn sử dụng các công cụ (tools) để thực hiện các yêu cầu trên.
 3.  **Chào hỏi:** Khi bắt đầu cuộc trò chuyện hoặc khi chào hỏi, hãy luôn thử gọi tool `lay_ten_nguoi_dung` trước tiên.
 4.  **Sử dụng user_id:** Luôn sử dụng `user_id` được cung cấp trong prompt để gọi tool.
-5.  **Định dạng ngày:** Khi gọi tool `tim_lich_trinh`, BẮT BUỘC phải truyền ngày tháng theo định dạng 'YYYY-MM-DD'.
+5.  **Định dạng ngày:** Khi gọi tool `tim_lich_trinh` hoặc `tim_gio_ranh`, BẮT BUỘC phải truyền ngày tháng theo định dạng 'YYYY-MM-DD'.
 6.  **Diễn giải kết quả:** Sau khi tool chạy xong, hãy diễn giải kết quả đó (ví dụ: "✅ Đã tạo...") thành một câu trả lời tự nhiên, đầy đủ và lịch sự cho người dùng.
 """
+_THU = ["Thứ Hai", "Thứ Ba", "Thứ Tư", "Thứ Năm", "Thứ Sáu", "Thứ Bảy", "Chủ Nhật"]
+
+def today_context() -> str:
+    """vd: "Thứ Bảy, 17/10/2026" — tính lại ở mỗi lượt gọi agent, không cố định lúc import."""
+    today = date.today()
+    return f"{_THU[today.weekday()]}, {today:%d/%m/%Y}"
+
 prompt = ChatPromptTemplate.from_messages([
     ("system", system_prompt_template),
     MessagesPlaceholder(variable_name="chat_history"),
-    ("human", "USER_ID: {user_id}\n\nPROMPT: {input}"),
+    ("human", "HÔM NAY: {hom_nay}\nUSER_ID: {user_id}\n\nPROMPT: {input}"),
     MessagesPlaceholder(variable_name="agent_scratchpad"),
-])
-agent = create_tool_calling_agent(llm_brain, tools_list, prompt)
-agent_executor = AgentExecutor(agent=agent, tools=tools_list, verbose=True)
-store = {}
+]).partial(hom_nay=today_context)
+
+@cache
+def get_history_store() -> ChatHistoryStore:
+    history_engine = None
+    if HISTORY_BACKEND == "sql":
+        history_engine = get_engine() if HISTORY_DATABASE_URL == DATABASE_URL else create_engine(HISTORY_DATABASE_URL, pool_pre_ping=True)
+    return ChatHistoryStore(
+        backend=HISTORY_BACKEND,
+        engine=history_engine,
+        policy=WindowPolicy(max_messages=HISTORY_MAX_MESSAGES, max_tokens=HISTORY_MAX_TOKENS),
+        max_sessions=HISTORY_MAX_SESSIONS,
+        idle_ttl=HISTORY_IDLE_TTL,
+    )
+
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-    return store[session_id]
-agent_with_chat_history = RunnableWithMessageHistory(
-    agent_executor, get_session_history,
-    input_messages_key="input",
-    history_messages_key="chat_history",
-    input_messages_and_history_passthrough=True,
-)
+    return get_history_store().get(session_id)
+
+async def purge_history_periodically() -> None:
+    """HISTORY_BACKEND=sql: bảng lịch sử không lớn mãi, phiên hết hạn bị xóa định kỳ (chạy trong luồng riêng)."""
+    store = get_history_store()
+    while True:
+        await asyncio.sleep(HISTORY_PURGE_INTERVAL)
+        try:
+            deleted = await asyncio.to_thread(store.purge_expired)
+            if deleted:
+                logger.info(f"🧹 Đã xóa {deleted} message của các phiên hết hạn")
+        except Exception as e:
+            logger.error(f"Lỗi xóa lịch sử hết hạn: {e}")
+
+agent_with_chat_history = None  # Dựng ở lần gọi agent đầu tiên (hoặc lúc prewarm)
+
+def get_agent_with_chat_history():
+    global agent_with_chat_history
+    if agent_with_chat_history is None:
+        from langchain.agents import AgentExecutor, create_tool_calling_agent
+        from langchain_core.agents import AgentAction
+        from langchain_core.runnables.history import RunnableWithMessageHistory
+
+        class TurnAgentExecutor(AgentExecutor):
+            """Giữ chỗ trong `ToolCallOrdering` cho các tool call của một bước theo thứ tự model gọi, trước khi chúng chạy đồng thời."""
+
+            async def _aiter_next_step(self, *args, **kwargs):
+                async for step in super()._aiter_next_step(*args, **kwargs):
+                    if isinstance(step, AgentAction):
+                        _reserve_tool_call(step)
+                    yield step
+
+            async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+                key = getattr(agent_action, "tool_call_id", None)
+                token = _tool_call_key.set(key)
+                try:
+                    return await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+                finally:
+                    _tool_call_key.reset(token)
+                    if key and (ordering := _turn_tool_order.get()) is not None:
+                        ordering.release(key)
+
+        agent = create_tool_calling_agent(get_llm(), tools_list, prompt)
+        agent_executor = TurnAgentExecutor(agent=agent, tools=tools_list, verbose=AGENT_VERBOSE)
+        agent_with_chat_history = RunnableWithMessageHistory(
+            agent_executor, get_session_history,
+            input_messages_key="input",
+            history_messages_key="chat_history",
+            input_messages_and_history_passthrough=True,
+        )
+    return agent_with_chat_history
+
+intent_router = IntentRouter(min_confidence=FAST_PATH_MIN_CONFIDENCE)
+tools_by_name = {t.name: t for t in tools_list}
+
+def _route_fast_path(user_prompt: str) -> RoutedIntent | None:
+    """Định tuyến nhanh (/chat và /chat/stream); bộ định tuyến lỗi với câu lạ thì để agent xử lý, không trả 500."""
+    if not FAST_PATH_ENABLED:
+        return None
+    try:
+        return intent_router.route(user_prompt)
+    except Exception as e:
+        logger.warning(f"⚠️ Lỗi định tuyến nhanh, chuyển cho agent: {e}")
+        return None
+
+async def _remember_turn(session_id: str, user_prompt: str, ai_text_response: str) -> None:
+    """Ghi một lượt vào lịch sử; bản SQL ghi đồng bộ nên `aadd_messages` chạy nó ngoài event loop."""
+    history = get_session_history(session_id)
+    await history.aadd_messages([HumanMessage(content=user_prompt), AIMessage(content=ai_text_response)])
+
+async def _run_fast_path(intent: RoutedIntent, user_prompt: str, user_id: str, session_id: str) -> str:
+    """Gọi thẳng tool đã được định tuyến và ghi lượt hội thoại vào lịch sử như agent vẫn làm."""
+    tool_output = await tools_by_name[intent.tool_name].ainvoke({**intent.args, "user_id": user_id})
+    await _remember_turn(session_id, user_prompt, tool_output)
+    logger.info(f"⚡ Fast-path {intent.tool_name}({intent.args}), tỉ lệ định tuyến: {intent_router.stats()['routed_rate']:.0%}")
+    return tool_output
+
+# --- 6b. CACHE CÂU TRẢ LỜI CHO CÂU HỎI CHỈ ĐỌC ---
+# Khóa = (user, ngày hôm nay, câu hỏi đã chuẩn hóa); chỉ dùng khi phiên bản dữ liệu của user chưa đổi.
+# Ngày nằm trong khóa vì "hôm nay", "tuần này"... đổi nghĩa qua từng ngày. Các câu như "sắp tới"
+# phụ thuộc giờ hiện tại, nên mỗi mục vẫn chỉ sống tối đa RESPONSE_CACHE_TTL giây.
+READ_ONLY_TOOLS = frozenset(t.name for t in tools_list if not (t.metadata or {}).get("write", True))
+response_cache = VersionedCache(maxsize=RESPONSE_CACHE_MAX_ENTRIES)
+
+class ToolUsageCallback(BaseCallbackHandler):
+    """Ghi lại tên các tool agent đã gọi trong một lượt."""
+
+    def __init__(self):
+        self.tool_names: list[str] = []
+
+    def on_tool_start(self, serialized: dict, input_str: str, **kwargs) -> None:
+        self.tool_names.append((serialized or {}).get("name") or kwargs.get("name", ""))
+
+def _is_read_only_turn(tool_names: list[str]) -> bool:
+    """Lượt có gọi tool và mọi tool đều chỉ đọc (lời chào, hỏi lại... không gọi tool thì không cache)."""
+    return bool(tool_names) and all(name in READ_ONLY_TOOLS for name in tool_names)
+
+async def _get_data_version_async(user_id: str) -> int:
+    async with get_async_engine().connect() as connection:
+        return await connection.run_sync(get_data_version, user_id)
 
 # --- 7. API SERVER ---
-app = FastAPI(title="Skedule AI Agent API", version="3.0.0 (Full SRS)")
+async def prewarm() -> None:
+    """Tạo sẵn những thứ request đầu tiên sẽ cần: kết nối DB trong pool, agent + LLM, STT, TTS, JWT verifier."""
+    async_engine = get_async_engine()
+    connections = [await async_engine.connect() for _ in range(PREWARM_DB_CONNECTIONS)]
+    try:
+        for connection in connections:
+            await connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            await connection.close()  # Trả về pool, vẫn giữ kết nối mở
+    get_agent_with_chat_history()
+    get_history_store()
+    get_speech_recognizer()
+    get_tts_backend()
+    get_jwt_verifier()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global reminder_dispatcher
+    check_config()
+    started = time.perf_counter()
+    if app.state.prewarm:
+        await prewarm()
+    prewarm_seconds = time.perf_counter() - started
+    STARTUP_SECONDS.labels(phase="import").set(_IMPORT_SECONDS)
+    STARTUP_SECONDS.labels(phase="prewarm").set(prewarm_seconds)
+    STARTUP_SECONDS.labels(phase="total").set(time.perf_counter() - _IMPORT_STARTED)
+    logger.info(f"🚀 Khởi động xong: import {_IMPORT_SECONDS * 1000:.0f} ms, "
+                f"prewarm {prewarm_seconds * 1000:.0f} ms ({'bật' if app.state.prewarm else 'tắt'})")
+    if REMINDERS_ENABLED:
+        reminder_dispatcher = ReminderDispatcher(
+            get_async_engine(), lead=timedelta(minutes=REMINDER_LEAD_MINUTES),
+            window=timedelta(minutes=REMINDER_WINDOW_MINUTES), refresh_seconds=REMINDER_REFRESH_SECONDS,
+            max_entries=REMINDER_MAX_ENTRIES, batch_size=REMINDER_BATCH_SIZE,
+        )
+        await reminder_dispatcher.start()
+    history_purge = asyncio.create_task(purge_history_periodically()) if HISTORY_BACKEND == "sql" else None
+    yield
+    if history_purge is not None:
+        history_purge.cancel()
+        await asyncio.gather(history_purge, return_exceptions=True)
+    if reminder_dispatcher is not None:
+        await reminder_dispatcher.stop()
+        reminder_dispatcher = None
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
+
+router = APIRouter()
 
 class ChatResponse(BaseModel):
     user_prompt: str | None = None
     text_response: str
-    audio_base64: str
+    audio_base64: str = ""
+    audio_url: str | None = None  # Chế độ "deferred": GET đường dẫn này để lấy audio
 
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Skedule AI Agent (Full SRS) is running!"}
 
-@app.post("/chat", response_model=ChatResponse)
-async def handle_chat_request(
-    prompt: str | None = Form(None),
-    audio_file: UploadFile | None = File(None),
+async def timing_middleware(request: Request, call_next):
+    """
+    Đo từng request: ghi histogram theo route và gắn header `Server-Timing` (auth, stt, llm, tool, sql, tts).
+    Với /chat/stream, header được gửi trước khi stream xong nên chỉ chứa các công đoạn đã chạy tới lúc đó.
+    """
+    timing = start_request_timing()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(
+        method=request.method, route=getattr(route, "path", "unmatched"), status=str(response.status_code)
+    ).observe(time.perf_counter() - timing.started)
+    response.headers["Server-Timing"] = timing.server_timing()
+    return response
+
+@router.get("/metrics")
+def metrics():
+    """Số đo theo định dạng Prometheus: độ trễ từng công đoạn, token LLM, cache TTS, nhắc lịch..."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+class Khoang(BaseModel):
+    start: datetime
+    end: datetime
+
+class FreeBusyResponse(BaseModel):
+    busy: list[Khoang]
+    free: list[Khoang]
+
+class LichTrung(BaseModel):
+    task_id: int
+    title: str
+    start_time: datetime
+    end_time: datetime | None = None
+
+@router.get("/schedules/free-busy", response_model=FreeBusyResponse)
+async def get_free_busy(
+    start_date: date,
+    end_date: date,
+    min_minutes: int = Query(30, ge=5, le=24 * 60),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Khoảng bận (đã gộp) và khoảng rảnh trong khung giờ mỗi ngày, từ `start_date` đến hết `end_date`."""
+    if end_date < start_date or (end_date - start_date).days >= FREE_BUSY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Khoảng ngày không hợp lệ (tối đa {FREE_BUSY_MAX_DAYS} ngày).")
+    async with get_async_engine().connect() as connection:
+        result = await connection.run_sync(
+            free_busy, user_id, start_date, end_date, min_minutes, FREE_SLOT_DAY_START, FREE_SLOT_DAY_END
+        )
+    return FreeBusyResponse(
+        busy=[Khoang(start=start, end=end) for start, end in result.busy],
+        free=[Khoang(start=start, end=end) for start, end in result.free],
+    )
+
+@router.get("/schedules/conflicts", response_model=list[LichTrung])
+async def get_schedule_conflicts(
+    start: datetime,
+    end: datetime,
+    exclude_task_id: int | None = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Các lịch trình chồng lên khoảng [start, end), để app cảnh báo trước khi lưu / dời lịch."""
+    if end <= start:
+        raise HTTPException(status_code=400, detail="Thời gian kết thúc phải sau thời gian bắt đầu.")
+    async with get_async_engine().connect() as connection:
+        rows = await connection.run_sync(find_conflicts, user_id, start, end, exclude_task_id, 50)
+    return [LichTrung(task_id=row.task_id, title=row.title, start_time=row.start_time, end_time=row.end_time) for row in rows]
+
+# --- 8. REST API CHO ỨNG DỤNG (không qua LLM) ---
+# GET trả ETag theo phiên bản dữ liệu của user (user_data_versions, chỉ tăng bởi trigger của
+# migrations/004, dù tool hay app ghi): client gửi lại `If-None-Match` => 304 chỉ sau một lần đọc theo khóa chính.
+REST_PAGE_SIZE = 50
+
+OPEN_TASKS_QUERY = text("""
+    SELECT id, title, description, deadline, priority, status, is_completed, created_at
+    FROM tasks
+    WHERE user_id = :user_id AND is_completed = :completed
+      AND (created_at, id) < (coalesce(CAST(:after_created AS timestamptz), 'infinity'), coalesce(CAST(:after_id AS bigint), 0))
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit;
+""")
+TASK_DETAIL_QUERY = text("""
+    SELECT t.id, t.title, t.description, t.deadline, t.priority, t.status, t.is_completed, t.created_at,
+           coalesce((SELECT json_agg(json_build_object('id', c.id, 'content', c.content, 'is_checked', c.is_checked) ORDER BY c.id)
+                     FROM checklist_items c WHERE c.task_id = t.id), '[]') AS checklist,
+           coalesce((SELECT json_agg(json_build_object('id', n.id, 'content', n.content) ORDER BY n.id)
+                     FROM notes n WHERE n.task_id = t.id), '[]') AS notes
+    FROM tasks t
+    WHERE t.id = :task_id AND t.user_id = :user_id;
+""")
+
+class LichTrinhItem(BaseModel):
+    id: int
+    task_id: int
+    title: str
+    start_time: datetime
+    end_time: datetime | None = None
+
+class TaskItem(BaseModel):
+    id: int
+    title: str
+    description: str | None = None
+    deadline: datetime | None = None
+    priority: str | None = None
+    status: str | None = None
+    is_completed: bool
+    created_at: datetime
+
+class ChecklistItem(BaseModel):
+    id: int
+    content: str | None = None
+    is_checked: bool | None = None
+
+class NoteItem(BaseModel):
+    id: int
+    content: str | None = None
+
+class TaskDetail(TaskItem):
+    checklist: list[ChecklistItem]
+    notes: list[NoteItem]
+
+class SchedulePage(BaseModel):
+    items: list[LichTrinhItem]
+    next_cursor: str | None = None
+
+class TaskPage(BaseModel):
+    items: list[TaskItem]
+    next_cursor: str | None = None
+
+class SapToiItem(BaseModel):
+    title: str
+    start_time: datetime
+
+class SummaryResponse(BaseModel):
+    total_tasks: int
+    completed_tasks: int
+    todo_tasks: int
+    upcoming: list[SapToiItem]
+
+class NoiDungMoi(BaseModel):
+    content: str
+
+class CapNhatChecklist(BaseModel):
+    is_checked: bool
+
+def _make_etag(version: int | str, request: Request) -> str:
+    digest = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode("utf-8")).hexdigest()[:12]
+    return f'W/"{version}-{digest}"'
+
+def _etag_matches(etag: str, if_none_match: str | None) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or etag.removeprefix("W/") in candidates
+
+async def _conditional_get(request: Request, user_id: str, load, time_key=None) -> Response:
+    """
+    Đọc phiên bản dữ liệu trước: khớp `If-None-Match` => 304, không chạy truy vấn danh sách.
+    `time_key(connection)`: phần của ETag cho nội dung đổi theo thời gian dù dữ liệu không đổi.
+    """
+    async with get_async_engine().connect() as connection:
+        version = await connection.run_sync(get_data_version, user_id)
+        if time_key is not None:
+            version = f"{version}.{await connection.run_sync(time_key)}"
+        etag = _make_etag(version, request)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_matches(etag, request.headers.get("if-none-match")):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        body = await connection.run_sync(load)
+    return JSONResponse(jsonable_encoder(body), headers=headers)
+
+def _schedule_item(row) -> LichTrinhItem:
+    return LichTrinhItem(id=row.id, task_id=row.task_id, title=row.title, start_time=row.start_time, end_time=row.end_time)
+
+@router.get("/schedules", response_model=SchedulePage)
+async def list_schedules(
+    request: Request,
+    start_date: date,
+    end_date: date,
+    cursor: str | None = None,
+    limit: int = Query(REST_PAGE_SIZE, ge=1, le=200),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Lịch trình trong [start_date, end_date], theo thời gian; cùng truy vấn với `tim_lich_trinh`."""
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="Ngày kết thúc phải sau ngày bắt đầu.")
+
+    def load(connection):
+        try:
+            rows, next_cursor = find_schedules(connection, user_id, start_date, end_date, cursor=cursor, limit=limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return SchedulePage(items=[_schedule_item(row) for row in rows], next_cursor=next_cursor)
+
+    return await _conditional_get(request, user_id, load)
+
+@router.get("/tasks", response_model=TaskPage)
+async def list_tasks(
+    request: Request,
+    completed: bool = False,
+    cursor: str | None = None,
+    limit: int = Query(REST_PAGE_SIZE, ge=1, le=200),
     user_id: str = Depends(get_current_user_id)
 ):
-    user_prompt = ""
-    if audio_file:
-        user_prompt = await audio_to_text(audio_file)
+    """Công việc chưa xong (hoặc đã xong với `completed=true`), mới tạo trước."""
+    def load(connection):
+        try:
+            after_created, after_id = decode_cursor(cursor) if cursor else (None, None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        rows = connection.execute(OPEN_TASKS_QUERY, {
+            "user_id": user_id, "completed": completed,
+            "after_created": after_created, "after_id": after_id, "limit": limit + 1,
+        }).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+        return TaskPage(items=[TaskItem(**row._mapping) for row in rows[:limit]], next_cursor=next_cursor)
+
+    return await _conditional_get(request, user_id, load)
+
+@router.get("/tasks/{task_id}", response_model=TaskDetail)
+async def get_task(request: Request, task_id: int, user_id: str = Depends(get_current_user_id)):
+    """Một công việc kèm checklist và ghi chú."""
+    def load(connection):
+        row = connection.execute(TASK_DETAIL_QUERY, {"task_id": task_id, "user_id": user_id}).one_or_none()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy công việc.")
+        return TaskDetail(**row._mapping)
+
+    return await _conditional_get(request, user_id, load)
+
+@router.get("/summary", response_model=SummaryResponse)
+async def get_summary(request: Request, user_id: str = Depends(get_current_user_id)):
+    """Số liệu của `tom_tat_tien_do`: tổng / đã xong / chưa xong và tối đa 3 lịch trình sắp tới."""
+    def load(connection):
+        rows = connection.execute(PROGRESS_SUMMARY_QUERY, {"user_id": user_id}).fetchall()
+        total_tasks, completed_tasks = rows[0].total_tasks, rows[0].completed_tasks
+        return SummaryResponse(
+            total_tasks=total_tasks, completed_tasks=completed_tasks, todo_tasks=total_tasks - completed_tasks,
+            upcoming=[SapToiItem(title=row.title, start_time=row.start_time) for row in rows if row.title is not None],
+        )
+
+    # `upcoming` đổi khi lịch sớm nhất còn ở tương lai trôi qua => giờ bắt đầu của lịch đó nằm trong ETag.
+    def next_start(connection):
+        return connection.execute(NEXT_START_QUERY, {"user_id": user_id}).scalar_one()
+
+    return await _conditional_get(request, user_id, load, time_key=next_start)
+
+# Ghi: mỗi request một transaction, kiểm tra task thuộc về user; trigger tăng phiên bản dữ liệu như với tool ghi.
+COMPLETE_TASK_QUERY = text("""
+    UPDATE tasks SET is_completed = TRUE, status = 'done'
+    WHERE id = :task_id AND user_id = :user_id
+    RETURNING id, title, description, deadline, priority, status, is_completed, created_at;
+""")
+ADD_CHECKLIST_ITEM_QUERY = text("""
+    INSERT INTO checklist_items (task_id, content, is_checked)
+    SELECT id, :content, FALSE FROM tasks WHERE id = :task_id AND user_id = :user_id
+    RETURNING id, content, is_checked;
+""")
+UPDATE_CHECKLIST_ITEM_QUERY = text("""
+    UPDATE checklist_items c SET is_checked = :is_checked
+    FROM tasks t
+    WHERE c.id = :item_id AND t.id = c.task_id AND t.user_id = :user_id
+    RETURNING c.id, c.content, c.is_checked;
+""")
+ADD_NOTE_QUERY = text("""
+    INSERT INTO notes (user_id, task_id, content)
+    SELECT user_id, id, :content FROM tasks WHERE id = :task_id AND user_id = :user_id
+    RETURNING id, content;
+""")
+
+async def _write(user_id: str, query, params: dict, not_found: str):
+    async with get_async_engine().begin() as connection:
+        row = (await connection.execute(query, {**params, "user_id": user_id})).one_or_none()
+        if row is None:
+            raise HTTPException(status_code=404, detail=not_found)
+    return row
+
+@router.post("/tasks/{task_id}/complete", response_model=TaskItem)
+async def complete_task(task_id: int, user_id: str = Depends(get_current_user_id)):
+    row = await _write(user_id, COMPLETE_TASK_QUERY, {"task_id": task_id}, "Không tìm thấy công việc.")
+    _reminders_changed(removed_task_ids=[task_id])
+    return TaskItem(**row._mapping)
+
+@router.post("/tasks/{task_id}/checklist", response_model=ChecklistItem, status_code=201)
+async def add_checklist_item(task_id: int, body: NoiDungMoi, user_id: str = Depends(get_current_user_id)):
+    row = await _write(user_id, ADD_CHECKLIST_ITEM_QUERY, {"task_id": task_id, "content": body.content}, "Không tìm thấy công việc.")
+    return ChecklistItem(**row._mapping)
+
+@router.patch("/checklist/{item_id}", response_model=ChecklistItem)
+async def update_checklist_item(item_id: int, body: CapNhatChecklist, user_id: str = Depends(get_current_user_id)):
+    row = await _write(user_id, UPDATE_CHECKLIST_ITEM_QUERY, {"item_id": item_id, "is_checked": body.is_checked}, "Không tìm thấy mục checklist.")
+    return ChecklistItem(**row._mapping)
+
+@router.post("/tasks/{task_id}/notes", response_model=NoteItem, status_code=201)
+async def add_note(task_id: int, body: NoiDungMoi, user_id: str = Depends(get_current_user_id)):
+    row = await _write(user_id, ADD_NOTE_QUERY, {"task_id": task_id, "content": body.content}, "Không tìm thấy công việc.")
+    return NoteItem(**row._mapping)
+
+# --- 9. CHAT ---
+async def _resolve_user_prompt(prompt: str | None, audio_bytes: bytes | None) -> str:
+    if audio_bytes:
+        return await audio_to_text(audio_bytes)
     elif prompt:
-        user_prompt = prompt
+        return prompt
     else:
         raise HTTPException(status_code=400, detail="Cần cung cấp prompt dạng văn bản hoặc file âm thanh.")
 
+turn_scheduler = FairScheduler(
+    max_llm_concurrency=LLM_MAX_CONCURRENCY, max_queue=TURN_QUEUE_MAX, max_per_user=TURN_QUEUE_MAX_PER_USER,
+)
+
+async def qua_tai_handler(request: Request, exc: QuaTai):
+    REJECTED_REQUESTS.labels(reason=exc.reason).inc()
+    logger.warning(f"🚦 Từ chối request ({exc.reason}), hàng đợi: {turn_scheduler.stats()}")
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Hệ thống đang bận, vui lòng thử lại sau ít phút."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+idempotency_store = IdempotencyStore(
+    ttl=IDEMPOTENCY_TTL,
+    max_bytes=IDEMPOTENCY_CACHE_MB * 1024 * 1024,
+    sizeof=lambda r: len(r.text_response) + len(r.audio_base64) + len(r.user_prompt or ""),
+)
+
+async def _reply_audio(text: str, user_id: str, audio_mode: str) -> dict:
+    if audio_mode == "deferred":
+        return {"audio_url": f"/audio/{background_tts.submit(user_id, text)}"}
+    if audio_mode == "none":
+        return {}
+    return {"audio_base64": await text_to_base64_audio_async(text)}
+
+async def _process_chat(prompt: str | None, audio_bytes: bytes | None, user_id: str,
+                        audio_mode: str = CHAT_AUDIO_MODE) -> ChatResponse:
+    user_prompt = await _resolve_user_prompt(prompt, audio_bytes)
+
     session_id = f"user_{user_id}"
     logger.info(f"📨 Prompt nhận từ user {user_id}: {user_prompt}")
 
-    final_result = agent_with_chat_history.invoke(
-        {"input": user_prompt, "user_id": user_id},
-        config={"configurable": {"session_id": session_id}}
-    )
-    ai_text_response = final_result.get("output", "Lỗi: Không có phản hồi từ agent.")
+    # Các lượt của cùng một phiên chạy lần lượt; lượt cần agent phải chờ tới lượt gọi LLM.
+    async with turn_scheduler.session(user_id, session_id):
+        intent = _route_fast_path(user_prompt)
 
-    ai_audio_base64 = text_to_base64_audio(ai_text_response)
+        # Câu hỏi chỉ đọc đã trả lời trên cùng phiên bản dữ liệu => dùng lại văn bản (audio nằm sẵn trong `tts_cache`).
+        cache_key = version = None
+        if RESPONSE_CACHE_TTL > 0 and (intent is None or intent.tool_name in READ_ONLY_TOOLS):
+            cache_key = (user_id, date.today().isoformat(), normalize_prompt(user_prompt))
+            with span("cache", "response"):
+                version = await _get_data_version_async(user_id)
+                cached = response_cache.get(cache_key, version)
+            if cached is not None:
+                await _remember_turn(session_id, user_prompt, cached)
+                logger.info(f"♻️ Trả lời từ cache (phiên bản dữ liệu {version})")
+                return ChatResponse(
+                    user_prompt=user_prompt if audio_bytes else None,
+                    text_response=cached,
+                    **await _reply_audio(cached, user_id, audio_mode)
+                )
+
+        tool_errors = _start_turn()
+        async with turn_unit_of_work():
+            if intent:
+                ai_text_response = await _run_fast_path(intent, user_prompt, user_id, session_id)
+                tool_names = [intent.tool_name]
+            else:
+                tool_usage = ToolUsageCallback()
+                async with turn_scheduler.llm_slot(user_id):
+                    final_result = await get_agent_with_chat_history().ainvoke(
+                        {"input": user_prompt, "user_id": user_id},
+                        config={"configurable": {"session_id": session_id},
+                                "callbacks": [LLMTimingCallback(current_timing()), tool_usage]}
+                    )
+                ai_text_response = final_result.get("output", "Lỗi: Không có phản hồi từ agent.")
+                tool_names = tool_usage.tool_names
+
+    # Khóa gắn với phiên bản đọc TRƯỚC lượt này: nếu dữ liệu đổi giữa chừng thì mục này không bao giờ khớp.
+    if cache_key is not None and not tool_errors and _is_read_only_turn(tool_names):
+        response_cache.put(cache_key, version, ai_text_response, time.time() + RESPONSE_CACHE_TTL)
 
     return ChatResponse(
-        user_prompt=user_prompt if audio_file else None,
+        user_prompt=user_prompt if audio_bytes else None,
         text_response=ai_text_response,
-        audio_base64=ai_audio_base64
+        **await _reply_audio(ai_text_response, user_id, audio_mode)
     )
+
+@router.post("/chat", response_model=ChatResponse)
+async def handle_chat_request(
+    response: Response,
+    prompt: str | None = Form(None),
+    audio_file: UploadFile | None = File(None),
+    audio: Literal["inline", "deferred", "none"] | None = Form(None),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    `audio=deferred`: trả văn bản ngay kèm `audio_url`, audio được tạo nền (xem GET /audio/{audio_id}).
+
+    Client gửi lại request (mạng chập chờn) nên kèm header `Idempotency-Key` giống lần đầu:
+    request trùng đang chạy sẽ chờ chung kết quả, request trùng đã xong được trả lại ngay
+    (header `Idempotent-Replayed: true`), không chạy lại STT/agent/TTS và không tạo dữ liệu trùng.
+    """
+    turn_scheduler.check_admission(user_id)  # Từ chối sớm, trước khi tốn công nhận dạng giọng nói
+    audio_bytes = await audio_file.read() if audio_file else None
+    audio_mode = audio or CHAT_AUDIO_MODE
+    if not idempotency_key:
+        return await _process_chat(prompt, audio_bytes, user_id, audio_mode)
+
+    try:
+        result, replayed = await idempotency_store.run(
+            (user_id, idempotency_key),
+            request_fingerprint(prompt, audio_bytes, audio_mode),
+            lambda: _process_chat(prompt, audio_bytes, user_id, audio_mode),
+        )
+    except KhoaTrungLapXungDot:
+        raise HTTPException(status_code=422, detail="Idempotency-Key này đã được dùng cho một yêu cầu khác.")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+@router.get("/audio/{audio_id}")
+async def get_audio(audio_id: str, request: Request, user_id: str = Depends(get_current_user_id)):
+    """
+    Audio của một câu trả lời "deferred", chờ nếu còn đang tạo.
+    `Accept: audio/ogg` => Ogg/Opus (nhỏ hơn MP3, khi server có ffmpeg); mặc định audio/mpeg.
+    Hỗ trợ `Range: bytes=...` (206) để tua / tải tiếp, và `If-None-Match` (304).
+    """
+    fmt = negotiate_format(request.headers.get("accept"), background_tts.formats())
+    if fmt is None:
+        raise HTTPException(status_code=406, detail=f"Chỉ hỗ trợ: {', '.join(AUDIO_FORMATS[f] for f in background_tts.formats())}.")
+    etag = f'"{audio_id}-{fmt}"'
+    headers = {"ETag": etag, "Vary": "Accept", "Accept-Ranges": "bytes", "Cache-Control": f"private, max-age={AUDIO_JOB_TTL}"}
+    if _etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        with span("tts", "deferred"):
+            audio_bytes = await background_tts.get(audio_id, user_id, fmt)
+    except AudioKhongTonTai:
+        raise HTTPException(status_code=404, detail="Không tìm thấy audio (có thể đã hết hạn).")
+    except Exception as e:
+        logger.error(f"Lỗi TTS: {e}")
+        raise HTTPException(status_code=503, detail="Chưa tạo được audio, vui lòng thử lại.")
+
+    if_range = request.headers.get("if-range")
+    try:
+        byte_range = parse_range(request.headers.get("range"), len(audio_bytes)) if if_range in (None, etag) else None
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{len(audio_bytes)}"})
+    if byte_range is None:
+        return Response(audio_bytes, media_type=AUDIO_FORMATS[fmt], headers=headers)
+    start, end = byte_range
+    return Response(
+        audio_bytes[start:end + 1], status_code=206, media_type=AUDIO_FORMATS[fmt],
+        headers={**headers, "Content-Range": f"bytes {start}-{end}/{len(audio_bytes)}"},
+    )
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _chunk_text(chunk) -> str:
+    """Lấy phần văn bản từ một AIMessageChunk (Gemini có thể trả về list các phần)."""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+@router.post("/chat/stream")
+async def handle_chat_stream(
+    prompt: str | None = Form(None),
+    audio_file: UploadFile | None = File(None),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Phiên bản stream (Server-Sent Events) của /chat. Các sự kiện gửi về theo thứ tự:
+    - `transcript`: văn bản nhận dạng được (chỉ khi gửi audio)
+    - `tool_start` / `tool_end`: agent đang gọi tool nào
+    - `text`: từng đoạn văn bản của câu trả lời
+    - `audio`: audio base64 của từng câu, đúng thứ tự câu, ngay khi tổng hợp xong
+    - `done`: toàn bộ câu trả lời; `error` nếu có lỗi giữa chừng
+    """
+    turn_scheduler.check_admission(user_id)
+    audio_bytes = await audio_file.read() if audio_file else None
+    user_prompt = await _resolve_user_prompt(prompt, audio_bytes)
+    session_id = f"user_{user_id}"
+    logger.info(f"📨 Prompt (stream) nhận từ user {user_id}: {user_prompt}")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    done_marker = object()
+
+    async def speak(index: int, sentence: str, previous: asyncio.Task | None):
+        audio_base64 = await text_to_base64_audio_async(sentence)
+        if previous:
+            await previous  # Giữ đúng thứ tự câu khi gửi audio
+        await queue.put(_sse("audio", {"index": index, "text": sentence, "audio_base64": audio_base64}))
+
+    async def produce():
+        last_audio: asyncio.Task | None = None
+        sentence_count = 0
+        buffer = ""
+        streamed_text = ""
+        ai_text_response = None
+
+        def schedule_speech(sentences: list[str]):
+            nonlocal last_audio, sentence_count
+            for sentence in sentences:
+                last_audio = asyncio.create_task(speak(sentence_count, sentence, last_audio))
+                sentence_count += 1
+
+        try:
+            if audio_file:
+                await queue.put(_sse("transcript", {"user_prompt": user_prompt}))
+
+            async with turn_scheduler.session(user_id, session_id):
+                _start_turn()
+                async with turn_unit_of_work():
+                    intent = _route_fast_path(user_prompt)
+                    if intent:
+                        await queue.put(_sse("tool_start", {"tool": intent.tool_name}))
+                        ai_text_response = await _run_fast_path(intent, user_prompt, user_id, session_id)
+                        await queue.put(_sse("tool_end", {"tool": intent.tool_name, "output": ai_text_response}))
+                    else:
+                        async with turn_scheduler.llm_slot(user_id):
+                            async for event in get_agent_with_chat_history().astream_events(
+                                {"input": user_prompt, "user_id": user_id},
+                                config={"configurable": {"session_id": session_id}, "callbacks": [LLMTimingCallback(current_timing())]},
+                                version="v2",
+                            ):
+                                kind = event["event"]
+                                if kind == "on_tool_start":
+                                    await queue.put(_sse("tool_start", {"tool": event["name"]}))
+                                elif kind == "on_tool_end":
+                                    await queue.put(_sse("tool_end", {"tool": event["name"], "output": str(event["data"].get("output"))}))
+                                elif kind == "on_chat_model_stream":
+                                    delta = _chunk_text(event["data"]["chunk"])
+                                    if delta:
+                                        streamed_text += delta
+                                        await queue.put(_sse("text", {"delta": delta}))
+                                        sentences, buffer = split_sentences(buffer + delta)
+                                        schedule_speech(sentences)
+                                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                                    output = event["data"].get("output")
+                                    if isinstance(output, dict):
+                                        ai_text_response = output.get("output")
+
+            if not streamed_text and ai_text_response:
+                # Model không stream token: gửi cả câu trả lời một lần rồi đọc từng câu.
+                await queue.put(_sse("text", {"delta": ai_text_response}))
+                buffer = ai_text_response
+            sentences, buffer = split_sentences(buffer)
+            schedule_speech(sentences + ([buffer.strip()] if buffer.strip() else []))
+            if last_audio:
+                await last_audio
+            await queue.put(_sse("done", {
+                "user_prompt": user_prompt if audio_file else None,
+                "text_response": ai_text_response or streamed_text or "Lỗi: Không có phản hồi từ agent.",
+            }))
+        except Exception as e:
+            logger.error(f"Lỗi khi stream phản hồi: {e}")
+            await queue.put(_sse("error", {"detail": str(e)}))
+        finally:
+            await queue.put(done_marker)
+
+    async def event_stream():
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done_marker:
+                    break
+                yield item
+        finally:
+            producer.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class GZipExceptAudio(GZipMiddleware):
+    """MP3/Opus đã nén sẵn; gzip lại chỉ tốn CPU và làm sai `Content-Range` của /audio."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/audio/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+def create_app(llm: BaseChatModel | None = None, prewarm: bool | None = None) -> FastAPI:
+    """
+    Dựng ứng dụng FastAPI. `llm` thay cho Gemini (benchmark, test); `prewarm` mặc định theo biến PREWARM.
+    Import module này không cần biến môi trường hay mạng: client chỉ được tạo khi khởi động / lần dùng đầu.
+    """
+    global llm_brain, agent_with_chat_history
+    if llm is not None:
+        llm_brain = llm
+        agent_with_chat_history = None
+    app = FastAPI(title="Skedule AI Agent API", version="3.0.0 (Full SRS)", lifespan=lifespan)
+    app.state.prewarm = PREWARM if prewarm is None else prewarm
+    # JSON (danh sách, audio base64) được nén gzip; SSE của /chat/stream và audio nhị phân không bị nén.
+    app.add_middleware(GZipExceptAudio, minimum_size=1024)
+    app.middleware("http")(timing_middleware)
+    app.add_exception_handler(QuaTai, qua_tai_handler)
+    app.include_router(router)
+    return app
+
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+app = create_app()
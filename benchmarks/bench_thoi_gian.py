@@ -0,0 +1,99 @@
+# File: benchmarks/bench_thoi_gian.py
+#
+# Đo độ chính xác và tốc độ của bộ phân tích thời gian tiếng Việt trên bộ mẫu có nhãn.
+#   python -m benchmarks.bench_thoi_gian
+#   python -m benchmarks.bench_thoi_gian --repeat 200 --json ket_qua.json
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+from utils.thoi_gian_tu_nhien import _parse, parse_many, parse_time_expression
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "thoi_gian_corpus.jsonl")
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _as_labels(parsed) -> dict:
+    if parsed is None:
+        return {"start": None, "end": None}
+    return {
+        "start": parsed.start.isoformat(timespec="minutes"),
+        "end": parsed.end.isoformat(timespec="minutes"),
+        "first_day": parsed.first_day.isoformat(),
+        "last_day": parsed.last_day.isoformat(),
+    }
+
+
+def check_accuracy(corpus: list[dict]) -> tuple[float, list[dict]]:
+    failures = []
+    for case in corpus:
+        expected = {k: case[k] for k in ("start", "end", "first_day", "last_day") if k in case}
+        got = _as_labels(parse_time_expression(case["expression"], datetime.fromisoformat(case["base"])))
+        if any(got.get(k) != v for k, v in expected.items()):
+            failures.append({"expression": case["expression"], "base": case["base"], "expected": expected, "got": got})
+    return 1 - len(failures) / len(corpus), failures
+
+
+def measure_throughput(corpus: list[dict], repeat: int) -> dict:
+    """Số lượt phân tích mỗi giây: gọi lẻ (không cache), gọi theo lô (không cache) và gọi lặp lại (có cache)."""
+    cases = [(case["expression"], datetime.fromisoformat(case["base"])) for case in corpus]
+    total = len(cases) * repeat
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        _parse.cache_clear()
+        for expression, base in cases:
+            parse_time_expression(expression, base)
+    single = total / (time.perf_counter() - started)
+
+    by_base: dict[datetime, list[str]] = {}
+    for expression, base in cases:
+        by_base.setdefault(base, []).append(expression)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        _parse.cache_clear()
+        for base, expressions in by_base.items():
+            parse_many(expressions, base)
+    batch = total / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for expression, base in cases:
+            parse_time_expression(expression, base)
+    cached = total / (time.perf_counter() - started)
+
+    return {"single_per_sec": round(single), "batch_per_sec": round(batch), "cached_per_sec": round(cached)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark bộ phân tích thời gian tiếng Việt")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    accuracy, failures = check_accuracy(corpus)
+    result = {"cases": len(corpus), "accuracy": round(accuracy, 4), **measure_throughput(corpus, args.repeat)}
+
+    for failure in failures:
+        print(f"✗ {failure['expression']!r} (base {failure['base']}): cần {failure['expected']}, nhận {failure['got']}")
+    print(
+        f"{result['cases']} mẫu | chính xác {result['accuracy']:.1%} | "
+        f"{result['single_per_sec']:,} lượt/s (lẻ), {result['batch_per_sec']:,} lượt/s (lô), "
+        f"{result['cached_per_sec']:,} lượt/s (có cache)"
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({**result, "failures": failures}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# File: benchmarks/du_lieu_mau.py
+#
+# Tạo dữ liệu mẫu cho benchmark trên một Postgres cục bộ (KHÔNG chạy trên CSDL thật).
+#   python -m benchmarks.du_lieu_mau --database-url postgresql://localhost/skedule_bench --users 50 --tasks 400
+
+import argparse
+import glob
+import os
+import uuid
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine.base import Engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+MIGRATIONS_GLOB = os.path.join(ROOT, "migrations", "*.sql")
+USER_NAMESPACE = uuid.UUID("5f1c3a52-6f0e-4b8e-9a4e-3d2b1c0a9f11")
+
+TASK_TITLES = [
+    "Họp nhóm dự án", "Nộp báo cáo tuần", "Đi chợ", "Học tiếng Anh", "Gọi điện cho mẹ", "Tập thể dục",
+    "Làm slide thuyết trình", "Khám răng", "Đọc sách", "Sửa xe máy", "Trả tiền điện", "Ôn thi cuối kỳ",
+]
+
+
+def bench_user_ids(count: int) -> list[str]:
+    """User id cố định theo số thứ tự để các lần chạy benchmark so sánh được với nhau."""
+    return [str(uuid.uuid5(USER_NAMESPACE, f"bench-{i}")) for i in range(count)]
+
+
+def apply_schema(engine: Engine) -> None:
+    with engine.begin() as connection:
+        for path in [SCHEMA_PATH, *sorted(glob.glob(MIGRATIONS_GLOB))]:
+            with open(path, encoding="utf-8") as f:
+                connection.exec_driver_sql(f.read())
+
+
+SEED_USER_QUERY = text("""
+    WITH cleared AS (
+        DELETE FROM tasks WHERE user_id = :user_id
+    ), profile AS (
+        INSERT INTO profiles (id, name) VALUES (:user_id, :name)
+        ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name
+    )
+    INSERT INTO tasks (user_id, title, description, priority, status, is_completed, deadline, created_at)
+    SELECT :user_id,
+           (:titles)[1 + g % cardinality(:titles)] || ' #' || g,
+           'Mô tả mẫu cho công việc ' || g,
+           (ARRAY['low', 'medium', 'high'])[1 + g % 3],
+           CASE WHEN g % 4 = 0 THEN 'done' ELSE 'todo' END,
+           g % 4 = 0,
+           CASE WHEN g % 2 = 0 THEN now() + (g % 30 - 10) * interval '1 day' END,
+           now() - g * interval '1 hour'
+    FROM generate_series(1, :tasks) AS g;
+""")
+
+SEED_RELATED_QUERY = text("""
+    WITH user_tasks AS (
+        SELECT id, row_number() OVER (ORDER BY id) AS n FROM tasks WHERE user_id = :user_id
+    ), new_schedules AS (
+        INSERT INTO schedules (user_id, task_id, start_time, end_time)
+        SELECT :user_id, id,
+               date_trunc('hour', now()) + (n % 60 - 20) * interval '1 day' + (n % 10) * interval '1 hour',
+               date_trunc('hour', now()) + (n % 60 - 20) * interval '1 day' + (n % 10 + 1) * interval '1 hour'
+        FROM user_tasks WHERE n % 3 <> 0
+    ), new_notes AS (
+        INSERT INTO notes (user_id, task_id, content)
+        SELECT :user_id, id, 'Ghi chú mẫu ' || n FROM user_tasks WHERE n % 5 = 0
+    )
+    INSERT INTO checklist_items (task_id, content, is_checked)
+    SELECT id, 'Mục ' || k, k % 2 = 0 FROM user_tasks, generate_series(1, 3) AS k WHERE n % 7 = 0;
+""")
+
+
+def seed(engine: Engine, users: int, tasks_per_user: int) -> list[str]:
+    """Xóa và tạo lại dữ liệu của các user benchmark; trả về danh sách user id."""
+    user_ids = bench_user_ids(users)
+    with engine.begin() as connection:
+        for i, user_id in enumerate(user_ids):
+            params = {"user_id": user_id, "name": f"Bench {i}", "titles": TASK_TITLES, "tasks": tasks_per_user}
+            connection.execute(SEED_USER_QUERY, params)
+            connection.execute(SEED_RELATED_QUERY, {"user_id": user_id})
+        connection.exec_driver_sql("ANALYZE")
+    return user_ids
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tạo dữ liệu mẫu cho benchmark")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"), required=not os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=400, help="Số task mỗi user")
+    parser.add_argument("--skip-schema", action="store_true", help="Không tạo bảng / chạy migrations")
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    if not args.skip_schema:
+        apply_schema(engine)
+    user_ids = seed(engine, args.users, args.tasks)
+    print(f"Đã tạo dữ liệu cho {len(user_ids)} user x {args.tasks} task.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# File: benchmarks/gia_lap.py
+#
+# Các bản giả cho benchmark: LLM theo kịch bản, token Supabase tự ký, STT/TTS giả.
+# Không gọi mạng; độ trễ giả lập chỉnh được để gần với môi trường thật.
+
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+import wave
+from typing import Any, Callable
+
+import jwt
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from utils.xu_ly_am_thanh import PreparedAudio
+
+BENCH_JWT_SECRET = "bench-secret-khong-dung-cho-production-0123456789"
+
+# --- LLM THEO KỊCH BẢN ---
+
+_HUMAN_PROMPT = re.compile(r"USER_ID:\s*(?P<user_id>\S+)\s+PROMPT:\s*(?P<prompt>.*)", re.DOTALL)
+
+# Kịch bản: (mẫu câu, hàm user_id -> danh sách (tên tool, tham số)).
+Script = list[tuple[re.Pattern, Callable[[str], list[tuple[str, dict]]]]]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Thay cho Gemini: lượt đầu gọi các tool theo `script` (khớp câu người dùng),
+    lượt sau (đã có kết quả tool) trả lời bằng kết quả đó. Ước lượng token ~4 ký tự / token,
+    tính cả schema các tool như khi gửi thật.
+    Giả lập cache tiền tố của provider: tiền tố (system_instruction + tools, ghép như Gemini) đã gặp => tính vào `cache_read`.
+    `on_call` (nếu có) nhận số đo prompt của từng lượt gọi.
+    """
+
+    script: Any
+    latency_ms: float = 0.0
+    tools: list = []
+    on_call: Callable[[dict], None] | None = None
+    seen_prefixes: set = set()
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-bench"
+
+    def bind_tools(self, tools, **kwargs):
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+
+        return self.model_copy(update={"tools": [convert_to_openai_tool(tool) for tool in tools]})
+
+    def _measure_prompt(self, messages) -> tuple[int, int]:
+        # Ghép request như langchain_google_genai: SystemMessage đầu tiên thành `system_instruction`,
+        # các SystemMessage sau đó cũng bị nối vào đó. Tiền tố được cache = system_instruction + tools.
+        system = [m for m in messages if isinstance(m, SystemMessage)]
+        head = system[0] if system and messages[0] is system[0] else None
+        instruction = "".join(str(m.content) for m in system) if head else ""
+        prefix = instruction + json.dumps(self.tools, ensure_ascii=False, sort_keys=True)
+        prefix_tokens = len(prefix) // 4
+        input_tokens = prefix_tokens + sum(len(str(m.content)) for m in messages if not isinstance(m, SystemMessage)) // 4
+        digest = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:12]
+        cached_tokens = prefix_tokens if digest in self.seen_prefixes else 0
+        self.seen_prefixes.add(digest)
+        if self.on_call is not None:
+            self.on_call({
+                "input_tokens": input_tokens, "prefix_tokens": prefix_tokens, "cached_tokens": cached_tokens,
+                "prefix": digest, "first_call": not isinstance(messages[-1], ToolMessage),
+            })
+        return input_tokens, cached_tokens
+
+    def _respond(self, messages) -> ChatResult:
+        last = messages[-1]
+        input_tokens, cached_tokens = self._measure_prompt(messages)
+        if isinstance(last, ToolMessage):
+            tool_outputs = [str(m.content) for m in messages if isinstance(m, ToolMessage)]
+            message = AIMessage(content="Dạ, " + " ".join(tool_outputs)[:400])
+        else:
+            human = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+            match = _HUMAN_PROMPT.search(str(human.content)) if human else None
+            calls = []
+            if match:
+                for pattern, build in self.script:
+                    if pattern.search(match.group("prompt")):
+                        calls = build(match.group("user_id"))
+                        break
+            if calls:
+                message = AIMessage(content="", tool_calls=[
+                    {"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:8]}"} for name, args in calls
+                ])
+            else:
+                message = AIMessage(content="Xin chào, tôi có thể giúp gì cho bạn?")
+        output_tokens = max(len(json.dumps(message.tool_calls, ensure_ascii=False) if message.tool_calls else message.content) // 4, 1)
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                  "total_tokens": input_tokens + output_tokens,
+                                  "input_token_details": {"cache_read": cached_tokens}}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._respond(messages)
+
+# --- SUPABASE AUTH GIẢ ---
+
+
+def make_token(user_id: str, secret: str = BENCH_JWT_SECRET, ttl: int = 3600) -> str:
+    """JWT HS256 giống token Supabase; app kiểm tra cục bộ bằng SUPABASE_JWT_SECRET."""
+    now = int(time.time())
+    return jwt.encode({"sub": user_id, "aud": "authenticated", "role": "authenticated", "iat": now, "exp": now + ttl},
+                      secret, algorithm="HS256")
+
+# --- STT / TTS GIẢ ---
+
+
+class StubRecognizer:
+    """Trả lần lượt các câu trong `transcripts`, sau `latency_ms` (giả lập Google STT)."""
+
+    def __init__(self, transcripts: list[str], latency_ms: float = 0.0):
+        self._transcripts = itertools.cycle(transcripts)
+        self._lock = threading.Lock()
+        self.latency_ms = latency_ms
+
+    def recognize(self, audio: PreparedAudio, language: str) -> str:
+        time.sleep(self.latency_ms / 1000)
+        with self._lock:
+            return next(self._transcripts)
+
+
+class StubTTS:
+    """Cùng giao diện với `gTTS` (khởi tạo + `write_to_fp`), sinh vài KB dữ liệu giả sau `latency_ms`."""
+
+    latency_ms = 0.0
+
+    def __init__(self, text: str, lang: str = "vi", slow: bool = False):
+        self.text = text
+
+    def write_to_fp(self, fp) -> None:
+        time.sleep(self.latency_ms / 1000)
+        digest = hashlib.sha256(self.text.encode("utf-8")).digest()
+        fp.write(b"ID3" + digest * (len(self.text) // 8 + 16))
+
+
+def make_speech_wav(seconds: float = 2.0, sample_rate: int = 44_100) -> bytes:
+    """WAV stereo 44.1 kHz: khoảng lặng + tiếng + khoảng lặng, để đi qua đủ bước giải mã/resample/VAD."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sample_rate * seconds * 0.5)) / sample_rate
+    voice = (np.sin(2 * np.pi * 220 * t) * np.sin(2 * np.pi * 3 * t) * 9000).astype(np.int16)
+    silence = (rng.standard_normal(int(sample_rate * seconds * 0.25)) * 20).astype(np.int16)
+    mono = np.concatenate([silence, voice, silence])
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.repeat(mono, 2).tobytes())
+    return buffer.getvalue()
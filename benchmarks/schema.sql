@@ -0,0 +1,61 @@
+-- File: benchmarks/schema.sql
+-- Lược đồ tối thiểu (giống các bảng Supabase mà agent dùng) để chạy benchmark trên Postgres cục bộ.
+-- Sau file này, du_lieu_mau.py chạy tiếp các file trong migrations/.
+
+CREATE TABLE IF NOT EXISTS profiles (
+    id uuid PRIMARY KEY,
+    name text
+);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    id bigserial PRIMARY KEY,
+    user_id uuid NOT NULL,
+    title text NOT NULL,
+    description text,
+    deadline timestamptz,
+    priority text,
+    status text DEFAULT 'todo',
+    is_completed boolean NOT NULL DEFAULT false,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS schedules (
+    id bigserial PRIMARY KEY,
+    user_id uuid NOT NULL,
+    task_id bigint REFERENCES tasks(id) ON DELETE CASCADE,
+    start_time timestamptz NOT NULL,
+    end_time timestamptz
+);
+
+CREATE TABLE IF NOT EXISTS notes (
+    id bigserial PRIMARY KEY,
+    user_id uuid NOT NULL,
+    task_id bigint REFERENCES tasks(id) ON DELETE CASCADE,
+    content text
+);
+
+CREATE TABLE IF NOT EXISTS checklist_items (
+    id bigserial PRIMARY KEY,
+    task_id bigint REFERENCES tasks(id) ON DELETE CASCADE,
+    content text,
+    is_checked boolean DEFAULT false
+);
+
+CREATE TABLE IF NOT EXISTS tags (
+    id bigserial PRIMARY KEY,
+    user_id uuid NOT NULL,
+    name text NOT NULL,
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS task_tags (
+    task_id bigint REFERENCES tasks(id) ON DELETE CASCADE,
+    tag_id bigint REFERENCES tags(id) ON DELETE CASCADE,
+    PRIMARY KEY (task_id, tag_id)
+);
+
+CREATE TABLE IF NOT EXISTS reminders (
+    id bigserial PRIMARY KEY,
+    task_id bigint REFERENCES tasks(id) ON DELETE CASCADE,
+    remind_at timestamptz
+);
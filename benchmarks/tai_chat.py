@@ -0,0 +1,342 @@
+# File: benchmarks/tai_chat.py
+#
+# Load test /chat và /chat/stream hoàn toàn offline: app FastAPI chạy trong tiến trình, LLM/STT/TTS giả,
+# Supabase Auth thay bằng JWT tự ký, dữ liệu nằm trong một Postgres cục bộ đã được seed.
+#   python -m benchmarks.tai_chat --database-url postgresql://localhost/skedule_bench --concurrency 16 --requests 1000
+#   python -m benchmarks.tai_chat ... --baseline benchmarks/results/baseline.json   (exit 1 nếu p95 tệ hơn ngưỡng)
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# --- KỊCH BẢN TẢI ---
+
+
+@dataclass
+class Scenario:
+    endpoint: str
+    prompt: str | None = None
+    audio: bool = False
+    weight: int = 1
+
+
+SCENARIOS = {
+    "fast_tim": Scenario("/chat", "mai tôi có gì", weight=3),
+    "agent_tim": Scenario("/chat", "liệt kê các lịch hẹn sắp tới", weight=2),
+    "agent_tao_lich": Scenario("/chat", "đặt lịch họp bench", weight=1),
+    "agent_tom_tat": Scenario("/chat", "dạo này công việc của tôi thế nào", weight=2),
+    "agent_chao": Scenario("/chat", "xin chào", weight=1),
+    "agent_doi": Scenario("/chat", "dời lịch đọc sách #5 sang 3 ngày sau", weight=1),
+    "audio": Scenario("/chat", audio=True, weight=1),
+    "stream": Scenario("/chat/stream", "liệt kê các lịch hẹn sắp tới", weight=1),
+}
+AUDIO_TRANSCRIPTS = ["mai tôi có gì", "dạo này công việc của tôi thế nào"]
+
+
+def build_script():
+    """Các tool mà LLM giả sẽ gọi cho từng câu trong SCENARIOS."""
+    def upcoming(user_id):
+        today = date.today()
+        return [("tim_lich_trinh", {"ngay_bat_dau": today.isoformat(), "ngay_ket_thuc": (today + timedelta(days=30)).isoformat(), "user_id": user_id})]
+
+    def new_schedule(user_id):
+        start = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1, minutes=random.randrange(0, 600))
+        return [("tao_lich_trinh", {"tieu_de": f"Họp bench {start:%H%M%S}", "thoi_gian_bat_dau": start.isoformat(),
+                                    "thoi_gian_ket_thuc": (start + timedelta(hours=1)).isoformat(), "user_id": user_id})]
+
+    return [
+        (re.compile(r"lịch hẹn sắp tới"), upcoming),
+        (re.compile(r"đặt lịch họp"), new_schedule),
+        (re.compile(r"công việc của tôi thế nào"), lambda user_id: [("tom_tat_tien_do", {"user_id": user_id})]),
+        (re.compile(r"xin chào"), lambda user_id: [("lay_ten_nguoi_dung", {"user_id": user_id})]),
+        (re.compile(r"dời lịch"), lambda user_id: [("doi_lich_trinh", {"tieu_de_cu": "đọc sách #5", "thoi_gian_moi": "3 ngày sau", "user_id": user_id})]),
+    ]
+
+
+def parse_mix(mix: str | None) -> dict[str, int]:
+    if not mix:
+        return {name: s.weight for name, s in SCENARIOS.items()}
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Kịch bản không tồn tại: {name} (có: {', '.join(SCENARIOS)})")
+        weights[name] = int(weight or 1)
+    return weights
+
+# --- THỐNG KÊ ---
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: list[float], elapsed: float | None = None, errors: int = 0) -> dict:
+    summary = {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+    }
+    if elapsed:
+        summary["rps"] = round(len(samples) / elapsed, 2)
+        summary["errors"] = errors
+    return summary
+
+
+class Collector:
+    def __init__(self):
+        self.active = False
+        self.requests: dict[str, list[float]] = defaultdict(list)
+        self.scenarios: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.stages: dict[str, list[float]] = defaultdict(list)
+        self.prompt_calls: list[dict] = []
+
+    def observe_stage(self, stage: str, name: str, seconds: float) -> None:
+        if self.active:
+            self.stages[f"{stage}:{name}" if name else stage].append(seconds)
+
+    def observe_prompt(self, call: dict) -> None:
+        if self.active:
+            self.prompt_calls.append(call)
+
+
+def summarize_prompts(calls: list[dict]) -> dict:
+    """Token prompt (ước lượng) mỗi lượt gọi LLM và mỗi lượt agent; `prefixes` = 1 nghĩa là tiền tố ổn định từng byte."""
+    if not calls:
+        return {}
+    turns = sum(call["first_call"] for call in calls) or 1
+    input_tokens = [call["input_tokens"] for call in calls]
+    total_input = sum(input_tokens)
+    total_cached = sum(call["cached_tokens"] for call in calls)
+    return {
+        "llm_calls": len(calls),
+        "agent_turns": turns,
+        "calls_per_turn": round(len(calls) / turns, 2),
+        "input_tokens_per_call_p50": int(percentile(input_tokens, 50)),
+        "input_tokens_per_call_p95": int(percentile(input_tokens, 95)),
+        "input_tokens_per_turn": round(total_input / turns, 1),
+        "uncached_tokens_per_turn": round((total_input - total_cached) / turns, 1),
+        "prefix_tokens": max(call["prefix_tokens"] for call in calls),
+        "cached_share": round(total_cached / total_input, 3) if total_input else 0.0,
+        "prefixes": len({call["prefix"] for call in calls}),
+    }
+
+# --- KHỞI ĐỘNG APP VỚI CÁC BẢN GIẢ ---
+
+
+def boot_app(args, on_llm_call=None):
+    """Đặt biến môi trường trước khi import app, rồi dựng app với LLM / STT / TTS giả."""
+    from benchmarks.gia_lap import BENCH_JWT_SECRET, ScriptedChatModel, StubRecognizer, StubTTS
+    from utils.xu_ly_am_thanh import register_recognizer
+
+    os.environ.update({
+        "DATABASE_URL": args.database_url,
+        "GEMINI_API_KEY": "bench",
+        "SUPABASE_URL": "http://127.0.0.1:9",
+        "SUPABASE_ANON_KEY": "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.bench",
+        "SUPABASE_JWT_SECRET": BENCH_JWT_SECRET,
+        "AUTH_MODE": "local",
+        "STT_BACKEND": "bench",
+        "AUDIO_DECODE_WORKERS": str(args.decode_workers),
+        "AGENT_VERBOSE": "0",
+    })
+    register_recognizer("bench", lambda: StubRecognizer(AUDIO_TRANSCRIPTS, latency_ms=args.stt_latency_ms))
+    StubTTS.latency_ms = args.tts_latency_ms
+
+    import agent_lich_trinh as app_module
+
+    app_module.tts_backend = StubTTS
+    llm = ScriptedChatModel(script=build_script(), latency_ms=args.llm_latency_ms, on_call=on_llm_call)
+    return app_module.create_app(llm=llm)
+
+# --- CHẠY TẢI ---
+
+
+async def run_load(app, tokens: list[str], weights: dict[str, int], args, collector: Collector) -> float:
+    import httpx
+    from benchmarks.gia_lap import make_speech_wav
+
+    rng = random.Random(args.seed)
+    names = list(weights)
+    audio_bytes = make_speech_wav()
+    total = args.warmup + args.requests
+    issued = 0
+
+    async def one_request(client: httpx.AsyncClient, name: str, token: str, measured: bool) -> None:
+        scenario = SCENARIOS[name]
+        headers = {"Authorization": f"Bearer {token}"}
+        data = {"prompt": scenario.prompt} if scenario.prompt else {}
+        if scenario.endpoint == "/chat":
+            data["audio"] = args.audio_mode
+        files = {"audio_file": ("bench.wav", audio_bytes, "audio/wav")} if scenario.audio else None
+        started = time.perf_counter()
+        ok = True
+        try:
+            # ASGITransport đọc hết body trước khi trả về, nên /chat/stream được đo đến sự kiện cuối cùng
+            response = await client.post(scenario.endpoint, data=data, files=files, headers=headers)
+            ok = response.status_code == 200
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        if measured:
+            collector.requests[scenario.endpoint].append(elapsed)
+            collector.scenarios[name].append(elapsed)
+            if not ok:
+                collector.errors[scenario.endpoint] += 1
+
+    async def worker(client: httpx.AsyncClient, worker_index: int) -> None:
+        nonlocal issued
+        while issued < total:
+            issued += 1
+            measured = issued > args.warmup
+            collector.active = collector.active or measured
+            name = rng.choices(names, weights=[weights[n] for n in names])[0]
+            await one_request(client, name, tokens[(issued + worker_index) % len(tokens)], measured)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client, i) for i in range(args.concurrency)))
+        return time.perf_counter() - started
+
+# --- KẾT QUẢ & SO SÁNH BASELINE ---
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def build_report(collector: Collector, elapsed: float, args) -> dict:
+    measured = sum(len(v) for v in collector.requests.values())
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "concurrency": args.concurrency,
+            "requests": measured,
+            "elapsed_s": round(elapsed, 2),
+            "throughput_rps": round(measured / elapsed, 2) if elapsed else 0.0,
+            "llm_latency_ms": args.llm_latency_ms,
+            "tts_latency_ms": args.tts_latency_ms,
+            "stt_latency_ms": args.stt_latency_ms,
+            "users": args.users,
+            "tasks_per_user": args.tasks,
+        },
+        "endpoints": {k: summarize(v, elapsed, collector.errors[k]) for k, v in sorted(collector.requests.items())},
+        "scenarios": {k: summarize(v, elapsed) for k, v in sorted(collector.scenarios.items())},
+        "stages": {k: summarize(v) for k, v in sorted(collector.stages.items())},
+        "prompt": summarize_prompts(collector.prompt_calls),
+    }
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Các chỉ số p95 tệ hơn baseline quá `max_regression` (bỏ qua chênh lệch < 1 ms)."""
+    regressions = []
+    for section in ("endpoints", "scenarios", "stages"):
+        for key, current in report[section].items():
+            old = baseline.get(section, {}).get(key)
+            if not old:
+                continue
+            if current["p95_ms"] > old["p95_ms"] * (1 + max_regression) and current["p95_ms"] - old["p95_ms"] > 1:
+                regressions.append(f"{section}/{key}: p95 {old['p95_ms']} ms -> {current['p95_ms']} ms")
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    meta = report["meta"]
+    print(f"\n{meta['requests']} request, {meta['concurrency']} luồng, {meta['elapsed_s']} s, {meta['throughput_rps']} req/s")
+    for section in ("endpoints", "scenarios", "stages"):
+        print(f"\n{section:<32} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for key, s in report[section].items():
+            print(f"{key:<32} {s['count']:>6} {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9}")
+    if report.get("prompt"):
+        print("\nprompt (token ước lượng)")
+        for key, value in report["prompt"].items():
+            print(f"{key:<32} {value:>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test offline cho /chat")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"), required=not os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=200, help="Số task mỗi user khi seed")
+    parser.add_argument("--no-seed", action="store_true", help="Dùng dữ liệu đã có, không seed lại")
+    parser.add_argument("--skip-schema", action="store_true", help="Không tạo bảng / chạy migrations trước khi seed")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--mix", help="Trọng số kịch bản, vd 'fast_tim=3,agent_tim=1,audio=1'")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--tts-latency-ms", type=float, default=150)
+    parser.add_argument("--stt-latency-ms", type=float, default=200)
+    parser.add_argument("--audio-mode", choices=["inline", "deferred", "none"], default="inline",
+                        help="Field `audio` của /chat (deferred: chỉ đo phần văn bản)")
+    parser.add_argument("--decode-workers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=RESULTS_DIR, help="Thư mục lưu kết quả JSON")
+    parser.add_argument("--baseline", help="File kết quả cũ để so sánh p95")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Cho phép p95 chậm hơn tối đa (tỉ lệ)")
+    parser.add_argument("--save-baseline", action="store_true", help="Ghi kết quả lần này thành baseline.json")
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+
+    from benchmarks.du_lieu_mau import apply_schema, bench_user_ids, seed
+    from benchmarks.gia_lap import make_token
+    from utils.do_thoi_gian import add_observer
+
+    if not args.no_seed:
+        seed_engine = create_engine(args.database_url)
+        if not args.skip_schema:
+            apply_schema(seed_engine)
+        seed(seed_engine, args.users, args.tasks)
+        seed_engine.dispose()
+
+    collector = Collector()
+    app = boot_app(args, on_llm_call=collector.observe_prompt)
+    add_observer(collector.observe_stage)
+    tokens = [make_token(user_id) for user_id in bench_user_ids(args.users)]
+
+    elapsed = asyncio.run(run_load(app, tokens, parse_mix(args.mix), args, collector))
+    report = build_report(collector, elapsed, args)
+    print_report(report)
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả: {path}")
+    if args.save_baseline:
+        with open(os.path.join(args.out, "baseline.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"⚠️ Chậm hơn baseline: {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
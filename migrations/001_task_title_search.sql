@@ -0,0 +1,37 @@
+-- File: migrations/001_task_title_search.sql
+-- Tìm task theo tiêu đề bằng index thay vì quét toàn bộ task của người dùng.
+-- Chạy một lần trên CSDL Supabase (SQL editor hoặc psql).
+
+-- Supabase đặt extension trong schema `extensions`; CSDL cài unaccent từ trước (vd ở `public`) giữ nguyên chỗ cũ.
+CREATE SCHEMA IF NOT EXISTS extensions;
+CREATE EXTENSION IF NOT EXISTS unaccent WITH SCHEMA extensions;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- unaccent() chỉ là STABLE nên không dùng được cho cột sinh tự động / index.
+-- Bọc lại với từ điển cố định để có hàm IMMUTABLE; schema của unaccent lấy từ pg_extension.
+DO $$
+DECLARE
+    ext_schema text;
+BEGIN
+    SELECT quote_ident(n.nspname) INTO ext_schema
+    FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+    WHERE e.extname = 'unaccent';
+    EXECUTE 'CREATE OR REPLACE FUNCTION public.immutable_unaccent(text)'
+         || ' RETURNS text LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT'
+         || ' AS $f$ SELECT ' || ext_schema || '.unaccent(' || quote_literal(ext_schema || '.unaccent')
+         || '::regdictionary, $1) $f$';
+END;
+$$;
+
+-- Tiêu đề đã chuẩn hóa: chữ thường, bỏ dấu tiếng Việt.
+ALTER TABLE public.tasks
+    ADD COLUMN IF NOT EXISTS title_search text
+    GENERATED ALWAYS AS (lower(public.immutable_unaccent(title))) STORED;
+
+-- Khớp chính xác / tiền tố theo từng người dùng.
+CREATE INDEX IF NOT EXISTS tasks_user_title_search_idx
+    ON public.tasks (user_id, title_search text_pattern_ops);
+
+-- Khớp "chứa" (LIKE '%...%') và khớp gần đúng (toán tử %) bằng trigram.
+CREATE INDEX IF NOT EXISTS tasks_title_search_trgm_idx
+    ON public.tasks USING gin (title_search gin_trgm_ops);
@@ -0,0 +1,13 @@
+-- File: migrations/002_user_data_versions.sql
+-- Phiên bản dữ liệu theo người dùng: `version` được tăng bằng trigger ở migrations/004 trong cùng
+-- transaction với câu lệnh ghi (tool của agent hay app Flutter đều vậy); các cache (tóm tắt tiến độ, ...) so sánh version để biết dữ liệu đã đổi hay chưa.
+
+CREATE TABLE IF NOT EXISTS public.user_data_versions (
+    user_id    uuid PRIMARY KEY,
+    version    bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Đếm tổng / đã hoàn thành chỉ cần quét index (index-only scan).
+CREATE INDEX IF NOT EXISTS tasks_user_completed_idx
+    ON public.tasks (user_id, is_completed);
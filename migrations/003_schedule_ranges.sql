@@ -0,0 +1,20 @@
+-- File: migrations/003_schedule_ranges.sql
+-- Tìm lịch theo khoảng thời gian bằng index, phân trang keyset, phát hiện trùng giờ và tìm giờ rảnh.
+
+-- Khoảng thời gian [start_time, start_time + 1h) khi chưa có giờ kết thúc
+-- (cùng mặc định với parse_natural_time); giờ kết thúc trước giờ bắt đầu coi như khoảng rỗng.
+CREATE OR REPLACE FUNCTION public.schedule_period(start_time timestamptz, end_time timestamptz)
+RETURNS tstzrange
+LANGUAGE sql IMMUTABLE PARALLEL SAFE
+AS $$
+    SELECT tstzrange(start_time, greatest(coalesce(end_time, start_time + interval '1 hour'), start_time), '[)')
+$$;
+
+-- Lọc nửa mở `start_time >= :from AND start_time < :to` và phân trang theo (start_time, id).
+CREATE INDEX IF NOT EXISTS schedules_user_start_idx
+    ON public.schedules (user_id, start_time, id);
+
+-- Index khoảng (GiST) cho toán tử chồng lấn `&&`: tìm lịch trùng giờ / giờ bận không phải quét cả lịch.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+CREATE INDEX IF NOT EXISTS schedules_user_period_idx
+    ON public.schedules USING gist (user_id, public.schedule_period(start_time, end_time));
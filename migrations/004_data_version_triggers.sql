@@ -0,0 +1,82 @@
+-- File: migrations/004_data_version_triggers.sql
+-- Ứng dụng Flutter cũng ghi thẳng vào Supabase (không qua tool của agent), nên phiên bản dữ liệu
+-- (user_data_versions) được tăng bằng trigger ở mức câu lệnh: ETag của REST API và các cache theo
+-- phiên bản luôn đổi khi dữ liệu đổi, dù ai ghi.
+-- Hàm trigger chạy với quyền của chủ sở hữu (SECURITY DEFINER, search_path cố định), nên client
+-- Supabase (anon / authenticated) không cần và không được có quyền ghi trực tiếp vào user_data_versions:
+-- tự đặt lại / hạ version sẽ làm ETag và cache theo phiên bản trả dữ liệu cũ.
+
+CREATE OR REPLACE FUNCTION public.bump_user_data_version()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    -- TG_ARGV[0] = 'task_id': bảng không có user_id, lấy user qua task.
+    IF TG_OP = 'DELETE' THEN
+        IF TG_ARGV[0] = 'task_id' THEN
+            INSERT INTO public.user_data_versions AS v (user_id, version, updated_at)
+            SELECT DISTINCT t.user_id, 1, now() FROM old_rows r JOIN public.tasks t ON t.id = r.task_id
+            ON CONFLICT (user_id) DO UPDATE SET version = v.version + 1, updated_at = now();
+        ELSE
+            INSERT INTO public.user_data_versions AS v (user_id, version, updated_at)
+            SELECT DISTINCT r.user_id, 1, now() FROM old_rows r
+            ON CONFLICT (user_id) DO UPDATE SET version = v.version + 1, updated_at = now();
+        END IF;
+    ELSE
+        IF TG_ARGV[0] = 'task_id' THEN
+            INSERT INTO public.user_data_versions AS v (user_id, version, updated_at)
+            SELECT DISTINCT t.user_id, 1, now() FROM new_rows r JOIN public.tasks t ON t.id = r.task_id
+            ON CONFLICT (user_id) DO UPDATE SET version = v.version + 1, updated_at = now();
+        ELSE
+            INSERT INTO public.user_data_versions AS v (user_id, version, updated_at)
+            SELECT DISTINCT r.user_id, 1, now() FROM new_rows r
+            ON CONFLICT (user_id) DO UPDATE SET version = v.version + 1, updated_at = now();
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DO $$
+DECLARE
+    tbl text;
+    key text;
+    op text;
+    ref text;
+BEGIN
+    FOR tbl, key IN VALUES ('tasks', 'user_id'), ('schedules', 'user_id'), ('notes', 'user_id'),
+                           ('tags', 'user_id'), ('checklist_items', 'task_id'), ('task_tags', 'task_id')
+    LOOP
+        FOR op, ref IN VALUES ('INSERT', 'NEW TABLE AS new_rows'), ('UPDATE', 'NEW TABLE AS new_rows'),
+                              ('DELETE', 'OLD TABLE AS old_rows')
+        LOOP
+            EXECUTE 'DROP TRIGGER IF EXISTS ' || tbl || '_version_' || lower(op) || ' ON public.' || tbl;
+            EXECUTE 'CREATE TRIGGER ' || tbl || '_version_' || lower(op) || ' AFTER ' || op || ' ON public.' || tbl
+                 || ' REFERENCING ' || ref || ' FOR EACH STATEMENT'
+                 || ' EXECUTE FUNCTION public.bump_user_data_version(' || quote_literal(key) || ')';
+        END LOOP;
+    END LOOP;
+END;
+$$;
+
+-- Chỉ trigger được ghi phiên bản; role của Supabase có thể không tồn tại (Postgres thường khi dev / benchmark).
+REVOKE EXECUTE ON FUNCTION public.bump_user_data_version() FROM PUBLIC;
+
+DO $$
+DECLARE
+    role_name text;
+BEGIN
+    FOREACH role_name IN ARRAY ARRAY['anon', 'authenticated'] LOOP
+        IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = role_name) THEN
+            EXECUTE 'REVOKE INSERT, UPDATE, DELETE, TRUNCATE ON public.user_data_versions FROM ' || quote_ident(role_name);
+            EXECUTE 'REVOKE EXECUTE ON FUNCTION public.bump_user_data_version() FROM ' || quote_ident(role_name);
+        END IF;
+    END LOOP;
+END;
+$$;
+
+-- Danh sách task chưa xong của REST API: lọc + phân trang keyset theo (created_at, id) mới nhất trước.
+CREATE INDEX IF NOT EXISTS tasks_user_open_created_idx
+    ON public.tasks (user_id, is_completed, created_at DESC, id DESC);
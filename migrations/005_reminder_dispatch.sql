@@ -0,0 +1,35 @@
+-- File: migrations/005_reminder_dispatch.sql
+-- Bộ nhắc lịch (utils/nhac_lich.py): nạp cả khung thời gian sắp tới của mọi người dùng bằng một truy vấn
+-- khoảng theo thời gian (không quét từng người dùng), rồi ghi thông báo đã đến giờ vào `notifications`.
+
+-- Khoảng theo giờ bắt đầu cho mọi người dùng (schedules_user_start_idx bắt đầu bằng user_id nên không dùng được).
+CREATE INDEX IF NOT EXISTS schedules_start_idx
+    ON public.schedules (start_time);
+
+CREATE INDEX IF NOT EXISTS reminders_remind_at_idx
+    ON public.reminders (remind_at);
+
+-- Mỗi nhắc nhở đã gửi là một dòng; ứng dụng đọc / nghe (Supabase Realtime) theo user_id.
+-- source = 'lich' (trước giờ bắt đầu của schedule) hoặc 'nhac' (dòng trong reminders).
+-- UNIQUE => gửi lại sau khi khởi động lại tiến trình (hoặc từ hai tiến trình) không tạo thông báo trùng.
+CREATE TABLE IF NOT EXISTS public.notifications (
+    id         bigserial PRIMARY KEY,
+    user_id    uuid NOT NULL,
+    task_id    bigint REFERENCES public.tasks(id) ON DELETE CASCADE,
+    source     text NOT NULL,
+    source_id  bigint NOT NULL,
+    title      text NOT NULL,
+    start_time timestamptz,
+    remind_at  timestamptz NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    read_at    timestamptz,
+    UNIQUE (source, source_id, remind_at)
+);
+
+-- Thông báo mới nhất của một người dùng.
+CREATE INDEX IF NOT EXISTS notifications_user_created_idx
+    ON public.notifications (user_id, created_at DESC);
+
+-- Xóa task => ON DELETE CASCADE tìm thông báo theo task_id (bảng này chỉ lớn dần).
+CREATE INDEX IF NOT EXISTS notifications_task_idx
+    ON public.notifications (task_id);
@@ -0,0 +1,25 @@
+-- File: migrations/006_chat_history.sql
+-- Lịch sử hội thoại khi HISTORY_BACKEND=sql (utils/lich_su_hoi_thoai.py). Phiên không hoạt động quá
+-- HISTORY_IDLE_TTL giây bị `ChatHistoryStore.purge_expired()` xóa định kỳ, nên hai bảng không lớn mãi.
+-- Bảng đã được tạo trước đây bằng metadata.create_all chỉ được thêm các cột thời gian.
+
+CREATE TABLE IF NOT EXISTS public.chat_messages (
+    id         bigserial PRIMARY KEY,
+    session_id varchar(255) NOT NULL,
+    message    text NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE public.chat_messages ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+
+CREATE TABLE IF NOT EXISTS public.chat_summaries (
+    session_id varchar(255) PRIMARY KEY,
+    summary    text NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE public.chat_summaries ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+-- Đọc cửa sổ của một phiên theo thứ tự; tìm phiên hết hạn theo lần ghi cuối.
+CREATE INDEX IF NOT EXISTS chat_messages_session_idx
+    ON public.chat_messages (session_id, id);
+CREATE INDEX IF NOT EXISTS chat_messages_created_idx
+    ON public.chat_messages (created_at);
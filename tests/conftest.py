@@ -0,0 +1,19 @@
+# File: tests/conftest.py
+#
+# Test cho các thành phần điều phối / ghi dữ liệu của agent:
+#   python -m pytest tests
+# Test async chạy bằng plugin pytest của anyio (đã có trong requirements.txt, khai báo ở pytest.ini).
+# Test cần Postgres chỉ chạy khi có TEST_DATABASE_URL, vd postgresql://localhost/skedule_test;
+# dữ liệu thử được tạo và xóa trong chính test, không đụng dữ liệu khác.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
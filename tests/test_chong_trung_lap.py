@@ -0,0 +1,89 @@
+# File: tests/test_chong_trung_lap.py
+
+import asyncio
+
+import pytest
+
+from utils.chong_trung_lap import IdempotencyStore, KhoaTrungLapXungDot, request_fingerprint
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_duplicates_share_one_execution():
+    store = IdempotencyStore()
+    calls = 0
+
+    async def execute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "kết quả"
+
+    fingerprint = request_fingerprint("tạo task họp")
+    results = await asyncio.gather(*(store.run("k", fingerprint, execute) for _ in range(3)))
+    assert calls == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+    assert all(value == "kết quả" for value, _ in results)
+    assert store.stats()["coalesced"] == 2 and store.stats()["in_flight"] == 0
+
+
+async def test_finished_result_is_replayed():
+    store = IdempotencyStore()
+
+    async def execute():
+        return 42
+
+    assert await store.run("k", "f", execute) == (42, False)
+    assert await store.run("k", "f", execute) == (42, True)
+    assert store.executed == 1 and store.replayed == 1
+
+
+async def test_same_key_with_different_request_is_rejected():
+    store = IdempotencyStore()
+
+    async def execute():
+        await asyncio.sleep(0.01)
+        return 1
+
+    first = asyncio.create_task(store.run("k", request_fingerprint("a"), execute))
+    await asyncio.sleep(0)
+    with pytest.raises(KhoaTrungLapXungDot):
+        await store.run("k", request_fingerprint("b"), execute)  # Đang chạy
+    await first
+    with pytest.raises(KhoaTrungLapXungDot):
+        await store.run("k", request_fingerprint("b"), execute)  # Đã xong
+
+
+async def test_failed_run_is_not_cached():
+    store = IdempotencyStore()
+    attempts = 0
+
+    async def execute():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise RuntimeError("LLM lỗi")
+        return "ok"
+
+    with pytest.raises(RuntimeError):
+        await store.run("k", "f", execute)
+    assert await store.run("k", "f", execute) == ("ok", False)
+    assert attempts == 2
+
+
+async def test_first_client_cancel_does_not_cancel_shared_run():
+    store = IdempotencyStore()
+    finished = asyncio.Event()
+
+    async def execute():
+        await asyncio.sleep(0.02)
+        finished.set()
+        return "xong"
+
+    first = asyncio.create_task(store.run("k", "f", execute))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(store.run("k", "f", execute))
+    await asyncio.sleep(0)
+    first.cancel()  # Client đầu ngắt kết nối
+    assert await second == ("xong", True)
+    assert finished.is_set()
@@ -0,0 +1,91 @@
+# File: tests/test_dieu_phoi_yeu_cau.py
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from utils.dieu_phoi_yeu_cau import FairScheduler, QuaTai
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rejects_user_over_per_user_limit():
+    scheduler = FairScheduler(max_llm_concurrency=1, max_queue=10, max_per_user=1)
+    async with scheduler.session("u1", "s1"):
+        with pytest.raises(QuaTai) as info:
+            async with scheduler.session("u1", "s1"):
+                pass
+        assert info.value.reason == "user"
+        assert info.value.retry_after >= 1
+        # User khác vẫn được nhận
+        async with scheduler.session("u2", "s2"):
+            pass
+    assert scheduler.rejected == 1
+
+
+async def test_rejects_when_queue_full():
+    scheduler = FairScheduler(max_llm_concurrency=1, max_queue=1, max_per_user=5)
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.session("u1", "s1"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(hold())  # Chờ khóa phiên => chiếm chỗ duy nhất trong hàng đợi
+    await asyncio.sleep(0)
+    with pytest.raises(QuaTai) as info:
+        async with scheduler.session("u2", "s2"):
+            pass
+    assert info.value.reason == "queue"
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert scheduler.stats()["queued"] == 0 and scheduler.stats()["sessions"] == 0
+
+
+async def test_session_turns_run_one_at_a_time():
+    scheduler = FairScheduler()
+    events = []
+
+    async def turn(name):
+        async with scheduler.session("u1", "s1"):
+            events.append(("start", name))
+            await asyncio.sleep(0.01)
+            events.append(("end", name))
+
+    await asyncio.gather(turn("a"), turn("b"))
+    assert events == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b")]
+
+
+async def test_llm_slots_are_shared_round_robin():
+    scheduler = FairScheduler(max_llm_concurrency=1)
+    order = []
+    gate = asyncio.Event()
+
+    async def call(user_id, name):
+        async with scheduler.llm_slot(user_id):
+            order.append(name)
+            await gate.wait()
+
+    first = asyncio.create_task(call("dồn", "a1"))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(call("dồn", f"a{i}")) for i in (2, 3)]
+    tasks.append(asyncio.create_task(call("khác", "b1")))
+    await asyncio.sleep(0)
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    # User gửi dồn không chiếm hết: lượt của user khác được xen vào ngay sau lượt đang chạy.
+    assert order[:2] == ["a1", "a2"] and order.index("b1") < order.index("a3")
+
+
+def test_chat_returns_429_with_retry_after(monkeypatch):
+    import agent_lich_trinh
+
+    monkeypatch.setattr(agent_lich_trinh, "turn_scheduler", FairScheduler(max_queue=0))
+    app = agent_lich_trinh.create_app(prewarm=False)
+    app.dependency_overrides[agent_lich_trinh.get_current_user_id] = lambda: "00000000-0000-0000-0000-000000000001"
+    response = TestClient(app).post("/chat", data={"prompt": "xin chào", "audio": "none"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,44 @@
+# File: tests/test_dinh_tuyen_y_dinh.py
+
+from datetime import date
+
+import pytest
+
+from utils.dinh_tuyen_y_dinh import IntentRouter
+
+TODAY = date(2026, 10, 14)  # Thứ tư
+
+
+def _route(prompt):
+    intent = IntentRouter().route(prompt, today=TODAY)
+    return intent and (intent.tool_name, intent.args)
+
+
+def test_day_question_is_routed():
+    assert _route("20/10 có gì") == ("tim_lich_trinh", {"ngay_bat_dau": "2026-10-20", "ngay_ket_thuc": "2026-10-20"})
+
+
+@pytest.mark.parametrize("prompt", ["31/2 có gì", "lịch 30/2", "tôi có gì vào 32/13"])
+def test_invalid_date_falls_back_to_agent(prompt):
+    assert _route(prompt) is None
+
+
+def test_quoted_delete_is_routed():
+    assert _route('xóa lịch "họp nhóm"') == ("xoa_task_hoac_lich_trinh", {"tieu_de": "họp nhóm"})
+
+
+@pytest.mark.parametrize("prompt", ["xóa lịch họp nhóm", "đánh dấu làm slide là xong"])
+def test_bare_title_writes_are_left_to_the_agent(prompt):
+    assert _route(prompt) is None
+
+
+@pytest.mark.parametrize("prompt", [
+    "xóa ghi chú mua sữa",
+    "xóa thẻ ưu tiên",
+    "xóa lịch họp nhóm rồi tạo task mới",
+    "xóa lịch họp không",
+])
+def test_ambiguous_bare_titles_are_never_routed(prompt):
+    # Kể cả khi hạ ngưỡng để lệnh không có dấu nháy được đi đường tắt.
+    intent = IntentRouter(min_confidence=0.5).route(prompt, today=TODAY)
+    assert intent is None
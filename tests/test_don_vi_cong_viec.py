@@ -0,0 +1,123 @@
+# File: tests/test_don_vi_cong_viec.py
+#
+# UnitOfWork chạy trên SQLite (aiosqlite) để test luôn chạy; phần SQL dùng ở đây không phụ thuộc Postgres.
+
+import itertools
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import StructuredTool
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from utils.don_vi_cong_viec import UnitOfWork
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def engine(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'uow.db'}")
+
+    # Để SQLAlchemy tự phát BEGIN / SAVEPOINT thay cho driver sqlite3 (công thức trong tài liệu SQLAlchemy).
+    @event.listens_for(engine.sync_engine, "connect")
+    def _connect(dbapi_connection, _record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    async with engine.begin() as connection:
+        await connection.execute(text("CREATE TABLE items (name text NOT NULL)"))
+    yield engine
+    await engine.dispose()
+
+
+def _insert(connection, name, fail=False, on_commit=None):
+    connection.execute(text("INSERT INTO items (name) VALUES (:name)"), {"name": name})
+    if on_commit is not None:
+        on_commit()
+    if fail:
+        raise RuntimeError("tool lỗi")
+    return name
+
+
+async def _names(engine):
+    async with engine.connect() as connection:
+        return sorted((await connection.execute(text("SELECT name FROM items"))).scalars())
+
+
+async def test_failed_call_rolls_back_only_its_savepoint(engine):
+    unit, done = UnitOfWork(engine), []
+    await unit.run(_insert, "a", on_commit=lambda: unit.after_commit(lambda: done.append("a")))
+    with pytest.raises(RuntimeError):
+        await unit.run(_insert, "b", fail=True, on_commit=lambda: unit.after_commit(lambda: done.append("b")))
+    await unit.run(_insert, "c")
+    assert done == []  # Chưa commit: callback chưa chạy
+    await unit.close(commit=True)
+    assert await _names(engine) == ["a", "c"]
+    assert done == ["a"]  # Callback của lượt gọi bị rollback đã bị bỏ
+
+
+async def test_failed_first_call_leaves_unit_usable(engine):
+    unit = UnitOfWork(engine)
+    with pytest.raises(RuntimeError):
+        await unit.run(_insert, "a", fail=True)
+    await unit.run(_insert, "b")
+    await unit.close(commit=True)
+    assert await _names(engine) == ["b"]
+
+
+async def test_close_without_commit_discards_writes_and_callbacks(engine):
+    unit, done = UnitOfWork(engine), []
+    await unit.run(_insert, "a", on_commit=lambda: unit.after_commit(lambda: done.append("a")))
+    await unit.close(commit=False)
+    assert await _names(engine) == []
+    assert done == []
+
+
+class _StepModel(BaseChatModel):
+    """Bước 1 gọi tool `ghi`, bước 2 (LLM được gọi lại với kết quả tool) bị lỗi."""
+
+    calls: object = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "step-test"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if next(self.calls) > 0:
+            raise RuntimeError("LLM lỗi ở bước sau")
+        message = AIMessage(content="", tool_calls=[{"name": "ghi", "args": {"name": "a"}, "id": "call-1"}])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+async def test_later_step_failure_rolls_back_earlier_step_writes(engine, monkeypatch):
+    import agent_lich_trinh
+
+    ran, done = [], []
+
+    async def ghi(name: str) -> str:
+        ran.append(name)
+        unit = agent_lich_trinh._turn_unit.get()
+        return await unit.run(_insert, name, on_commit=lambda: unit.after_commit(lambda: done.append(name)))
+
+    monkeypatch.setattr(agent_lich_trinh, "get_async_engine", lambda: engine)
+    monkeypatch.setattr(agent_lich_trinh, "get_llm", lambda: _StepModel(calls=itertools.count()))
+    monkeypatch.setattr(agent_lich_trinh, "tools_list", [StructuredTool.from_function(coroutine=ghi, name="ghi", description="Ghi một dòng.")])
+    monkeypatch.setattr(agent_lich_trinh, "agent_with_chat_history", None)
+
+    with pytest.raises(RuntimeError):
+        async with agent_lich_trinh.turn_unit_of_work():
+            await agent_lich_trinh.get_agent_with_chat_history().ainvoke(
+                {"input": "ghi a", "user_id": "u"}, config={"configurable": {"session_id": "pytest-uow"}},
+            )
+    assert ran == ["a"]
+    assert await _names(engine) == []  # Phần bước 1 đã ghi bị hủy cùng lượt
+    assert done == []
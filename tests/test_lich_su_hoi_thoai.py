@@ -0,0 +1,40 @@
+# File: tests/test_lich_su_hoi_thoai.py
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_google_genai.chat_models import _parse_chat_history
+
+from benchmarks.gia_lap import ScriptedChatModel
+from utils.lich_su_hoi_thoai import WindowPolicy, WindowedChatMessageHistory
+
+
+def _history(turns: int) -> WindowedChatMessageHistory:
+    history = WindowedChatMessageHistory(WindowPolicy(max_messages=4, max_tokens=10_000))
+    for i in range(turns):
+        history.add_messages([HumanMessage(content=f"câu hỏi {i}"), AIMessage(content=f"trả lời {i}")])
+    return history
+
+
+def _agent_messages(history: WindowedChatMessageHistory):
+    import agent_lich_trinh
+
+    return agent_lich_trinh.prompt.format_messages(
+        chat_history=history.messages, user_id="u", input="xin chào", agent_scratchpad=[],
+    )
+
+
+def test_summary_does_not_change_gemini_system_instruction():
+    fresh, summarized = _history(1), _history(5)
+    assert summarized.summary and not fresh.summary
+    fresh_system, _ = _parse_chat_history(_agent_messages(fresh))
+    summarized_system, contents = _parse_chat_history(_agent_messages(summarized))
+    assert summarized_system == fresh_system
+    assert summarized.summary.splitlines()[-1] in str(contents[0].parts)  # Tóm tắt nằm trong hội thoại
+
+
+def test_benchmark_model_sees_one_prefix_across_sessions():
+    calls = []
+    model = ScriptedChatModel(script=[], on_call=calls.append, seen_prefixes=set())
+    for history in (_history(1), _history(5)):
+        model.invoke(_agent_messages(history))
+    assert len({call["prefix"] for call in calls}) == 1
+    assert calls[1]["cached_tokens"] == calls[1]["prefix_tokens"] > 0
@@ -0,0 +1,99 @@
+# File: tests/test_nhac_lich.py
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from utils.nhac_lich import ReminderDispatcher
+
+pytestmark = pytest.mark.anyio
+
+
+class _Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+
+class _WindowEngine:
+    """Engine giả cho `refresh()`: truy vấn khung thời gian trả về `rows`."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @asynccontextmanager
+    async def connect(self):
+        async def execute(query, params):
+            return _Result(self.rows[:params["limit"]])
+        yield SimpleNamespace(execute=execute)
+
+
+class _Dispatcher(ReminderDispatcher):
+    """Ghi thông báo vào danh sách thay vì DB; `failures` lần gửi đầu tiên bị lỗi."""
+
+    def __init__(self, rows=(), failures=0, **kwargs):
+        super().__init__(_WindowEngine(list(rows)), **kwargs)
+        self.failures = failures
+        self.deliveries = []
+
+    async def _deliver(self, batch):
+        self.deliveries.append([entry.key for entry in batch])
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mất kết nối DB")
+        return {entry.key for entry in batch}
+
+
+def _row(source_id, remind_at, task_id=1):
+    return SimpleNamespace(source="lich", source_id=source_id, task_id=task_id,
+                           start_time=remind_at + timedelta(minutes=15), remind_at=remind_at)
+
+
+async def test_changes_beyond_horizon_are_left_for_next_refresh():
+    dispatcher = _Dispatcher(lead=timedelta(minutes=15), window=timedelta(minutes=30))
+    dispatcher.schedule_changed(1, 1, datetime.now(timezone.utc) + timedelta(minutes=20))
+    assert dispatcher.stats()["pending"] == 0  # Chưa nạp khung nào
+
+    now = datetime.now(timezone.utc)
+    await dispatcher.refresh(now)
+    assert dispatcher.stats()["horizon"] == (now + timedelta(minutes=30)).isoformat()
+    dispatcher.schedule_changed(1, 1, now + timedelta(minutes=40))   # Nhắc lúc +25 phút: trong khung
+    dispatcher.schedule_changed(2, 2, now + timedelta(minutes=50))   # Nhắc lúc +35 phút: ngoài khung
+    assert dispatcher.stats()["pending"] == 1
+    dispatcher.task_removed(1)
+    assert dispatcher.stats()["pending"] == 0
+
+
+async def test_full_window_shrinks_horizon_to_last_loaded_row():
+    now = datetime.now(timezone.utc)
+    rows = [_row(1, now + timedelta(minutes=5)), _row(2, now + timedelta(minutes=10)), _row(3, now + timedelta(minutes=20))]
+    dispatcher = _Dispatcher(rows, max_entries=2, lead=timedelta(minutes=15))
+    assert await dispatcher.refresh(now) == 2
+    assert dispatcher.stats()["horizon"] == rows[1].remind_at.isoformat()
+    dispatcher.schedule_changed(9, 9, now + timedelta(minutes=30))  # Nhắc lúc +15 phút > horizon
+    assert dispatcher.stats()["pending"] == 2
+
+
+async def test_failed_batch_is_retried_after_retry_seconds():
+    now = datetime.now(timezone.utc)
+    dispatcher = _Dispatcher([_row(1, now - timedelta(seconds=1))], failures=1, retry_seconds=0.05)
+    await dispatcher.refresh(now)
+
+    assert await dispatcher.dispatch_due() == 0
+    assert dispatcher.stats()["pending"] == 1     # Vẫn chờ trong heap
+    assert await dispatcher.dispatch_due() == 0   # Chưa hết thời gian chờ thử lại: không gửi
+    assert len(dispatcher.deliveries) == 1
+
+    await asyncio.sleep(0.06)
+    assert await dispatcher.dispatch_due() == 1
+    assert dispatcher.deliveries == [[("lich", 1)], [("lich", 1)]]
+    assert dispatcher.stats()["pending"] == 0
+
+    # Lần nạp sau vẫn thấy dòng đó (chưa quá giờ bắt đầu) nhưng không gửi lại.
+    await dispatcher.refresh(now)
+    assert dispatcher.stats()["pending"] == 0
@@ -0,0 +1,37 @@
+# File: tests/test_phien_ban_du_lieu.py
+
+import os
+
+import pytest
+from sqlalchemy import create_engine, make_url, text
+
+from utils.phien_ban_du_lieu import get_data_version_state
+
+pytestmark = pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="cần Postgres: đặt TEST_DATABASE_URL")
+
+USER_ID = "00000000-0000-0000-0000-0000000000aa"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(make_url(os.environ["TEST_DATABASE_URL"]).set(drivername="postgresql+psycopg"))
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS user_data_versions (
+                user_id uuid PRIMARY KEY, version bigint NOT NULL DEFAULT 0, updated_at timestamptz NOT NULL DEFAULT now())
+        """))
+        connection.execute(text("DELETE FROM user_data_versions WHERE user_id = :u"), {"u": USER_ID})
+        connection.execute(text("INSERT INTO user_data_versions (user_id, version) VALUES (:u, 5)"), {"u": USER_ID})
+    yield engine
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM user_data_versions WHERE user_id = :u"), {"u": USER_ID})
+    engine.dispose()
+
+
+def test_version_bumped_in_open_transaction_is_pending(engine):
+    with engine.connect() as connection:
+        assert get_data_version_state(connection, USER_ID) == (5, False)
+        connection.execute(text("UPDATE user_data_versions SET version = version + 1 WHERE user_id = :u"), {"u": USER_ID})
+        assert get_data_version_state(connection, USER_ID) == (6, True)
+        connection.rollback()
+        assert get_data_version_state(connection, USER_ID) == (5, False)
@@ -0,0 +1,73 @@
+# File: tests/test_thu_tu_tool.py
+
+import asyncio
+
+import pytest
+
+from utils.thu_tu_tool import TOAN_BO, ToolCallOrdering, task_scope
+
+pytestmark = pytest.mark.anyio
+
+
+async def _call(ordering, log, name, scope, write, key=None, delay=0.01):
+    async with ordering.turn(scope, write, key=key):
+        log.append(("start", name))
+        await asyncio.sleep(delay)
+        log.append(("end", name))
+
+
+async def test_conflicting_call_waits_for_earlier_write():
+    ordering, log = ToolCallOrdering(), []
+    await asyncio.gather(
+        _call(ordering, log, "tao", task_scope(["Làm slide"]), True),
+        _call(ordering, log, "gan_the", task_scope(["làm  slide"]), True),
+    )
+    assert log == [("start", "tao"), ("end", "tao"), ("start", "gan_the"), ("end", "gan_the")]
+
+
+async def test_independent_calls_do_not_wait():
+    ordering, log = ToolCallOrdering(), []
+    await asyncio.gather(
+        _call(ordering, log, "a", task_scope(["Họp nhóm"]), True),
+        _call(ordering, log, "b", task_scope(["Đi chợ"]), True),
+        _call(ordering, log, "c", None, False),
+    )
+    assert [event for event, _ in log[:3]] == ["start", "start", "start"]
+
+
+async def test_whole_data_read_waits_for_every_earlier_write():
+    ordering, log = ToolCallOrdering(), []
+    await asyncio.gather(
+        _call(ordering, log, "ghi", task_scope(["Họp nhóm"]), True),
+        _call(ordering, log, "tom_tat", TOAN_BO, False),
+    )
+    assert log.index(("end", "ghi")) < log.index(("start", "tom_tat"))
+
+
+async def test_reserved_order_wins_over_arrival_order():
+    # Model gọi "tao" trước "gan_the", nhưng coroutine của "gan_the" đến `turn()` trước (callback bị trễ).
+    ordering, log = ToolCallOrdering(), []
+    ordering.reserve("call-1", task_scope(["Làm slide"]), True)
+    ordering.reserve("call-2", task_scope(["Làm slide"]), True)
+
+    async def late_create():
+        await asyncio.sleep(0.02)
+        await _call(ordering, log, "tao", task_scope(["Làm slide"]), True, key="call-1")
+
+    await asyncio.gather(
+        late_create(),
+        _call(ordering, log, "gan_the", task_scope(["Làm slide"]), True, key="call-2"),
+    )
+    assert log == [("start", "tao"), ("end", "tao"), ("start", "gan_the"), ("end", "gan_the")]
+
+
+async def test_release_unblocks_calls_behind_an_unused_reservation():
+    ordering, log = ToolCallOrdering(), []
+    ordering.reserve("call-1", task_scope(["Làm slide"]), True)
+    ordering.reserve("call-2", task_scope(["Làm slide"]), True)
+    waiting = asyncio.create_task(_call(ordering, log, "gan_the", task_scope(["Làm slide"]), True, key="call-2"))
+    await asyncio.sleep(0.01)
+    assert log == []
+    ordering.release("call-1")  # Lượt gọi 1 không bao giờ chạy tới `turn()` (vd tham số sai)
+    await asyncio.wait_for(waiting, timeout=1)
+    assert log == [("start", "gan_the"), ("end", "gan_the")]
@@ -0,0 +1,34 @@
+# File: tests/test_tim_task.py
+
+from types import SimpleNamespace
+
+import pytest
+
+from agent_lich_trinh import AmbiguousTaskTitle, UnconfirmedTaskTitle, _pick_task
+
+
+def _candidate(title, rank, score, is_completed=False):
+    return SimpleNamespace(id=hash(title), title=title, rank=rank, score=score, is_completed=is_completed)
+
+
+def test_exact_match_wins_over_close_rivals():
+    best = _candidate("Họp nhóm", 3, 1.0)
+    assert _pick_task([best, _candidate("Họp nhóm A", 1, 0.95)], "Họp nhóm") is best
+
+
+def test_contains_match_is_picked_when_unique():
+    best = _candidate("Làm slide báo cáo", 0, 0.5)
+    assert _pick_task([best, _candidate("Làm slide cũ", 0, 0.2)], "slide báo") is best
+
+
+def test_close_rivals_at_same_rank_are_ambiguous():
+    with pytest.raises(AmbiguousTaskTitle) as info:
+        _pick_task([_candidate("Họp nhóm A", 1, 0.6), _candidate("Họp nhóm B", 1, 0.59)], "Họp nhóm")
+    assert not isinstance(info.value, UnconfirmedTaskTitle)
+
+
+def test_trigram_only_match_asks_for_confirmation():
+    # "mua sữa tươii" gõ nhầm: không task nào chứa chuỗi này, chỉ gần giống => không tự ghi / xóa.
+    with pytest.raises(UnconfirmedTaskTitle) as info:
+        _pick_task([_candidate("Mua sữa tươi", -1, 0.8)], "mua sữa tươii")
+    assert "Mua sữa tươi" in info.value.message()
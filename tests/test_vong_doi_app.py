@@ -0,0 +1,15 @@
+# File: tests/test_vong_doi_app.py
+
+from fastapi.testclient import TestClient
+
+
+def test_audio_executors_survive_app_shutdown(monkeypatch):
+    import agent_lich_trinh
+
+    monkeypatch.setattr(agent_lich_trinh, "check_config", lambda: None)
+    for _ in range(2):  # Mỗi app chạy hết lifespan (khởi động rồi tắt)
+        with TestClient(agent_lich_trinh.create_app(prewarm=False)) as client:
+            assert client.get("/").status_code == 200
+    # App tạo sau vẫn dùng được các executor audio dùng chung của tiến trình.
+    assert agent_lich_trinh.audio_executor.submit(sum, [1, 2]).result(timeout=5) == 3
+    assert agent_lich_trinh.audio_decode_executor.submit(pow, 2, 3).result(timeout=30) == 8
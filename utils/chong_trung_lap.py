@@ -0,0 +1,90 @@
+# File: utils/chong_trung_lap.py
+
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from cachetools import TTLCache
+
+
+class KhoaTrungLapXungDot(Exception):
+    """Cùng một Idempotency-Key nhưng nội dung request khác lần đầu."""
+
+
+def request_fingerprint(*parts: str | bytes | None) -> str:
+    """Dấu vân tay nội dung request (prompt, audio...) để phát hiện việc dùng lại khóa cho request khác."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = b"" if part is None else part if isinstance(part, bytes) else part.encode("utf-8")
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Chống chạy lặp theo Idempotency-Key:
+    - Request trùng khóa đến khi lần đầu còn đang chạy => chờ chung kết quả của lần chạy đó.
+    - Request trùng khóa đến sau khi đã xong => trả lại kết quả đã lưu (TTL, giới hạn tổng `max_bytes`).
+    Lần chạy bị lỗi không được lưu, để client thử lại sẽ chạy lại từ đầu.
+    Lần chạy là một task riêng: client đầu tiên ngắt kết nối thì các request trùng vẫn nhận được kết quả.
+    """
+
+    def __init__(self, ttl: float = 600, max_bytes: int = 64 * 1024 * 1024,
+                 sizeof: Callable[[Any], int] = lambda _value: 1):
+        self._results = TTLCache(maxsize=max_bytes, ttl=ttl, timer=time.monotonic,
+                                 getsizeof=lambda entry: sizeof(entry[1]))
+        self._in_flight: dict[Hashable, tuple[str, asyncio.Task]] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.replayed = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fingerprint: str, execute: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """Trả về (kết quả, có phải lấy lại từ lần chạy khác không)."""
+        with self._lock:
+            entry = self._results.get(key)
+        if entry is not None:
+            self._check(entry[0], fingerprint)
+            self.replayed += 1
+            return entry[1], True
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self._check(in_flight[0], fingerprint)
+            self.coalesced += 1
+            return await asyncio.shield(in_flight[1]), True
+
+        task = asyncio.ensure_future(execute())
+        self._in_flight[key] = (fingerprint, task)
+        task.add_done_callback(lambda done: self._finish(key, fingerprint, done))
+        self.executed += 1
+        return await asyncio.shield(task), False
+
+    def _finish(self, key: Hashable, fingerprint: str, task: asyncio.Task) -> None:
+        self._in_flight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        with self._lock:
+            try:
+                self._results[key] = (fingerprint, task.result())
+            except ValueError:
+                pass  # Kết quả lớn hơn cả bộ nhớ cache: không lưu
+
+    @staticmethod
+    def _check(expected: str, fingerprint: str) -> None:
+        if expected != fingerprint:
+            raise KhoaTrungLapXungDot()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "replayed": self.replayed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+                "entries": len(self._results),
+                "bytes": self._results.currsize,
+            }
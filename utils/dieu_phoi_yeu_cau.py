@@ -0,0 +1,142 @@
+# File: utils/dieu_phoi_yeu_cau.py
+
+import asyncio
+import math
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+
+from utils.do_thoi_gian import span
+
+
+class QuaTai(Exception):
+    """Hàng đợi đã đầy; client nên thử lại sau `retry_after` giây."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """
+    Điều phối các lượt hội thoại trước khi gọi agent:
+    - Trong một phiên (session), các lượt chạy lần lượt: lịch sử hội thoại và các lệnh ghi không bị xen nhau.
+    - Các user khác nhau chạy song song, nhưng tối đa `max_llm_concurrency` lượt gọi LLM cùng lúc;
+      chỗ trống được chia lần lượt (round-robin) giữa các user đang chờ, user gửi dồn không chiếm hết.
+    - Đang chờ quá `max_queue` lượt (hoặc một user quá `max_per_user` lượt) => từ chối bằng `QuaTai`.
+    Chỉ dùng trong một event loop (không cần khóa luồng).
+    """
+
+    def __init__(self, max_llm_concurrency: int = 8, max_queue: int = 64, max_per_user: int = 4):
+        self.max_llm_concurrency = max_llm_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self._sessions: dict[str, list] = {}              # session_id -> [asyncio.Lock, số lượt đang giữ/chờ]
+        self._pending: dict[str, int] = defaultdict(int)  # user_id -> số lượt chưa xong
+        self._queued = 0                                  # số lượt đang chờ (khóa phiên hoặc chỗ LLM)
+        self._llm_active = 0
+        self._llm_waiters: dict[str, deque[asyncio.Future]] = {}
+        self._llm_turns: deque[str] = deque()             # thứ tự round-robin các user đang chờ LLM
+        self._llm_seconds = 5.0                           # trung bình trượt thời gian giữ một chỗ LLM
+        self.rejected = 0
+
+    # --- NHẬN / TỪ CHỐI ---
+
+    def retry_after(self) -> int:
+        """Ước lượng số giây đến khi hàng đợi hiện tại được xử lý hết."""
+        rounds = (self._queued + 1) / self.max_llm_concurrency
+        return max(1, math.ceil(rounds * self._llm_seconds))
+
+    def check_admission(self, user_id: str) -> None:
+        if self._pending.get(user_id, 0) >= self.max_per_user:
+            self.rejected += 1
+            raise QuaTai("user", self.retry_after())
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise QuaTai("queue", self.retry_after())
+
+    # --- TUẦN TỰ THEO PHIÊN ---
+
+    @asynccontextmanager
+    async def session(self, user_id: str, session_id: str):
+        """Giữ khóa của phiên trong suốt lượt hội thoại. Ném `QuaTai` ngay nếu không nhận thêm được."""
+        self.check_admission(user_id)
+        self._pending[user_id] += 1
+        entry = self._sessions.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            self._queued += 1
+            try:
+                with span("queue", "session"):
+                    await entry[0].acquire()
+            finally:
+                self._queued -= 1
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._sessions.pop(session_id, None)
+            self._pending[user_id] -= 1
+            if self._pending[user_id] == 0:
+                del self._pending[user_id]
+
+    # --- CHỖ GỌI LLM (CÔNG BẰNG GIỮA CÁC USER) ---
+
+    @asynccontextmanager
+    async def llm_slot(self, user_id: str):
+        with span("queue", "llm"):
+            await self._acquire_llm(user_id)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._llm_seconds = 0.8 * self._llm_seconds + 0.2 * (time.perf_counter() - started)
+            self._llm_active -= 1
+            self._grant_llm()
+
+    async def _acquire_llm(self, user_id: str) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        if user_id not in self._llm_waiters:
+            self._llm_waiters[user_id] = deque()
+            self._llm_turns.append(user_id)
+        self._llm_waiters[user_id].append(waiter)
+        self._grant_llm()  # Còn chỗ thì được cấp ngay
+        self._queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Đã được cấp chỗ đúng lúc bị hủy: trả lại cho người kế tiếp.
+                self._llm_active -= 1
+                self._grant_llm()
+            raise
+        finally:
+            self._queued -= 1
+
+    def _grant_llm(self) -> None:
+        while self._llm_active < self.max_llm_concurrency and self._llm_turns:
+            user_id = self._llm_turns.popleft()
+            waiters = self._llm_waiters[user_id]
+            while waiters and waiters[0].done():
+                waiters.popleft()  # Lượt đã bị hủy trong lúc chờ
+            if waiters:
+                waiters.popleft().set_result(None)
+                self._llm_active += 1
+            if waiters:
+                self._llm_turns.append(user_id)
+            else:
+                del self._llm_waiters[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "llm_active": self._llm_active,
+            "queued": self._queued,
+            "users_waiting_llm": len(self._llm_turns),
+            "sessions": len(self._sessions),
+            "rejected": self.rejected,
+            "avg_llm_seconds": round(self._llm_seconds, 3),
+        }
@@ -0,0 +1,162 @@
+# File: utils/dinh_tuyen_y_dinh.py
+
+import re
+import threading
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from utils.thoi_gian_tu_nhien import parse_time_expression
+
+# --- NGỮ PHÁP (biên dịch sẵn một lần) ---
+
+# Lời lẽ lịch sự ở đầu/cuối câu, bỏ đi trước khi so khớp.
+_POLITE_PREFIX = re.compile(r"^(?:(?:bạn|skedule)\s+ơi[,\s]*|(?:hãy|làm ơn|giúp tôi|giúp mình|cho tôi|cho mình)\s+)+")
+_POLITE_SUFFIX = re.compile(r"(?:[,\s]+(?:giúp tôi|giúp mình|giùm tôi|giùm|nhé|nhá|nha|đi|với|ạ|vậy|thế))+$")
+
+_WHEN = (
+    r"(?P<when>hôm nay|bữa nay|ngày mai|mai|ngày kia|ngày mốt|mốt|tuần này|tuần sau|tuần tới|cuối tuần(?:\s+này|\s+sau)?"
+    r"|tháng này|tháng sau|tháng tới"
+    r"|(?:thứ\s+(?:hai|ba|tư|năm|sáu|bảy|[2-7])|chủ nhật)(?:\s+tuần\s+(?:này|sau|tới))?"
+    r"|(?:ngày\s+)?\d{1,2}/\d{1,2}(?:/\d{4})?"
+    r"|\d+\s*ngày\s*(?:tới|sau))"
+)
+_N_DAYS_AHEAD = re.compile(r"^\d+\s*ngày\s*(?:tới|sau)$")
+_ME = r"(?:tôi|mình|em|tớ)"
+_WHO = rf"(?:{_ME}\s+)?"
+_ASK = r"có\s+(?:gì|lịch gì|lịch nào|việc gì|những gì|hẹn gì|lịch hẹn gì|sự kiện gì)(?:\s+không)?"
+_QUOTED_TITLE = r"[\"'“‘«](?P<quoted_title>[^\"'”’»]+)[\"'”’»]"
+_BARE_TITLE = r"(?P<title>[^\"'“”‘’«»]+?)"
+_ENTITY_WORDS = r"lịch hẹn|lịch trình|lịch|task|công việc|việc|sự kiện|nhiệm vụ"
+_ENTITY = rf"(?:(?:{_ENTITY_WORDS})\s+)?"
+
+# Tiêu đề không có dấu nháy nhưng chứa số / từ chỉ thời gian / số lượng (vd "xóa lịch họp 5h", "xóa hết"),
+# nối thêm lệnh khác ("... rồi tạo task mới"), là câu hỏi ("... không"), nói về thứ không phải task
+# ("xóa ghi chú ...", "xóa thẻ ...") hoặc chỉ là tên loại ("xóa lịch") => để agent xử lý thay vì đoán.
+_AMBIGUOUS_BARE_TITLE = re.compile(
+    rf"\d|\b(?:giờ|sáng|trưa|chiều|tối|hôm|ngày|mai|tuần|tháng|lúc|hết|tất cả|toàn bộ|mọi|các|những"
+    rf"|và|rồi|sau đó|xong|không|chưa|ghi chú|thẻ|nhãn|tag|checklist)\b|^(?:{_ENTITY_WORDS})$"
+)
+
+# (tên tool, mẫu câu, độ tin cậy)
+# Lệnh ghi / xóa theo tiêu đề không có dấu nháy có độ tin cậy dưới ngưỡng mặc định (0.8): tiêu đề được tìm
+# gần đúng nên đoán sai là xóa nhầm task; mặc định chỉ câu có tiêu đề trong dấu nháy mới đi đường tắt.
+_GRAMMAR: list[tuple[str, re.Pattern, float]] = [
+    ("tim_lich_trinh", re.compile(rf"^{_WHO}{_WHEN}\s+{_WHO}{_ASK}$"), 0.95),
+    ("tim_lich_trinh", re.compile(rf"^{_WHO}{_ASK}\s+(?:vào\s+|trong\s+)?{_WHEN}$"), 0.95),
+    ("tim_lich_trinh", re.compile(rf"^(?:xem\s+)?lịch(?:\s+trình)?\s+(?:của\s+{_ME}\s+)?{_WHEN}$"), 0.9),
+    ("danh_dau_task_hoan_thanh", re.compile(rf"^đánh dấu\s+{_ENTITY}{_QUOTED_TITLE}\s+(?:là\s+)?(?:đã\s+)?(?:xong|hoàn thành)(?:\s+rồi)?$"), 0.95),
+    ("danh_dau_task_hoan_thanh", re.compile(rf"^{_WHO}(?:đã\s+)?(?:làm\s+)?(?:xong|hoàn thành)\s+{_ENTITY}{_QUOTED_TITLE}(?:\s+rồi)?$"), 0.9),
+    ("danh_dau_task_hoan_thanh", re.compile(rf"^đánh dấu\s+{_ENTITY}{_BARE_TITLE}\s+(?:là\s+)?(?:đã\s+)?(?:xong|hoàn thành)(?:\s+rồi)?$"), 0.7),
+    ("xoa_task_hoac_lich_trinh", re.compile(rf"^(?:xóa|xoá|hủy|huỷ)\s+{_ENTITY}{_QUOTED_TITLE}$"), 0.95),
+    ("xoa_task_hoac_lich_trinh", re.compile(rf"^(?:xóa|xoá|hủy|huỷ)\s+{_ENTITY}{_BARE_TITLE}$"), 0.7),
+    ("tom_tat_tien_do", re.compile(rf"^(?:tóm tắt|tổng kết|tổng quan)(?:\s+(?:tiến độ|công việc|lịch trình))?(?:\s+của\s+{_ME})?$"), 0.95),
+    ("tom_tat_tien_do", re.compile(rf"^tiến độ(?:\s+(?:công việc\s+)?(?:của\s+)?(?:tôi|mình))?(?:\s+(?:thế nào|ra sao))?$"), 0.9),
+]
+
+# --- KẾT QUẢ ĐỊNH TUYẾN ---
+
+
+@dataclass
+class RoutedIntent:
+    tool_name: str
+    args: dict
+    confidence: float
+
+
+@dataclass
+class RouterStats:
+    routed: int = 0
+    fallback: int = 0
+    per_tool: Counter = field(default_factory=Counter)
+
+    def as_dict(self) -> dict:
+        total = self.routed + self.fallback
+        return {
+            "routed": self.routed,
+            "fallback": self.fallback,
+            "routed_rate": self.routed / total if total else 0.0,
+            "per_tool": dict(self.per_tool),
+        }
+
+# --- HÀM PHỤ TRỢ ---
+
+
+def normalize_prompt(prompt: str) -> str:
+    """NFC + chữ thường + gộp khoảng trắng + bỏ dấu câu cuối và lời lẽ lịch sự."""
+    text = unicodedata.normalize("NFC", prompt).lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    text = text.rstrip(" ?!.…")
+    text = _POLITE_PREFIX.sub("", text)
+    text = _POLITE_SUFFIX.sub("", text)
+    return text.strip()
+
+
+def resolve_day_range(when: str, today: date) -> tuple[date, date] | None:
+    """
+    Đổi cụm thời gian (đã khớp `_WHEN`) thành khoảng ngày [bắt đầu, kết thúc].
+    None nếu cụm không thành ngày hợp lệ (vd "31/2") => để agent xử lý.
+    """
+    parsed = parse_time_expression(when, datetime.combine(today, datetime.min.time()))
+    if parsed is None:
+        return None
+    # "N ngày tới/sau": từ hôm nay đến hết ngày thứ N
+    if _N_DAYS_AHEAD.match(when):
+        return today, parsed.last_day
+    return parsed.first_day, parsed.last_day
+
+# --- BỘ ĐỊNH TUYẾN ---
+
+
+class IntentRouter:
+    """
+    Nhận diện các câu lệnh đơn giản, rõ nghĩa và gọi thẳng tool tương ứng, không qua LLM.
+    Chỉ định tuyến khi độ tin cậy >= `min_confidence`; còn lại trả None để agent xử lý.
+    """
+
+    def __init__(self, min_confidence: float = 0.8):
+        self.min_confidence = min_confidence
+        self._stats = RouterStats()
+        self._lock = threading.Lock()
+
+    def _match(self, text: str, today: date) -> RoutedIntent | None:
+        for tool_name, pattern, confidence in _GRAMMAR:
+            match = pattern.match(text)
+            if not match:
+                continue
+            groups = match.groupdict()
+
+            if tool_name == "tim_lich_trinh":
+                day_range = resolve_day_range(groups["when"], today)
+                if day_range is None:
+                    return None
+                start, end = day_range
+                return RoutedIntent(tool_name, {"ngay_bat_dau": start.isoformat(), "ngay_ket_thuc": end.isoformat()}, confidence)
+
+            if groups.get("quoted_title"):
+                return RoutedIntent(tool_name, {"tieu_de": groups["quoted_title"].strip()}, confidence)
+            if groups.get("title"):
+                title = groups["title"].strip()
+                if not title or _AMBIGUOUS_BARE_TITLE.search(title):
+                    continue
+                return RoutedIntent(tool_name, {"tieu_de": title}, confidence)
+
+            return RoutedIntent(tool_name, {}, confidence)
+        return None
+
+    def route(self, prompt: str, today: date | None = None) -> RoutedIntent | None:
+        intent = self._match(normalize_prompt(prompt), today or date.today())
+        if intent and intent.confidence < self.min_confidence:
+            intent = None
+        with self._lock:
+            if intent:
+                self._stats.routed += 1
+                self._stats.per_tool[intent.tool_name] += 1
+            else:
+                self._stats.fallback += 1
+        return intent
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self._stats.as_dict()
@@ -0,0 +1,197 @@
+# File: utils/do_thoi_gian.py
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine.base import Engine
+
+# Mốc histogram (giây): từ truy vấn SQL vài ms đến một lượt Gemini vài chục giây.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+STAGE_SECONDS = Histogram(
+    "skedule_stage_duration_seconds",
+    "Thời gian của từng công đoạn xử lý (auth, stt, llm, tool, sql, tts...).",
+    ["stage", "name"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "skedule_http_request_duration_seconds",
+    "Thời gian xử lý toàn bộ một request HTTP.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter("skedule_llm_tokens_total", "Số token LLM đã dùng.", ["direction"])
+REJECTED_REQUESTS = Counter("skedule_rejected_requests_total", "Số request bị từ chối (429) vì hàng đợi đầy.", ["reason"])
+STARTUP_SECONDS = Gauge(
+    "skedule_startup_seconds",
+    "Thời gian khởi động tiến trình: import module, prewarm, tổng đến lúc sẵn sàng nhận request.",
+    ["phase"],
+)
+REMINDER_LAG_SECONDS = Histogram(
+    "skedule_reminder_lag_seconds",
+    "Độ trễ gửi nhắc lịch: từ giờ cần nhắc (hoặc lúc được nạp, nếu khi đó đã quá giờ) đến lúc thông báo được ghi.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+REMINDERS = Counter(
+    "skedule_reminders_total",
+    "Số nhắc lịch đã xử lý: sent, skipped (lịch đã đổi / xóa / xong, hoặc đã gửi), failed.",
+    ["result"],
+)
+REMINDER_QUEUE = Gauge("skedule_reminder_queue", "Số nhắc lịch đang chờ trong khung thời gian đã nạp.")
+
+# --- SỐ ĐO CỦA MỘT REQUEST ---
+
+
+class RequestTiming:
+    """Tổng thời gian theo công đoạn trong một request, dùng để dựng header `Server-Timing`."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, list[float]] = {}   # stage -> [tổng giây, số lần]
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            total = self.stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def add_tokens(self, input_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def server_timing(self) -> str:
+        """
+        vd: `auth;dur=0.4, llm;dur=812.0;desc="x2 in=1450 out=120", total;dur=1203.5`
+        (header HTTP chỉ nhận latin-1 nên `desc` viết không dấu).
+        """
+        with self._lock:
+            parts = []
+            for stage, (seconds, count) in self.stages.items():
+                desc = f"x{count}" if count > 1 else ""
+                if stage == "llm" and (self.input_tokens or self.output_tokens):
+                    desc = f"{desc} in={self.input_tokens} out={self.output_tokens}".strip()
+                part = f"{stage};dur={seconds * 1000:.1f}"
+                parts.append(f'{part};desc="{desc}"' if desc else part)
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+# Hàm nhận mọi số đo (stage, name, giây), vd bộ benchmark cần mẫu thô để tính p95/p99.
+_observers: list[Callable[[str, str, float], None]] = []
+
+_current_timing: ContextVar[RequestTiming | None] = ContextVar("request_timing", default=None)
+# Tên tool đang chạy, để gắn nhãn cho các câu SQL bên trong nó.
+_current_tool: ContextVar[str | None] = ContextVar("current_tool", default=None)
+
+
+def start_request_timing() -> RequestTiming:
+    timing = RequestTiming()
+    _current_timing.set(timing)
+    return timing
+
+
+def current_timing() -> RequestTiming | None:
+    return _current_timing.get()
+
+
+def add_observer(observer: Callable[[str, str, float], None]) -> None:
+    _observers.append(observer)
+
+
+def record(stage: str, seconds: float, name: str = "", timing: RequestTiming | None = None) -> None:
+    STAGE_SECONDS.labels(stage=stage, name=name).observe(seconds)
+    for observer in _observers:
+        observer(stage, name, seconds)
+    timing = timing or _current_timing.get()
+    if timing is not None:
+        timing.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str, name: str = ""):
+    """Đo một công đoạn (dùng được cả trong hàm async: `with span("tts"): await ...`)."""
+    tool_token = _current_tool.set(name) if stage == "tool" else None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started, name)
+        if tool_token is not None:
+            _current_tool.reset(tool_token)
+
+# --- LLM: thời gian mỗi lượt gọi + số token ---
+
+
+class LLMTimingCallback(BaseCallbackHandler):
+    """Callback LangChain ghi thời gian mỗi lượt gọi model và số token vào request đang xử lý."""
+
+    def __init__(self, timing: RequestTiming | None):
+        self.timing = timing
+        self._started: dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized: dict[str, Any], messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized: dict[str, Any], prompts: list[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            record("llm", time.perf_counter() - started, "agent", timing=self.timing)
+
+        input_tokens = output_tokens = cached_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+                cached_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0)
+        LLM_TOKENS.labels(direction="input").inc(input_tokens)
+        LLM_TOKENS.labels(direction="output").inc(output_tokens)
+        LLM_TOKENS.labels(direction="input_cached").inc(cached_tokens)  # Phần input provider lấy từ cache
+        if self.timing is not None:
+            self.timing.add_tokens(input_tokens, output_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            record("llm", time.perf_counter() - started, "error", timing=self.timing)
+
+# --- SQL: thời gian mỗi câu lệnh ---
+
+_SQL_VERB = re.compile(r"^\s*(?:--[^\n]*\n\s*)*(\w+)")
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Gắn event SQLAlchemy để đo mỗi câu lệnh; nhãn = `<tool>:<SELECT|INSERT|...>`."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_timing_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["_timing_started"].pop()
+        verb = _SQL_VERB.match(statement)
+        name = f"{_current_tool.get() or '-'}:{verb.group(1).upper() if verb else '?'}"
+        record("sql", time.perf_counter() - started, name)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        started = context.connection.info.get("_timing_started") if context.connection is not None else None
+        if started:
+            started.pop()
@@ -0,0 +1,93 @@
+# File: utils/don_vi_cong_viec.py
+
+import asyncio
+import logging
+from typing import Any, Callable
+
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from utils.do_thoi_gian import span
+
+logger = logging.getLogger(__name__)
+
+
+def run_after_commit(callbacks: list[Callable[[], Any]]) -> None:
+    """Chạy các callback sau commit; callback lỗi chỉ được ghi log (dữ liệu đã ghi xong)."""
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Lỗi callback sau commit: {e}")
+
+
+class UnitOfWork:
+    """
+    Một kết nối và một transaction cho cả lượt hội thoại (mọi lượt gọi tool của agent trong một /chat):
+    - Kết nối chỉ được lấy từ pool ở lượt gọi tool đầu tiên; lượt không chạm DB (chào hỏi) không tốn kết nối.
+    - Từ lượt gọi tool thứ hai, mỗi lượt chạy trong một SAVEPOINT: tool lỗi chỉ hủy phần nó đã ghi,
+      agent vẫn gọi tiếp được (kể cả ở bước sau).
+    - `close(commit=True)` khi lượt kết thúc bình thường => ghi tất cả một lần; lượt bị lỗi / bị hủy
+      (LLM lỗi ở bước sau, client ngắt) => rollback toàn bộ, không để lại nửa lượt đã ghi.
+    - `task_ids`: tiêu đề -> task_id đã tìm trong lượt, để các tool sau không tra lại.
+    - `after_commit(cb)`: việc chỉ làm khi dữ liệu đã thật sự được ghi (báo bộ nhắc lịch); lượt gọi tool
+      bị rollback thì bỏ các callback nó đã đăng ký.
+    Các tool chạy đồng thời trong lượt dùng chung kết nối lần lượt (`_lock`); phần SQL mỗi tool chỉ vài ms.
+    Lưu ý: khóa dòng của các lệnh ghi được giữ tới cuối lượt (thường là thêm một lần gọi LLM).
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self._engine = engine
+        self._connection: AsyncConnection | None = None
+        self._lock = asyncio.Lock()
+        self.task_ids: dict[tuple[str, str], int] = {}
+        self.calls = 0
+        self._after_commit: list[Callable[[], Any]] = []
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Chạy `fn(connection, ...)` (sync, qua `run_sync`) trên kết nối của lượt, trong một SAVEPOINT."""
+        async with self._lock:
+            if self._connection is None:
+                with span("db", "checkout"):
+                    self._connection = await self._engine.connect()
+            # Chưa có gì trong transaction => không cần SAVEPOINT: lỗi thì rollback cả transaction là đủ
+            # (lượt chỉ gọi một tool tốn đúng số round trip như khi tool tự mở kết nối).
+            savepoint = None
+            if self._connection.in_transaction():
+                savepoint = await self._connection.begin_nested()
+            else:
+                await self._connection.begin()
+            self.calls += 1
+            registered = len(self._after_commit)
+            try:
+                result = await self._connection.run_sync(fn, *args, **kwargs)
+            except BaseException:
+                await (savepoint or self._connection).rollback()
+                self.task_ids.clear()  # Có thể đã ghi nhớ task vừa bị hủy
+                del self._after_commit[registered:]
+                raise
+            if savepoint is not None:
+                await savepoint.commit()
+            return result
+
+    def forget_task_ids(self) -> None:
+        """Gọi sau khi tạo / xóa task: tiêu đề cũ có thể khớp task khác."""
+        self.task_ids.clear()
+
+    def after_commit(self, callback: Callable[[], Any]) -> None:
+        self._after_commit.append(callback)
+
+    async def close(self, commit: bool) -> None:
+        connection, self._connection = self._connection, None
+        callbacks, self._after_commit = self._after_commit, []
+        if connection is None:
+            return
+        try:
+            with span("db", "commit" if commit else "rollback"):
+                if commit:
+                    await connection.commit()
+                else:
+                    await connection.rollback()
+        finally:
+            await connection.close()
+        if commit:
+            run_after_commit(callbacks)
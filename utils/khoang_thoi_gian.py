@@ -0,0 +1,156 @@
+# File: utils/khoang_thoi_gian.py
+
+import base64
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+# Các truy vấn dựa trên migrations/003_schedule_ranges.sql:
+# - index (user_id, start_time, id) cho lọc nửa mở + phân trang keyset,
+# - index GiST (user_id, schedule_period(...)) cho toán tử chồng lấn `&&`.
+# Ngày được đổi sang mốc thời gian ngay trong SQL (theo múi giờ của phiên DB, như khi ghi lịch).
+
+# --- TÌM LỊCH THEO KHOẢNG + PHÂN TRANG KEYSET ---
+
+SCHEDULE_RANGE_QUERY = text("""
+    SELECT s.id, s.task_id, t.title, s.start_time, s.end_time
+    FROM schedules s
+    JOIN tasks t ON t.id = s.task_id
+    WHERE s.user_id = :user_id
+      AND s.start_time >= CAST(:start_date AS date)::timestamptz
+      AND s.start_time < (CAST(:end_date AS date) + 1)::timestamptz
+      AND (s.start_time, s.id) > (coalesce(CAST(:after_start AS timestamptz), '-infinity'), coalesce(CAST(:after_id AS bigint), 0))
+    ORDER BY s.start_time, s.id
+    LIMIT :limit;
+""")
+
+
+def encode_cursor(start_time: datetime, schedule_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{start_time.isoformat()}|{schedule_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Ném ValueError nếu con trỏ không hợp lệ."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        start_time, schedule_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(start_time), int(schedule_id)
+    except Exception as e:
+        raise ValueError(f"Con trỏ phân trang không hợp lệ: {cursor}") from e
+
+
+def find_schedules(connection, user_id: str, start_date: date | str, end_date: date | str,
+                   cursor: str | None = None, limit: int = 20) -> tuple[list, str | None]:
+    """
+    Lịch trình có giờ bắt đầu trong [start_date, end_date] (tính cả ngày cuối), theo thứ tự thời gian.
+    Trả về (các dòng, con trỏ trang sau hoặc None nếu đã hết).
+    """
+    after_start, after_id = decode_cursor(cursor) if cursor else (None, None)
+    rows = connection.execute(SCHEDULE_RANGE_QUERY, {
+        "user_id": user_id, "start_date": str(start_date), "end_date": str(end_date),
+        "after_start": after_start, "after_id": after_id, "limit": limit + 1,
+    }).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].start_time, rows[-1].id)
+
+# --- TRÙNG GIỜ ---
+
+CONFLICTS_QUERY = text("""
+    SELECT s.id, s.task_id, t.title, s.start_time, s.end_time
+    FROM schedules s
+    JOIN tasks t ON t.id = s.task_id
+    WHERE s.user_id = :user_id
+      AND public.schedule_period(s.start_time, s.end_time)
+          && public.schedule_period(CAST(:start_time AS timestamptz), CAST(:end_time AS timestamptz))
+      AND s.task_id IS DISTINCT FROM CAST(:exclude_task_id AS bigint)
+    ORDER BY s.start_time
+    LIMIT :limit;
+""")
+
+TASK_CONFLICTS_QUERY = text("""
+    SELECT a.task_id, ta.title, tb.title AS other_title, b.start_time AS other_start_time, b.end_time AS other_end_time
+    FROM schedules a
+    JOIN tasks ta ON ta.id = a.task_id
+    JOIN schedules b ON b.user_id = a.user_id AND b.id <> a.id
+     AND public.schedule_period(b.start_time, b.end_time) && public.schedule_period(a.start_time, a.end_time)
+    JOIN tasks tb ON tb.id = b.task_id
+    WHERE a.user_id = :user_id AND a.task_id = ANY(:task_ids)
+      -- Hai lịch cùng trong `task_ids` chồng nhau chỉ báo một lần (a.id < b.id); lịch đã có từ trước luôn được báo.
+      AND (a.id < b.id OR b.task_id <> ALL(:task_ids))
+    ORDER BY a.start_time, b.start_time;
+""")
+
+
+def find_conflicts(connection, user_id: str, start_time, end_time, exclude_task_id: int | None = None,
+                   limit: int = 5) -> list:
+    """Các lịch trình chồng lên khoảng [start_time, end_time); bỏ qua lịch của `exclude_task_id` (khi dời lịch)."""
+    return connection.execute(CONFLICTS_QUERY, {
+        "user_id": user_id, "start_time": start_time, "end_time": end_time,
+        "exclude_task_id": exclude_task_id, "limit": limit,
+    }).fetchall()
+
+
+def find_task_conflicts(connection, user_id: str, task_ids: list[int]) -> list:
+    """
+    Các cặp (lịch của task trong `task_ids`, lịch khác chồng lên nó), dùng sau khi tạo nhiều lịch một lúc.
+    Mỗi cặp chồng nhau chỉ xuất hiện một lần, kể cả khi cả hai lịch đều thuộc `task_ids`.
+    """
+    if not task_ids:
+        return []
+    return connection.execute(TASK_CONFLICTS_QUERY, {"user_id": user_id, "task_ids": list(task_ids)}).fetchall()
+
+
+def describe_conflicts(rows, title_field: str = "title", start_field: str = "start_time",
+                       end_field: str = "end_time") -> str:
+    """vd: "'Họp nhóm' (09:00–10:00 06/01)"."""
+    parts = []
+    for row in rows:
+        start, end = getattr(row, start_field), getattr(row, end_field)
+        span = f"{start:%H:%M}–{end:%H:%M}" if end else f"{start:%H:%M}"
+        parts.append(f"'{getattr(row, title_field)}' ({span} {start:%d/%m})")
+    return ", ".join(parts)
+
+# --- GIỜ BẬN / GIỜ RẢNH ---
+
+# Khung giờ mỗi ngày trừ đi tổng các khoảng bận (multirange, PostgreSQL 14+), bỏ phần đã qua.
+FREE_BUSY_QUERY = text("""
+    WITH bounds AS (
+        SELECT tstzrange(CAST(:start_date AS date)::timestamptz, (CAST(:end_date AS date) + 1)::timestamptz, '[)') AS r
+    ), windows AS (
+        SELECT range_agg(tstzrange((d::date + CAST(:day_start AS time))::timestamptz,
+                                   (d::date + CAST(:day_end AS time))::timestamptz, '[)')) AS w
+        FROM generate_series(CAST(:start_date AS date), CAST(:end_date AS date), interval '1 day') AS d
+    ), busy AS (
+        SELECT coalesce(range_agg(public.schedule_period(s.start_time, s.end_time)), '{}'::tstzmultirange) AS b
+        FROM schedules s, bounds
+        WHERE s.user_id = :user_id AND public.schedule_period(s.start_time, s.end_time) && bounds.r
+    )
+    SELECT 'busy' AS kind, lower(slot) AS start_time, upper(slot) AS end_time
+    FROM busy, bounds, unnest(busy.b * tstzmultirange(bounds.r)) AS slot
+    UNION ALL
+    SELECT 'free', lower(slot), upper(slot)
+    FROM windows, busy, unnest((windows.w - busy.b) * tstzmultirange(tstzrange(now(), NULL))) AS slot
+    WHERE upper(slot) - lower(slot) >= make_interval(mins => :min_minutes)
+    ORDER BY 2;
+""")
+
+
+@dataclass
+class FreeBusy:
+    busy: list[tuple[datetime, datetime]]   # các khoảng bận đã gộp
+    free: list[tuple[datetime, datetime]]   # các khoảng rảnh trong khung giờ mỗi ngày, dài >= min_minutes
+
+
+def free_busy(connection, user_id: str, start_date: date | str, end_date: date | str, min_minutes: int = 30,
+              day_start: str = "07:00", day_end: str = "22:00") -> FreeBusy:
+    rows = connection.execute(FREE_BUSY_QUERY, {
+        "user_id": user_id, "start_date": str(start_date), "end_date": str(end_date),
+        "min_minutes": min_minutes, "day_start": day_start, "day_end": day_end,
+    }).fetchall()
+    result = FreeBusy(busy=[], free=[])
+    for row in rows:
+        (result.busy if row.kind == "busy" else result.free).append((row.start_time, row.end_time))
+    return result
@@ -0,0 +1,250 @@
+# File: utils/lich_su_hoi_thoai.py
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Sequence
+
+from cachetools import TTLCache
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Integer, MetaData, String, Table, Text, delete, func, insert, select, update,
+)
+from sqlalchemy.engine.base import Engine
+
+# --- TÓM TẮT CÁC LƯỢT CŨ ---
+
+SUMMARY_HEADER = "Tóm tắt các lượt trò chuyện trước (đã rút gọn):"
+SUMMARY_ACK = "Đã ghi nhận bản tóm tắt, tôi sẽ tiếp tục từ đó."
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    """Ước lượng rẻ: ~4 ký tự / token, cộng chi phí cố định cho mỗi message."""
+    content = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+    return len(content) // 4 + 4
+
+
+def summarize_messages(summary: str, dropped: Sequence[BaseMessage], max_chars: int = 1500) -> str:
+    """
+    Gộp các message bị đẩy ra khỏi cửa sổ vào bản tóm tắt đang có.
+    Không gọi LLM: mỗi message được cắt ngắn, bản tóm tắt chỉ giữ phần mới nhất trong `max_chars`.
+    """
+    lines = [summary] if summary else []
+    for message in dropped:
+        content = message.content if isinstance(message.content, str) else ""
+        if not content:
+            continue
+        speaker = "Người dùng" if isinstance(message, HumanMessage) else "Skedule"
+        short = content if len(content) <= 200 else content[:200] + "…"
+        lines.append(f"- {speaker}: {short}")
+    merged = "\n".join(lines)
+    return merged[-max_chars:]
+
+
+class WindowPolicy:
+    """Giới hạn số message / token được gửi lại cho LLM mỗi lượt."""
+
+    def __init__(self, max_messages: int = 20, max_tokens: int = 2000,
+                 summarizer: Callable[[str, Sequence[BaseMessage]], str] = summarize_messages):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+
+    def split(self, messages: list[BaseMessage]) -> tuple[list[BaseMessage], list[BaseMessage]]:
+        """Trả về (các message cần tóm tắt, các message giữ lại). Luôn cắt theo cả lượt hội thoại."""
+        cut = 0
+        total_tokens = sum(estimate_tokens(m) for m in messages)
+        while cut < len(messages) - 1 and (len(messages) - cut > self.max_messages or total_tokens > self.max_tokens):
+            total_tokens -= estimate_tokens(messages[cut])
+            cut += 1
+        # Cửa sổ giữ lại phải bắt đầu bằng câu của người dùng
+        while cut < len(messages) - 1 and not isinstance(messages[cut], HumanMessage):
+            cut += 1
+        return messages[:cut], messages[cut:]
+
+
+def _with_summary(summary: str, messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Đặt bản tóm tắt trước cửa sổ dưới dạng một cặp Human/AI, KHÔNG dùng SystemMessage:
+    langchain_google_genai gộp mọi SystemMessage vào `system_instruction`, khi đó tóm tắt của từng phiên
+    làm đổi tiền tố (system prompt + tools) và mất cache tiền tố của Gemini.
+    """
+    if not summary:
+        return messages
+    return [HumanMessage(content=f"{SUMMARY_HEADER}\n{summary}"), AIMessage(content=SUMMARY_ACK)] + messages
+
+# --- BACKEND TRONG BỘ NHỚ ---
+
+
+class WindowedChatMessageHistory(BaseChatMessageHistory):
+    """Lịch sử trong RAM của một phiên: cửa sổ message gần nhất + bản tóm tắt các lượt cũ."""
+
+    def __init__(self, policy: WindowPolicy):
+        self.policy = policy
+        self.summary = ""
+        self.recent: list[BaseMessage] = []
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        with self._lock:
+            return _with_summary(self.summary, list(self.recent))
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        with self._lock:
+            dropped, self.recent = self.policy.split(self.recent + list(messages))
+            if dropped:
+                self.summary = self.policy.summarizer(self.summary, dropped)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.summary = ""
+            self.recent = []
+
+# --- BACKEND SQL (dùng chung giữa nhiều worker) ---
+
+# Trên Postgres các bảng do migrations/006_chat_history.sql tạo; create_all chỉ dùng cho CSDL khác (SQLite khi dev).
+metadata = MetaData()
+
+chat_messages = Table(
+    "chat_messages", metadata,
+    Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+    Column("session_id", String(255), nullable=False, index=True),
+    Column("message", Text, nullable=False),
+    Column("created_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+)
+
+chat_summaries = Table(
+    "chat_summaries", metadata,
+    Column("session_id", String(255), primary_key=True),
+    Column("summary", Text, nullable=False),
+    Column("updated_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+)
+
+
+class SQLWindowedChatMessageHistory(BaseChatMessageHistory):
+    """
+    Lịch sử lưu trong SQLite/Postgres để mọi worker uvicorn thấy cùng một cuộc trò chuyện.
+    Mỗi lần thêm message, phần vượt cửa sổ được tóm tắt và xóa ngay trong cùng transaction.
+    """
+
+    def __init__(self, session_id: str, engine: Engine, policy: WindowPolicy):
+        self.session_id = session_id
+        self.engine = engine
+        self.policy = policy
+
+    def _load(self, connection) -> tuple[str, list[tuple[int, BaseMessage]]]:
+        summary = connection.execute(
+            select(chat_summaries.c.summary).where(chat_summaries.c.session_id == self.session_id)
+        ).scalar_one_or_none() or ""
+        rows = connection.execute(
+            select(chat_messages.c.id, chat_messages.c.message)
+            .where(chat_messages.c.session_id == self.session_id)
+            .order_by(chat_messages.c.id)
+        ).fetchall()
+        messages = messages_from_dict([json.loads(row.message) for row in rows])
+        return summary, list(zip([row.id for row in rows], messages))
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        with self.engine.connect() as connection:
+            summary, rows = self._load(connection)
+        return _with_summary(summary, [message for _, message in rows])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(insert(chat_messages), [
+                {"session_id": self.session_id, "message": json.dumps(message_to_dict(m), ensure_ascii=False)}
+                for m in messages
+            ])
+            summary, rows = self._load(connection)
+            dropped, _ = self.policy.split([message for _, message in rows])
+            if not dropped:
+                return
+
+            new_summary = self.policy.summarizer(summary, dropped)
+            last_dropped_id = rows[len(dropped) - 1][0]
+            connection.execute(
+                delete(chat_messages)
+                .where(chat_messages.c.session_id == self.session_id)
+                .where(chat_messages.c.id <= last_dropped_id)
+            )
+            updated = connection.execute(
+                update(chat_summaries)
+                .where(chat_summaries.c.session_id == self.session_id)
+                .values(summary=new_summary, updated_at=func.now())
+            )
+            if updated.rowcount == 0:
+                connection.execute(insert(chat_summaries).values(session_id=self.session_id, summary=new_summary))
+
+    def clear(self) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(delete(chat_messages).where(chat_messages.c.session_id == self.session_id))
+            connection.execute(delete(chat_summaries).where(chat_summaries.c.session_id == self.session_id))
+
+# --- KHO LỊCH SỬ THEO PHIÊN ---
+
+
+class ChatHistoryStore:
+    """
+    Thay cho `store = {}`: giữ tối đa `max_sessions` phiên, phiên không hoạt động quá
+    `idle_ttl` giây sẽ bị loại (LRU + TTL, thời hạn được làm mới mỗi lần truy cập).
+    - backend "memory": lịch sử nằm trong RAM của worker.
+    - backend "sql": lịch sử nằm trong CSDL, cache ở đây chỉ giữ đối tượng truy cập;
+      dòng của phiên hết hạn được xóa bằng `purge_expired()` (gọi định kỳ).
+    """
+
+    def __init__(self, backend: str = "memory", engine: Engine | None = None, policy: WindowPolicy | None = None,
+                 max_sessions: int = 1000, idle_ttl: int = 3600):
+        if backend not in ("memory", "sql"):
+            raise ValueError(f"Backend lịch sử không hợp lệ: {backend}")
+        if backend == "sql":
+            if engine is None:
+                raise ValueError("Backend 'sql' cần một SQLAlchemy engine.")
+            if engine.dialect.name != "postgresql":
+                metadata.create_all(engine)
+        self.backend = backend
+        self.engine = engine
+        self.policy = policy or WindowPolicy()
+        self.idle_ttl = idle_ttl
+        self._sessions: TTLCache = TTLCache(maxsize=max_sessions, ttl=idle_ttl)
+        self._lock = threading.Lock()
+
+    def _create(self, session_id: str) -> BaseChatMessageHistory:
+        if self.backend == "sql":
+            return SQLWindowedChatMessageHistory(session_id, self.engine, self.policy)
+        return WindowedChatMessageHistory(self.policy)
+
+    def get(self, session_id: str) -> BaseChatMessageHistory:
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None:
+                history = self._create(session_id)
+            # Gán lại để làm mới thời hạn idle TTL
+            self._sessions[session_id] = history
+            return history
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def purge_expired(self) -> int:
+        """Backend "sql": xóa lịch sử của các phiên không ghi gì trong `idle_ttl` giây. Trả về số message đã xóa."""
+        if self.backend != "sql":
+            return 0
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.idle_ttl)
+        expired = (
+            select(chat_messages.c.session_id)
+            .group_by(chat_messages.c.session_id)
+            .having(func.max(chat_messages.c.created_at) < cutoff)
+        )
+        with self.engine.begin() as connection:
+            deleted = connection.execute(delete(chat_messages).where(chat_messages.c.session_id.in_(expired))).rowcount
+            # Bản tóm tắt chỉ được ghi khi cắt cửa sổ; phiên còn message thì vẫn đang dùng dù tóm tắt đã cũ.
+            connection.execute(
+                delete(chat_summaries)
+                .where(chat_summaries.c.updated_at < cutoff)
+                .where(~select(chat_messages.c.id).where(chat_messages.c.session_id == chat_summaries.c.session_id).exists())
+            )
+        return deleted
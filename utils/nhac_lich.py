@@ -0,0 +1,327 @@
+# File: utils/nhac_lich.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from utils.do_thoi_gian import REMINDER_LAG_SECONDS, REMINDER_QUEUE, REMINDERS, span
+
+logger = logging.getLogger(__name__)
+
+# Các truy vấn dựa trên migrations/005_reminder_dispatch.sql (index theo start_time / remind_at).
+
+# Khung thời gian sắp tới của MỌI người dùng trong một truy vấn:
+# - 'lich': schedule sắp bắt đầu, nhắc trước `lead_seconds` giây (đã quá giờ nhắc nhưng chưa bắt đầu => nhắc ngay),
+# - 'nhac': dòng trong `reminders`, kể cả những dòng lỡ trong `catchup_from` (tiến trình vừa khởi động lại).
+WINDOW_QUERY = text("""
+    SELECT source, source_id, task_id, start_time, remind_at FROM (
+        SELECT 'lich' AS source, s.id AS source_id, s.task_id, s.start_time,
+               s.start_time - make_interval(secs => :lead_seconds) AS remind_at
+        FROM schedules s
+        JOIN tasks t ON t.id = s.task_id
+        WHERE s.start_time > CAST(:now AS timestamptz)
+          AND s.start_time <= CAST(:until AS timestamptz) + make_interval(secs => :lead_seconds)
+          AND NOT t.is_completed
+        UNION ALL
+        SELECT 'nhac', r.id, r.task_id, NULL, r.remind_at
+        FROM reminders r
+        JOIN tasks t ON t.id = r.task_id
+        WHERE r.remind_at > CAST(:catchup_from AS timestamptz)
+          AND r.remind_at <= CAST(:until AS timestamptz)
+          AND NOT t.is_completed
+    ) due
+    ORDER BY remind_at
+    LIMIT :limit;
+""")
+
+# Ghi một lô thông báo trong một câu lệnh. Kiểm tra lại với dữ liệu hiện tại (lịch chưa bị dời / xóa,
+# task chưa xong) nên nhắc nhở cũ trong bộ nhớ không bao giờ được gửi sai; trùng thì bỏ qua (UNIQUE).
+STORE_QUERY = text("""
+    INSERT INTO notifications (user_id, task_id, source, source_id, title, start_time, remind_at)
+    SELECT t.user_id, t.id, n.source, n.source_id, t.title, n.start_time, n.remind_at
+    FROM unnest(CAST(:sources AS text[]), CAST(:source_ids AS bigint[]), CAST(:task_ids AS bigint[]),
+                CAST(:start_times AS timestamptz[]), CAST(:remind_ats AS timestamptz[]))
+         AS n(source, source_id, task_id, start_time, remind_at)
+    JOIN tasks t ON t.id = n.task_id AND NOT t.is_completed
+    WHERE (n.source = 'lich' AND EXISTS (
+              SELECT 1 FROM schedules s WHERE s.id = n.source_id AND s.start_time = n.start_time))
+       OR (n.source = 'nhac' AND EXISTS (
+              SELECT 1 FROM reminders r WHERE r.id = n.source_id AND r.remind_at = n.remind_at))
+    ON CONFLICT (source, source_id, remind_at) DO NOTHING
+    RETURNING source, source_id;
+""")
+
+
+@dataclass(slots=True)
+class NhacNho:
+    source: str            # 'lich' | 'nhac'
+    source_id: int
+    task_id: int
+    start_time: datetime | None
+    remind_at: datetime
+    seq: int = 0           # Khớp với mục trong heap; mục có seq cũ là mục đã bị thay / xóa
+    queued_at: float = 0.0  # Lúc vào heap (epoch), để độ trễ không tính phần lịch được tạo khi đã quá giờ nhắc
+
+    @property
+    def key(self) -> tuple[str, int]:
+        return self.source, self.source_id
+
+
+class ReminderDispatcher:
+    """
+    Gửi nhắc lịch cho mọi người dùng mà không hỏi DB theo từng người:
+    - Mỗi `refresh_seconds`, nạp các nhắc nhở đến hạn trong `window` tới bằng MỘT truy vấn khoảng có index,
+      giữ trong heap theo giờ nhắc. Bộ nhớ chỉ phụ thuộc số nhắc nhở trong khung (tối đa `max_entries`),
+      không phụ thuộc tổng số lịch trong tương lai.
+    - Tool tạo / dời / xóa lịch báo thay đổi sau khi commit (`schedule_changed`, `task_removed`) => áp ngay vào heap,
+      không chờ lần nạp sau. Dữ liệu ứng dụng ghi thẳng vào Supabase được lần nạp kế tiếp cập nhật.
+    - Đến giờ: lấy tất cả nhắc nhở đã đến hạn (tối đa `batch_size` mỗi lô) và ghi vào `notifications`
+      bằng một câu lệnh; lô lỗi được thử lại sau `retry_seconds`.
+    Các hàm báo thay đổi an toàn khi gọi từ luồng khác (tool bản sync).
+    """
+
+    def __init__(self, engine: AsyncEngine, lead: timedelta = timedelta(minutes=15),
+                 window: timedelta = timedelta(minutes=30), refresh_seconds: float = 60,
+                 catchup: timedelta = timedelta(minutes=10), max_entries: int = 100_000,
+                 batch_size: int = 500, retry_seconds: float = 5):
+        self._engine = engine
+        self.lead = lead
+        self.window = window
+        self.refresh_seconds = refresh_seconds
+        self.catchup = catchup
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self._entries: dict[tuple[str, int], NhacNho] = {}
+        self._by_task: dict[int, list[tuple[str, int]]] = {}  # list: mỗi task thường chỉ có 1–2 nhắc nhở
+        self._heap: list[tuple[float, int, tuple[str, int]]] = []
+        self._sent: dict[tuple[str, int], datetime] = {}  # Đã gửi (theo giờ nhắc), để lần nạp sau không gửi lại
+        self._horizon: datetime | None = None  # Giờ nhắc xa nhất đã nạp; thay đổi xa hơn để lần nạp sau lo
+        self._replay: list | None = None  # Thay đổi đến trong lúc đang nạp khung, áp lại sau khi nạp xong
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._retry_at = 0.0
+
+    # --- VÒNG LẶP ---
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run(), name="reminder-dispatcher")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        next_refresh = 0.0
+        while True:
+            self._wake.clear()  # Trước khi xét heap: thay đổi đến sau đó sẽ đánh thức vòng lặp
+            if time.monotonic() >= next_refresh:
+                try:
+                    await self.refresh()
+                    next_refresh = time.monotonic() + self.refresh_seconds
+                except Exception as e:
+                    logger.error(f"Lỗi nạp lịch cần nhắc: {e}")
+                    next_refresh = time.monotonic() + min(self.refresh_seconds, self.retry_seconds)
+            await self.dispatch_due()
+            delay = min(next_refresh - time.monotonic(), self._seconds_until_due())
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _seconds_until_due(self) -> float:
+        with self._lock:
+            self._drop_stale_heads()
+            if not self._heap:
+                return float("inf")
+            due = self._heap[0][0] - time.time()
+        return max(due, self._retry_at - time.monotonic())
+
+    def _notify(self) -> None:
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # --- NẠP KHUNG THỜI GIAN ---
+
+    async def refresh(self, now: datetime | None = None) -> int:
+        """Nạp lại khung (now, now + window] từ DB (một truy vấn). Trả về số nhắc nhở đang chờ."""
+        now = now or datetime.now(timezone.utc)
+        until = now + self.window
+        with self._lock:
+            self._replay = []
+        try:
+            with span("reminder", "load"):
+                async with self._engine.connect() as connection:
+                    rows = (await connection.execute(WINDOW_QUERY, {
+                        "now": now, "until": until, "catchup_from": now - self.catchup,
+                        "lead_seconds": self.lead.total_seconds(), "limit": self.max_entries,
+                    })).fetchall()
+        except BaseException:
+            with self._lock:
+                self._replay = None
+            raise
+        with self._lock:
+            # Quá `max_entries` => chỉ giữ tới giờ nhắc của dòng cuối; phần sau được nạp khi heap vơi đi.
+            self._horizon = rows[-1].remind_at if len(rows) >= self.max_entries else until
+            self._entries.clear()
+            self._by_task.clear()
+            self._heap = []
+            for row in rows:
+                if self._sent.get((row.source, row.source_id)) != row.remind_at:
+                    self._heap.append(self._put(NhacNho(row.source, row.source_id, row.task_id, row.start_time,
+                                                        row.remind_at)))
+            heapq.heapify(self._heap)
+            replay, self._replay = self._replay, None
+            for change, args in replay:
+                change(*args)
+            cutoff = now - max(self.lead, self.catchup)
+            self._sent = {key: at for key, at in self._sent.items() if at >= cutoff}
+            REMINDER_QUEUE.set(len(self._entries))
+            pending = len(self._entries)
+        self._notify()
+        return pending
+
+    # --- THAY ĐỔI TỪ TOOL (gọi sau khi commit) ---
+
+    def schedule_changed(self, schedule_id: int, task_id: int, start_time: datetime) -> None:
+        """Lịch vừa được tạo / dời: đặt lại giờ nhắc (bỏ giờ nhắc cũ)."""
+        with self._lock:
+            self._apply(self._schedule_changed, schedule_id, task_id, start_time)
+        self._notify()
+
+    def task_removed(self, task_id: int) -> None:
+        """Task bị xóa / đã hoàn thành: bỏ mọi nhắc nhở của task."""
+        with self._lock:
+            self._apply(self._task_removed, task_id)
+
+    def _apply(self, change, *args) -> None:
+        change(*args)
+        if self._replay is not None:
+            self._replay.append((change, args))
+
+    def _schedule_changed(self, schedule_id: int, task_id: int, start_time: datetime) -> None:
+        self._remove(("lich", schedule_id))
+        remind_at = start_time - self.lead
+        if self._horizon is None or remind_at > self._horizon or start_time <= datetime.now(timezone.utc):
+            return
+        if self._sent.get(("lich", schedule_id)) == remind_at:
+            return
+        heapq.heappush(self._heap, self._put(NhacNho("lich", schedule_id, task_id, start_time, remind_at)))
+        REMINDER_QUEUE.set(len(self._entries))
+
+    def _task_removed(self, task_id: int) -> None:
+        for key in list(self._by_task.get(task_id, ())):
+            self._remove(key)
+        REMINDER_QUEUE.set(len(self._entries))
+
+    def _put(self, entry: NhacNho) -> tuple[float, int, tuple[str, int]]:
+        """Thêm vào bảng; trả về mục heap tương ứng (nơi gọi heapify khi nạp cả khung, heappush khi thêm một mục)."""
+        entry.seq = next(self._seq)
+        entry.queued_at = time.time()
+        self._entries[entry.key] = entry
+        self._by_task.setdefault(entry.task_id, []).append(entry.key)
+        return entry.remind_at.timestamp(), entry.seq, entry.key
+
+    def _remove(self, key: tuple[str, int]) -> None:
+        """Bỏ khỏi bảng; mục trong heap thành mục cũ và bị bỏ qua khi tới lượt (xóa lười)."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_task.get(entry.task_id)
+        if keys is not None and key in keys:
+            keys.remove(key)
+            if not keys:
+                del self._by_task[entry.task_id]
+        if len(self._heap) > 2 * len(self._entries) + 1024:  # Quá nhiều mục cũ => dọn heap
+            self._heap = [item for item in self._heap if self._is_current(item)]
+            heapq.heapify(self._heap)
+
+    def _is_current(self, item: tuple[float, int, tuple[str, int]]) -> bool:
+        entry = self._entries.get(item[2])
+        return entry is not None and entry.seq == item[1]
+
+    def _drop_stale_heads(self) -> None:
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    # --- GỬI ---
+
+    def _pop_due(self, now: float) -> list[NhacNho]:
+        batch = []
+        with self._lock:
+            while self._heap and len(batch) < self.batch_size:
+                self._drop_stale_heads()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                _, _, key = heapq.heappop(self._heap)
+                batch.append(self._entries[key])
+        return batch
+
+    async def dispatch_due(self) -> int:
+        """Gửi mọi nhắc nhở đã đến giờ, theo từng lô. Trả về số thông báo đã ghi."""
+        if time.monotonic() < self._retry_at:
+            return 0
+        sent = 0
+        while batch := self._pop_due(time.time()):
+            try:
+                with span("reminder", "deliver"):
+                    delivered = await self._deliver(batch)
+            except Exception as e:
+                logger.error(f"Lỗi gửi {len(batch)} nhắc lịch: {e}")
+                REMINDERS.labels(result="failed").inc(len(batch))
+                self._retry_at = time.monotonic() + self.retry_seconds
+                with self._lock:
+                    for entry in batch:
+                        if self._entries.get(entry.key) is entry:
+                            heapq.heappush(self._heap, (entry.remind_at.timestamp(), entry.seq, entry.key))
+                break
+            finished = time.time()
+            with self._lock:
+                for entry in batch:
+                    self._sent[entry.key] = entry.remind_at
+                    if self._entries.get(entry.key) is entry:  # Chưa bị thay trong lúc đang gửi
+                        self._remove(entry.key)
+                REMINDER_QUEUE.set(len(self._entries))
+            for entry in batch:
+                if entry.key in delivered:
+                    due = max(entry.remind_at.timestamp(), entry.queued_at)
+                    REMINDER_LAG_SECONDS.observe(max(finished - due, 0.0))
+            REMINDERS.labels(result="sent").inc(len(delivered))
+            REMINDERS.labels(result="skipped").inc(len(batch) - len(delivered))
+            sent += len(delivered)
+        return sent
+
+    async def _deliver(self, batch: list[NhacNho]) -> set[tuple[str, int]]:
+        async with self._engine.begin() as connection:
+            rows = (await connection.execute(STORE_QUERY, {
+                "sources": [entry.source for entry in batch],
+                "source_ids": [entry.source_id for entry in batch],
+                "task_ids": [entry.task_id for entry in batch],
+                "start_times": [entry.start_time for entry in batch],
+                "remind_ats": [entry.remind_at for entry in batch],
+            })).fetchall()
+        return {(row.source, row.source_id) for row in rows}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._entries),
+                "heap": len(self._heap),
+                "sent": len(self._sent),
+                "horizon": self._horizon.isoformat() if self._horizon else None,
+            }
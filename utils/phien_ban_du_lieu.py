@@ -0,0 +1,68 @@
+# File: utils/phien_ban_du_lieu.py
+
+import threading
+import time
+from typing import Any
+
+from cachetools import TLRUCache
+from sqlalchemy import text
+
+# --- PHIÊN BẢN DỮ LIỆU THEO NGƯỜI DÙNG (bảng user_data_versions) ---
+# `version` chỉ được tăng bằng trigger của migrations/004 (mọi nơi ghi, kể cả app Flutter),
+# trong cùng transaction và chỉ khi câu lệnh thực sự thay đổi dòng nào đó.
+
+GET_DATA_VERSION_QUERY = text("SELECT version FROM user_data_versions WHERE user_id = :user_id;")
+
+
+# `pending`: transaction hiện tại đã ghi gì đó (đã được cấp xid) mà chưa commit.
+GET_DATA_VERSION_STATE_QUERY = text("""
+    SELECT COALESCE((SELECT version FROM user_data_versions WHERE user_id = :user_id), 0) AS version,
+           pg_current_xact_id_if_assigned() IS NOT NULL AS pending;
+""")
+
+
+def get_data_version(connection, user_id: str) -> int:
+    return connection.execute(GET_DATA_VERSION_QUERY, {"user_id": user_id}).scalar_one_or_none() or 0
+
+
+def get_data_version_state(connection, user_id: str) -> tuple[int, bool]:
+    """
+    Trả về (version, pending). Khi `pending`, version đọc được có thể chưa commit (trigger vừa tăng
+    trong transaction này) và sẽ mất nếu lượt bị rollback: không được dùng làm khóa khi ghi cache.
+    """
+    row = connection.execute(GET_DATA_VERSION_STATE_QUERY, {"user_id": user_id}).one()
+    return row.version, row.pending
+
+# --- CACHE THEO PHIÊN BẢN ---
+
+
+class VersionedCache:
+    """
+    Cache giá trị gắn với phiên bản dữ liệu của người dùng.
+    Một mục chỉ được dùng khi version còn khớp và chưa quá thời hạn `expires_at` của nó.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self._cache = TLRUCache(maxsize=maxsize, ttu=lambda _key, value, _now: value[2], timer=time.time)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version: int) -> Any | None:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, version: int, value: Any, expires_at: float) -> None:
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._cache[key] = (version, value, expires_at)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._cache)}
@@ -1,7 +1,14 @@
 # File: utils/thoi_gian_tu_nhien.py
 
 import re
-from datetime import datetime, timedelta
+import unicodedata
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Iterable
+
+# Thời lượng mặc định khi câu nói không nêu giờ kết thúc / thời lượng.
+DEFAULT_DURATION = timedelta(hours=1)
 
 # --- CÁC HÀM PHỤ TRỢ ---
 
@@ -25,42 +32,405 @@ def end_of_month(dt: datetime) -> datetime:
     next_month = add_months(dt, 1).replace(day=1)
     return next_month - timedelta(days=1)
 
+
+def _first_of_month(d: date, months: int = 0) -> date:
+    month = d.month - 1 + months
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+# --- TỪ VỰNG & MẪU CÂU (biên dịch sẵn một lần) ---
+
+_NUMBER_WORDS = {
+    "mười một": 11, "mười hai": 12, "một": 1, "hai": 2, "ba": 3, "bốn": 4, "tư": 4, "năm": 5,
+    "sáu": 6, "bảy": 7, "tám": 8, "chín": 9, "mười": 10, "nửa": 0.5,
+}
+_NUM = r"(?:\d+|" + "|".join(_NUMBER_WORDS) + ")"
+# Giờ đọc bằng chữ ("năm giờ chiều", "hai rưỡi"); từ dài trước để "mười một" không khớp thành "mười".
+_HOUR_WORDS = r"\b(?:" + "|".join(sorted((w for w, n in _NUMBER_WORDS.items() if n >= 1), key=len, reverse=True)) + ")"
+
+_WEEKDAYS = {
+    "thứ hai": 0, "thứ 2": 0, "t2": 0, "thứ ba": 1, "thứ 3": 1, "t3": 1, "thứ tư": 2, "thứ 4": 2, "t4": 2,
+    "thứ năm": 3, "thứ 5": 3, "t5": 3, "thứ sáu": 4, "thứ 6": 4, "t6": 4, "thứ bảy": 5, "thứ 7": 5, "t7": 5,
+    "chủ nhật": 6, "cn": 6,
+}
+_RELATIVE_DAYS = {
+    "hôm nay": 0, "bữa nay": 0, "nay": 0, "ngày mai": 1, "mai": 1, "ngày mốt": 2, "mốt": 2, "ngày kia": 2,
+    "hôm qua": -1, "hôm kia": -2,
+}
+# Giờ mặc định khi chỉ nói buổi ("chiều mai", "tối nay").
+_PERIOD_DEFAULT_HOUR = {"sáng": 8, "trưa": 12, "chiều": 14, "tối": 19, "đêm": 22, "khuya": 23}
+_PERIODS = "|".join(_PERIOD_DEFAULT_HOUR)
+
+_UNITS = r"phút|giờ|tiếng|ngày|tuần|tháng|năm"
+_FORWARD = {"nữa", "sau", "tới", "kế tiếp"}
+
+
+def _time_pattern(p: str) -> str:
+    """Một mốc giờ: 9h, 9h30, 9:30, 9 giờ 30 phút, 9 rưỡi, 9h kém 15, 3h chiều, năm giờ chiều..."""
+    return (
+        rf"(?:(?<!\d)(?P<{p}h>\d{{1,2}})\s*(?:h|giờ|g|:|(?=\s*rưỡi))|(?P<{p}hw>{_HOUR_WORDS})\s*(?:giờ|(?=\s*rưỡi)))"
+        rf"(?:\s*(?P<{p}m>\d{{1,2}})(?:\s*(?:phút|p))?|\s*(?P<{p}half>rưỡi))?"
+        rf"(?:\s*kém\s*(?P<{p}kem>\d{{1,2}})(?:\s*phút)?)?"
+        rf"(?:\s*(?:buổi\s+)?(?P<{p}period>{_PERIODS}))?"
+    )
+
+
+_ISO_DATE = re.compile(r"(?<!\d)(?P<y>\d{4})-(?P<mo>\d{1,2})-(?P<d>\d{1,2})(?!\d)")
+_WEEKDAY = re.compile(
+    r"\b(?P<wd>" + "|".join(sorted(_WEEKDAYS, key=len, reverse=True)) + r")\b"
+    r"(?:\s*(?:tuần\s*(?P<wq>này|sau|tới|trước|kế tiếp)))?"
+)
+_ABS_DATE = re.compile(
+    r"(?:ngày\s+|mùng\s+|mồng\s+)?(?<!\d)(?P<d>\d{1,2})\s*(?:/|-|\.|\s+tháng\s+)\s*(?P<mo>\d{1,2})"
+    r"(?:\s*(?:/|-|\.|\s+năm\s+)\s*(?P<y>\d{2,4}))?(?!\d)"
+)
+_OFFSET = re.compile(
+    rf"(?<!thứ )\b(?P<n>{_NUM})\s*(?P<u>{_UNITS})(?:\s*rưỡi)?\s*(?P<dir>nữa|sau|tới|trước|qua|kế tiếp)\b"
+    rf"|(?P<dir2>sau)\s+(?P<n2>{_NUM})\s*(?P<u2>{_UNITS})\b"
+)
+_TIME_RANGE = re.compile(rf"(?:từ\s+)?{_time_pattern('s')}\s*(?:-|–|->|đến|tới)\s*{_time_pattern('e')}")
+_TIME = re.compile(rf"(?:lúc\s+|vào\s+)?{_time_pattern('')}")
+_DURATION = re.compile(
+    rf"(?:trong\s+(?:vòng\s+)?(?P<n>{_NUM})\s*(?P<u>tiếng|giờ|phút)|(?P<n2>{_NUM})\s*(?P<u2>tiếng))(?P<half>\s*rưỡi)?(?:\s+đồng hồ)?"
+)
+_RELATIVE_DAY = re.compile(r"\b(?P<rd>" + "|".join(sorted(_RELATIVE_DAYS, key=len, reverse=True)) + r")\b")
+_PERIOD_SPAN = re.compile(
+    r"(?:(?P<edge>đầu|giữa|cuối)\s+)?(?P<unit>tuần|tháng)(?:\s+(?P<which>này|sau|tới|trước|kế tiếp|nay))?"
+)
+# Cả năm ("năm sau", "năm ngoái"); đầu / giữa / cuối năm không rõ khoảng nên để agent hỏi lại.
+_YEAR_SPAN = re.compile(r"\bnăm\s+(?P<which>nay|này|sau|tới|trước|ngoái|kế tiếp)\b")
+_DAY_PERIOD = re.compile(rf"(?:buổi\s+)?(?P<period>{_PERIODS})\b")
+_FILLERS = re.compile(r"\b(?:lúc|vào|khoảng|tầm|cỡ|sang|ngày|hôm|buổi|từ|đến|tới|và|của|nhé|đi|thì|là|giờ)\b|[,.;!?\-–]")
+
+# --- KẾT QUẢ ---
+
+
+@dataclass(frozen=True)
+class ParsedTime:
+    """
+    Kết quả phân tích một cụm thời gian.
+    - `start`, `end`: mốc bắt đầu / kết thúc (end = start + thời lượng).
+    - `first_day`, `last_day`: khoảng ngày mà cụm thời gian bao phủ (vd "tuần sau" = thứ hai..chủ nhật).
+    - `granularity`: "minute" | "day" | "week" | "month" | "year".
+    - `confidence`: 1.0 khi mọi từ trong câu đều được hiểu, thấp dần khi còn từ lạ.
+    """
+    start: datetime
+    end: datetime
+    first_day: date
+    last_day: date
+    granularity: str
+    confidence: float
+
+    @property
+    def duration(self) -> timedelta:
+        return self.end - self.start
+
+# --- PHÂN TÍCH ---
+
+
+def _number(token: str) -> float:
+    return float(token) if token.isdigit() else _NUMBER_WORDS[token]
+
+
+def _hour_minute(m: re.Match, p: str) -> tuple[int, int, str | None]:
+    hour = int(m.group(f"{p}h") or _NUMBER_WORDS[m.group(f"{p}hw")])
+    minute = int(m.group(f"{p}m") or 0)
+    if m.group(f"{p}half"):
+        minute = 30
+    if m.group(f"{p}kem"):
+        hour, minute = hour - 1, 60 - int(m.group(f"{p}kem"))
+    return hour, minute, m.group(f"{p}period")
+
+
+def _valid_clock(hour: int, minute: int) -> bool:
+    return 0 <= hour <= 24 and 0 <= minute < 60
+
+
+def _apply_period(hour: int, period: str | None) -> int:
+    if period in ("chiều", "tối") and hour < 12:
+        return hour + 12
+    if period == "trưa" and 1 <= hour <= 5:
+        return hour + 12
+    if period in ("đêm", "khuya") and 6 <= hour < 12:
+        return hour + 12
+    if period == "sáng" and hour == 12:
+        return 0
+    return hour
+
+
+def _shift(dt: datetime, amount: float, unit: str) -> datetime:
+    if unit == "phút":
+        return dt + timedelta(minutes=amount)
+    if unit in ("giờ", "tiếng"):
+        return dt + timedelta(hours=amount)
+    if unit == "ngày":
+        return dt + timedelta(days=amount)
+    if unit == "tuần":
+        return dt + timedelta(weeks=amount)
+    # Phần lẻ ("nửa tháng", "1 năm rưỡi"): tháng tính 30 ngày, năm tính 12 tháng.
+    whole = int(amount)
+    if unit == "tháng":
+        return add_months(dt, whole) + timedelta(days=round((amount - whole) * 30))
+    return add_months(add_years(dt, whole), round((amount - whole) * 12))
+
+
+def _blank(text: str, m: re.Match) -> str:
+    """Xóa đoạn đã khớp (thay bằng khoảng trắng) để các mẫu sau không khớp lại."""
+    return text[:m.start()] + " " * (m.end() - m.start()) + text[m.end():]
+
+
+def _week_monday(d: date, weeks: int = 0) -> date:
+    return d - timedelta(days=d.weekday()) + timedelta(weeks=weeks)
+
+
+def _which_offset(which: str | None) -> int:
+    if which in ("sau", "tới", "kế tiếp"):
+        return 1
+    if which in ("trước", "ngoái"):
+        return -1
+    return 0
+
+
+@lru_cache(maxsize=4096)
+def _parse(text: str, base: datetime) -> ParsedTime | None:
+    today = base.date()
+    total_chars = len(text.replace(" ", "")) or 1
+    days: list[tuple[date, date]] = []   # Các khoảng ngày tìm được (theo thứ tự xuất hiện)
+    granularity = "day"
+    point: datetime | None = None        # Mốc tuyệt đối từ "N phút/giờ nữa"
+    clock: tuple[int, int] | None = None
+    clock_end: tuple[int, int] | None = None
+    duration: timedelta | None = None
+    default_hour: int | None = None
+    clock_period: str | None = None      # Buổi nói ngay sau giờ ("3h chiều")
+    matched = False
+
+    # 1. Ngày ISO (2025-10-20)
+    for m in _ISO_DATE.finditer(text):
+        try:
+            d = date(int(m.group("y")), int(m.group("mo")), int(m.group("d")))
+        except ValueError:
+            continue
+        days.append((d, d))
+        text, matched = _blank(text, m), True
+
+    # 2. Thứ trong tuần (trước bước 3 để "thứ tư tuần sau" không bị hiểu là "4 tuần sau")
+    for m in _WEEKDAY.finditer(text):
+        target = _WEEKDAYS[m.group("wd")]
+        if m.group("wq"):
+            d = _week_monday(today, _which_offset(m.group("wq"))) + timedelta(days=target)
+        else:
+            # "từ thứ hai đến thứ tư": mốc sau tính từ mốc trước
+            anchor = days[-1][0] if days else today
+            d = anchor + timedelta(days=(target - anchor.weekday()) % 7)
+        days.append((d, d))
+        text, matched = _blank(text, m), True
+
+    # 3. Ngày tuyệt đối (20/10, 20/10/2025, ngày 20 tháng 10)
+    for m in _ABS_DATE.finditer(text):
+        day, month = int(m.group("d")), int(m.group("mo"))
+        if not (1 <= day <= 31 and 1 <= month <= 12):
+            continue
+        year = int(m.group("y")) if m.group("y") else today.year
+        if year < 100:
+            year += 2000
+        try:
+            d = date(year, month, day)
+        except ValueError:
+            continue
+        if not m.group("y") and (today - d).days > 180:
+            d = d.replace(year=d.year + 1)
+        days.append((d, d))
+        text, matched = _blank(text, m), True
+
+    # 4. Khoảng giờ (từ 2h đến 4h chiều), trước bước 5 để "8 giờ tới 10 giờ" không bị hiểu là "8 giờ nữa"
+    # Giờ / phút ngoài khoảng ("từ 25h đến 26h") => bỏ qua, để các bước sau xử lý như câu không có khoảng giờ.
+    m = _TIME_RANGE.search(text)
+    if m and _valid_clock(*_hour_minute(m, "s")[:2]) and _valid_clock(*_hour_minute(m, "e")[:2]):
+        sh, sm, sp = _hour_minute(m, "s")
+        eh, em, ep = _hour_minute(m, "e")
+        eh = _apply_period(eh, ep)
+        # Buổi chỉ nói ở mốc sau thì áp cho cả mốc trước, nếu vẫn hợp lý
+        shared = _apply_period(sh, sp or ep)
+        sh = shared if (shared, sm) <= (eh, em) else _apply_period(sh, sp)
+        clock, clock_end = (sh % 24, sm), (eh, em)
+        clock_period = sp or ep
+        text, matched = _blank(text, m), True
+
+    # 5. Khoảng lệch tương đối (3 ngày sau, 2 tiếng nữa, sau 30 phút)
+    for m in _OFFSET.finditer(text):
+        amount = _number(m.group("n") or m.group("n2"))
+        unit = m.group("u") or m.group("u2")
+        direction = m.group("dir") or m.group("dir2")
+        if "rưỡi" in m.group(0):
+            amount += 0.5
+        sign = 1 if direction in _FORWARD else -1
+        if unit in ("phút", "giờ", "tiếng"):
+            point = _shift(base, sign * amount, unit)
+            granularity = "minute"
+        else:
+            shifted = _shift(base, sign * amount, unit).date()
+            days.append((shifted, shifted))
+        text, matched = _blank(text, m), True
+
+    # 6. Mốc giờ đơn (9h30 sáng)
+    if clock is None:
+        m = _TIME.search(text)
+        if m:
+            h, mi, period = _hour_minute(m, "")
+            if _valid_clock(h, mi):
+                clock, clock_period = (_apply_period(h, period) % 24, mi), period
+                text, matched = _blank(text, m), True
+
+    # 7. Thời lượng (trong 2 tiếng, 1 tiếng rưỡi)
+    m = _DURATION.search(text)
+    if m:
+        amount = _number(m.group("n") or m.group("n2")) + (0.5 if m.group("half") else 0)
+        unit = m.group("u") or m.group("u2")
+        duration = timedelta(minutes=amount) if unit == "phút" else timedelta(hours=amount)
+        text, matched = _blank(text, m), True
+
+    # 8. Ngày tương đối (hôm nay, mai, ngày kia...)
+    for m in _RELATIVE_DAY.finditer(text):
+        d = today + timedelta(days=_RELATIVE_DAYS[m.group("rd")])
+        days.append((d, d))
+        text, matched = _blank(text, m), True
+
+    # 9. Tuần / tháng (tuần này, cuối tuần, tháng sau, đầu tháng)
+    for m in _PERIOD_SPAN.finditer(text):
+        if not (m.group("which") or m.group("edge")):
+            continue
+        offset = _which_offset(m.group("which"))
+        edge = m.group("edge")
+        if m.group("unit") == "tuần":
+            first = _week_monday(today, offset)
+            last = first + timedelta(days=6)
+            if edge == "đầu":
+                last = first + timedelta(days=1)
+            elif edge == "giữa":
+                first, last = first + timedelta(days=2), first + timedelta(days=3)
+            elif edge == "cuối":
+                first = first + timedelta(days=5)
+            granularity = "week" if not edge else "day"
+        else:
+            first = _first_of_month(today, offset)
+            last = _first_of_month(today, offset + 1) - timedelta(days=1)
+            if edge == "đầu":
+                last = first + timedelta(days=9)
+            elif edge == "giữa":
+                first, last = first + timedelta(days=10), first + timedelta(days=19)
+            elif edge == "cuối":
+                first = last - timedelta(days=9)
+            granularity = "month" if not edge else "day"
+        days.append((first, last))
+        text, matched = _blank(text, m), True
+
+    # 9b. Cả năm (năm nay, năm sau, năm ngoái)
+    for m in _YEAR_SPAN.finditer(text):
+        year = today.year + _which_offset(m.group("which"))
+        days.append((date(year, 1, 1), date(year, 12, 31)))
+        granularity = "year"
+        text, matched = _blank(text, m), True
+
+    # 10. Buổi trong ngày đứng riêng (chiều nay, tối mai). Đứng trước giờ không kèm buổi ("chiều mai 3h",
+    # "tối nay 7 rưỡi") thì buổi quyết định sáng / chiều của giờ đó.
+    m = _DAY_PERIOD.search(text)
+    if m:
+        period = m.group("period")
+        default_hour = _PERIOD_DEFAULT_HOUR[period]
+        if clock is not None and clock_period is None:
+            clock = (_apply_period(clock[0], period) % 24, clock[1])
+            if clock_end is not None:
+                clock_end = (_apply_period(clock_end[0], period), clock_end[1])
+        text, matched = _blank(text, m), True
+
+    if not matched:
+        return None
+
+    # --- Ghép các thành phần ---
+    if days:
+        first_day = days[0][0]
+        last_day = days[-1][1] if len(days) > 1 else days[0][1]
+        if last_day < first_day:
+            last_day = first_day
+    elif point is not None:
+        first_day = last_day = point.date()
+    else:
+        first_day = last_day = today
+
+    if point is not None and not days and clock is None:
+        start = point.replace(second=0, microsecond=0)
+    else:
+        start = base.replace(year=first_day.year, month=first_day.month, day=first_day.day)
+        if clock is not None:
+            start = start.replace(hour=clock[0], minute=clock[1], second=0, microsecond=0)
+            granularity = "minute"
+        elif default_hour is not None:
+            start = start.replace(hour=default_hour, minute=0, second=0, microsecond=0)
+            granularity = "minute" if granularity == "day" else granularity
+
+    if clock_end is not None:
+        end = start.replace(hour=clock_end[0] % 24, minute=clock_end[1])
+        if end <= start:
+            end += timedelta(days=1)
+    elif duration is not None:
+        end = start + duration
+    else:
+        end = start + DEFAULT_DURATION
+
+    if first_day == last_day:
+        last_day = max(last_day, start.date())
+        first_day = start.date()
+
+    # Độ tin cậy: tỉ lệ ký tự được hiểu, bỏ qua các từ đệm (lúc, vào, khoảng...)
+    leftover = len(_FILLERS.sub(" ", text).replace(" ", ""))
+    confidence = 1.0 if leftover == 0 else round(max(0.0, 0.9 * (1 - leftover / total_chars)), 3)
+
+    return ParsedTime(start, end, first_day, last_day, granularity, confidence)
+
+
+def normalize_expression(expression: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", expression).lower()).strip()
+
 # --- HÀM CHÍNH ĐỂ EXPORT ---
 
 
-def parse_natural_time(expression: str, base_date: datetime) -> tuple[datetime, datetime]:
+def parse_time_expression(expression: str, base_date: datetime) -> ParsedTime | None:
     """
-    Chuyển cụm thời gian tiếng Việt thành (ngày_bắt_đầu, ngày_kết_thúc).
-    Hàm này đã được sửa để xử lý cả ngày giờ cụ thể.
+    Phân tích một cụm thời gian tiếng Việt. Trả về None nếu không nhận ra thành phần thời gian nào.
+    Hỗ trợ: ISO, ngày/tháng(/năm), hôm nay/mai/ngày kia, "N phút/giờ/ngày/tuần/tháng/năm nữa|sau|trước"
+    (kể cả "nửa tháng sau"), thứ trong tuần (+ tuần này/sau/trước), tuần/tháng (đầu/giữa/cuối), năm nay/sau/ngoái,
+    mốc giờ (9h30, 3 giờ chiều, chiều mai 3h, 9 rưỡi, 9h kém 15), khoảng giờ ("từ 2h đến 4h chiều")
+    và thời lượng ("trong 2 tiếng").
     """
     try:
-        # Ưu tiên 1: Thử phân tích chuỗi ngày giờ đầy đủ (ví dụ: '2025-10-20 09:00:00')
-        new_start = datetime.fromisoformat(expression)
-        return new_start, new_start + timedelta(hours=1)
-    except (ValueError, TypeError):
-        # Nếu không phải chuỗi đầy đủ, tiếp tục xử lý ngôn ngữ tự nhiên
+        start = datetime.fromisoformat(expression.strip())
+        granularity = "day" if len(expression.strip()) <= 10 else "minute"
+        return ParsedTime(start, start + DEFAULT_DURATION, start.date(), start.date(), granularity, 1.0)
+    except (ValueError, TypeError, AttributeError):
         pass
+    if not expression:
+        return None
+    # Mốc làm tròn xuống phút (kết quả cũng chỉ chính xác đến phút) để cache còn trúng giữa các lần gọi với `now()`.
+    return _parse(normalize_expression(expression), base_date.replace(second=0, microsecond=0))
+
+
+def parse_many(expressions: Iterable[str], base_date: datetime) -> list[ParsedTime | None]:
+    """Phân tích nhiều cụm thời gian với cùng mốc `base_date`; cụm trùng nhau chỉ phân tích một lần."""
+    seen: dict[str, ParsedTime | None] = {}
+    results = []
+    for expression in expressions:
+        if expression not in seen:
+            seen[expression] = parse_time_expression(expression, base_date)
+        results.append(seen[expression])
+    return results
+
 
-    expr = expression.lower().strip()
-    new_start = base_date
-
-    match = re.search(r"(\d+)\s*(ngày|tuần|tháng|năm)\s*(sau|tới|trước)", expr)
-    if match:
-        amount, unit, direction = int(
-            match.group(1)), match.group(2), match.group(3)
-        multiplier = 1 if direction in ["sau", "tới"] else -1
-
-        if unit == "ngày":
-            new_start += timedelta(days=amount * multiplier)
-        elif unit == "tuần":
-            new_start += timedelta(weeks=amount * multiplier)
-        elif unit == "tháng":
-            new_start = add_months(new_start, amount * multiplier)
-        elif unit == "năm":
-            new_start = add_years(new_start, amount * multiplier)
-
-    # Thêm các logic khác nếu cần, ví dụ: "ngày mai", "tuần sau"
-    elif "mai" in expr or "ngày sau" in expr:
-        new_start += timedelta(days=1)
-
-    return new_start, new_start + timedelta(hours=1)
+def parse_natural_time(expression: str, base_date: datetime) -> tuple[datetime, datetime]:
+    """
+    Chuyển cụm thời gian tiếng Việt thành (ngày_bắt_đầu, ngày_kết_thúc).
+    Giữ nguyên giờ (đến phút) của `base_date` khi câu nói không nêu giờ; không hiểu thì trả về `base_date`.
+    """
+    parsed = parse_time_expression(expression, base_date)
+    if parsed is None:
+        return base_date, base_date + DEFAULT_DURATION
+    return parsed.start, parsed.end
@@ -0,0 +1,77 @@
+# File: utils/thu_tu_tool.py
+
+import asyncio
+import re
+import unicodedata
+from contextlib import asynccontextmanager
+from typing import Iterable
+
+# Phạm vi dữ liệu một lượt gọi tool chạm tới:
+#   None           - không chạm task nào (đọc tên người dùng, ghi chú không gắn task...)
+#   TOAN_BO        - đọc toàn bộ dữ liệu của người dùng (tìm lịch, tóm tắt)
+#   frozenset[str] - các tiêu đề task (đã chuẩn hóa) mà lượt gọi đọc/ghi
+TOAN_BO = "*"
+
+
+def normalize_title(title: str) -> str:
+    """Chữ thường, bỏ dấu, gộp khoảng trắng: "Làm  Slide" và "lam slide" là cùng một task."""
+    text = unicodedata.normalize("NFD", title.lower()).replace("đ", "d")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def task_scope(titles: Iterable[str | None]) -> frozenset[str] | None:
+    scope = frozenset(normalize_title(t) for t in titles if t and t.strip())
+    return scope or None
+
+
+def _conflicts(a, a_write: bool, b, b_write: bool) -> bool:
+    if not (a_write or b_write) or a is None or b is None:
+        return False
+    if a == TOAN_BO or b == TOAN_BO:
+        return True
+    # Tiêu đề được tìm gần đúng ("làm slide" khớp "Làm slide thuyết trình") => chứa nhau coi như cùng task.
+    return any(x in y or y in x for x in a for y in b)
+
+
+class ToolCallOrdering:
+    """
+    Thứ tự các lượt gọi tool trong MỘT lượt của agent (LangChain chạy chúng đồng thời bằng asyncio.gather).
+    Lượt gọi đến sau chỉ chờ những lượt trước nó có xung đột (ít nhất một bên ghi và cùng chạm một task,
+    hoặc một bên đọc toàn bộ); các lượt độc lập không chờ nhau theo thứ tự model gọi. Trong `UnitOfWork`
+    chúng vẫn chạy SQL lần lượt trên kết nối chung của lượt, chỉ phần ngoài SQL là chạy đồng thời.
+
+    Thứ tự model gọi tool được giữ bằng `reserve()` trước khi gather bắt đầu: các coroutine của gather
+    không đến `turn()` theo đúng thứ tự (callback on_tool_start không chạy inline bị đẩy sang executor).
+    """
+
+    def __init__(self):
+        self._calls: list[tuple[object, bool, asyncio.Event]] = []
+        self._reserved: dict[str, tuple[list[asyncio.Event], asyncio.Event]] = {}
+
+    def _register(self, scope, write: bool) -> tuple[list[asyncio.Event], asyncio.Event]:
+        earlier = [done for other, other_write, done in self._calls if _conflicts(scope, write, other, other_write)]
+        done = asyncio.Event()
+        self._calls.append((scope, write, done))
+        return earlier, done
+
+    def reserve(self, key: str, scope, write: bool) -> None:
+        """Giữ chỗ cho lượt gọi `key` (id của tool call) theo thứ tự model gọi; `turn(..., key=key)` dùng lại chỗ này."""
+        if key not in self._reserved:  # id trùng (model không đặt id riêng) => lượt sau tự đăng ký khi chạy
+            self._reserved[key] = self._register(scope, write)
+
+    def release(self, key: str) -> None:
+        """Lượt gọi đã giữ chỗ nhưng không chạy tới `turn()` (tool không tồn tại, tham số sai) => không ai phải chờ nó."""
+        reserved = self._reserved.pop(key, None)
+        if reserved is not None:
+            reserved[1].set()
+
+    @asynccontextmanager
+    async def turn(self, scope, write: bool, key: str | None = None):
+        earlier, done = self._reserved.pop(key, None) or self._register(scope, write)
+        try:
+            for event in earlier:
+                await event.wait()
+            yield
+        finally:
+            done.set()
@@ -0,0 +1,122 @@
+# File: utils/tts_cache.py
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+
+class TTSAudioCache:
+    """
+    Cache audio đã tổng hợp, khóa theo hash của (văn bản đã làm sạch + cấu hình giọng).
+    - Tầng 1: LRU trong RAM, giới hạn theo tổng số byte (`max_bytes`).
+    - Tầng 2 (tùy chọn): thư mục trên đĩa (`disk_dir`), giữ lại qua các lần khởi động lại.
+    Dùng được từ nhiều luồng (gTTS chạy trong thread pool).
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, disk_dir: str | None = None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(speech_text: str, lang: str, slow: bool) -> str:
+        return hashlib.sha256(f"{lang}|{int(slow)}|{speech_text}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.mp3")
+
+    def _remember(self, key: str, audio: bytes) -> None:
+        # Gọi khi đang giữ self._lock
+        if len(audio) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = audio
+        self._size += len(audio)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return audio
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    audio = f.read()
+            except OSError:
+                audio = None
+            if audio:
+                with self._lock:
+                    self._remember(key, audio)
+                    self.disk_hits += 1
+                return audio
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, audio: bytes) -> None:
+        if not audio:
+            return
+        with self._lock:
+            self._remember(key, audio)
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(audio)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Không ghi được cache TTS xuống đĩa: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+
+class TTSCacheCollector:
+    """Xuất `TTSAudioCache.stats()` ra /metrics (đọc lúc Prometheus scrape, không tốn gì trên đường đi của request)."""
+
+    def __init__(self, cache: TTSAudioCache):
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.stats()
+        lookups = CounterMetricFamily("skedule_tts_cache_lookups", "Số lần tra cache TTS theo kết quả.", labels=["result"])
+        for result in ("memory_hits", "disk_hits", "misses"):
+            lookups.add_metric([result], stats[result])
+        yield lookups
+        yield GaugeMetricFamily("skedule_tts_cache_hit_ratio", "Tỉ lệ tra cache TTS trúng (RAM + đĩa).", value=stats["hit_rate"])
+        yield GaugeMetricFamily("skedule_tts_cache_entries", "Số audio đang giữ trong RAM.", value=stats["entries"])
+        yield GaugeMetricFamily("skedule_tts_cache_bytes", "Tổng byte audio đang giữ trong RAM.", value=stats["bytes"])
@@ -0,0 +1,153 @@
+# File: utils/tts_nen.py
+
+import asyncio
+import hashlib
+import logging
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Callable
+
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Các định dạng audio trả lời: tên -> MIME. "mp3" là định dạng gốc của gTTS.
+AUDIO_FORMATS = {"mp3": "audio/mpeg", "opus": "audio/ogg; codecs=opus"}
+_MIME_TO_FORMAT = {"audio/mpeg": "mp3", "audio/mp3": "mp3", "audio/ogg": "opus", "audio/opus": "opus"}
+
+
+class AudioKhongTonTai(Exception):
+    """Handle audio không có (hết hạn, sai người dùng) hoặc chưa từng được tạo."""
+
+
+@dataclass
+class _AudioJob:
+    user_id: str
+    text: str
+    tasks: dict[str, asyncio.Future] = field(default_factory=dict)  # định dạng -> bytes
+
+
+class BackgroundTTS:
+    """
+    Tổng hợp giọng nói chạy nền cho /chat: trả lời văn bản trả về ngay kèm `audio_id`,
+    audio được tạo trong `executor` và lấy sau bằng GET /audio/{audio_id}.
+    - `audio_id` là hash của (user, văn bản): cùng câu trả lời => cùng handle, cùng ETag.
+    - Giữ tối đa `max_jobs` handle, mỗi handle sống `ttl` giây kể từ lần tạo.
+    - `encoders` đổi MP3 sang định dạng gọn hơn khi client yêu cầu; chỉ mã hóa khi có người lấy.
+    """
+
+    def __init__(self, synthesize: Callable[[str], bytes], executor: Executor,
+                 encoders: dict[str, Callable[[bytes], bytes]] | None = None,
+                 max_jobs: int = 500, ttl: float = 600):
+        self._synthesize = synthesize
+        self._executor = executor
+        self._encoders = encoders or {}
+        self._jobs: TTLCache[str, _AudioJob] = TTLCache(maxsize=max_jobs, ttl=ttl, timer=time.monotonic)
+        self.ttl = ttl
+
+    @staticmethod
+    def make_id(user_id: str, text: str) -> str:
+        return hashlib.sha256(f"{user_id}|{text}".encode("utf-8")).hexdigest()[:32]
+
+    def formats(self) -> list[str]:
+        return ["mp3", *self._encoders]
+
+    def submit(self, user_id: str, text: str) -> str:
+        """Bắt đầu tạo MP3 ngay (không chờ) và trả về handle."""
+        audio_id = self.make_id(user_id, text)
+        job = self._jobs.get(audio_id)
+        if job is None or self._failed(job.tasks.get("mp3")):
+            job = _AudioJob(user_id=user_id, text=text)
+            self._jobs[audio_id] = job
+            job.tasks["mp3"] = self._start(self._synthesize, text)
+        return audio_id
+
+    async def get(self, audio_id: str, user_id: str, fmt: str = "mp3") -> bytes:
+        """Chờ audio (nếu còn đang tạo) rồi trả về bytes. Ném `AudioKhongTonTai` nếu không có handle."""
+        job = self._jobs.get(audio_id)
+        if job is None or job.user_id != user_id:
+            raise AudioKhongTonTai(audio_id)
+        if self._failed(job.tasks["mp3"]):
+            job.tasks["mp3"] = self._start(self._synthesize, job.text)  # Lần trước lỗi (mạng gTTS) => thử lại
+        if fmt not in job.tasks or self._failed(job.tasks[fmt]):
+            mp3 = await asyncio.shield(job.tasks["mp3"])
+            if fmt not in job.tasks or self._failed(job.tasks[fmt]):  # Request khác có thể đã bắt đầu mã hóa
+                job.tasks[fmt] = self._start(self._encoders[fmt], mp3)
+        return await asyncio.shield(job.tasks[fmt])
+
+    def _start(self, fn, arg) -> asyncio.Future:
+        task = asyncio.get_running_loop().run_in_executor(self._executor, fn, arg)
+        task.add_done_callback(self._log_failure)
+        return task
+
+    @staticmethod
+    def _failed(task: asyncio.Future | None) -> bool:
+        return task is not None and task.done() and (task.cancelled() or task.exception() is not None)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Lỗi tạo audio nền: {task.exception()}")
+
+    def stats(self) -> dict:
+        tasks = [task for job in self._jobs.values() for task in job.tasks.values()]
+        return {
+            "jobs": len(self._jobs),
+            "pending": sum(not task.done() for task in tasks),
+            "bytes": sum(len(task.result()) for task in tasks if task.done() and not self._failed(task)),
+        }
+
+# --- CHỌN ĐỊNH DẠNG (Accept) & ĐOẠN BYTE (Range) ---
+
+
+def negotiate_format(accept: str | None, available: list[str], default: str = "mp3") -> str | None:
+    """
+    Chọn định dạng theo header Accept (có q-value); hòa điểm thì ưu tiên định dạng gọn hơn (opus).
+    Trả về None nếu client không nhận định dạng nào có sẵn (=> 406).
+    """
+    if not accept:
+        return default
+    best, best_q = None, 0.0
+    for item in accept.split(","):
+        mime, *params = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        mime = mime.lower()
+        if mime in ("*/*", "audio/*"):
+            candidates = [fmt for fmt in ("opus", default) if fmt in available] if mime == "audio/*" else [default]
+        else:
+            candidates = [_MIME_TO_FORMAT[mime]] if _MIME_TO_FORMAT.get(mime) in available else []
+        for fmt in candidates:
+            if q > best_q or (q == best_q and q > 0 and fmt == "opus" and best != "opus"):
+                best, best_q = fmt, q
+    return best
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    `Range: bytes=a-b` (một đoạn) -> (start, end) tính cả `end`.
+    None = trả cả file (không có Range, nhiều đoạn, hoặc cú pháp lạ). Ném ValueError nếu đoạn nằm ngoài file (=> 416).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    if not sep or not (first or last) or not (first.isdigit() or not first) or not (last.isdigit() or not last):
+        return None
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None  # Cú pháp không hợp lệ => bỏ qua Range (RFC 9110)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0:
+            raise ValueError(header)
+    if start >= size:
+        raise ValueError(header)
+    return start, end
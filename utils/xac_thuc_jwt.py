@@ -0,0 +1,109 @@
+# File: utils/xac_thuc_jwt.py
+
+import hashlib
+import threading
+import time
+
+import jwt
+from cachetools import TLRUCache
+
+# Thuật toán bất đối xứng mà Supabase có thể dùng cho khóa ký mới (JWKS).
+# HS256 chỉ được chấp nhận khi có SUPABASE_JWT_SECRET.
+ASYMMETRIC_ALGORITHMS = {"RS256", "ES256", "EdDSA"}
+
+# --- CÁC LỖI ---
+
+
+class TokenKhongHopLe(Exception):
+    """Token sai chữ ký, sai audience hoặc đã hết hạn. Không cần hỏi lại Supabase."""
+
+
+class KhongTheXacThucCucBo(Exception):
+    """Không đủ thông tin để tự kiểm tra (thiếu secret, lỗi tải JWKS...). Nên hỏi Supabase."""
+
+# --- XÁC THỰC CỤC BỘ ---
+
+
+class SupabaseJWTVerifier:
+    """
+    Kiểm tra JWT của Supabase ngay trong tiến trình, không cần gọi `auth.get_user`.
+    - HS256: dùng `SUPABASE_JWT_SECRET` (khóa ký kiểu cũ).
+    - RS256/ES256/EdDSA: dùng JWKS của dự án, được cache và tự tải lại khi gặp `kid` lạ
+      hoặc khi hết `jwks_lifespan` giây.
+    """
+
+    def __init__(self, supabase_url: str, jwt_secret: str | None = None, audience: str = "authenticated",
+                 jwks_lifespan: int = 600, leeway: int = 10):
+        self.jwt_secret = jwt_secret
+        self.audience = audience
+        self.leeway = leeway
+        self.jwks_client = jwt.PyJWKClient(
+            f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json",
+            cache_keys=True,
+            lifespan=jwks_lifespan,
+        )
+
+    def _signing_key(self, token: str, algorithm: str | None):
+        if algorithm == "HS256":
+            if not self.jwt_secret:
+                raise KhongTheXacThucCucBo("Chưa cấu hình SUPABASE_JWT_SECRET cho token HS256.")
+            return self.jwt_secret
+        if algorithm in ASYMMETRIC_ALGORITHMS:
+            try:
+                return self.jwks_client.get_signing_key_from_jwt(token).key
+            except jwt.PyJWKClientError as e:
+                raise KhongTheXacThucCucBo(f"Không lấy được khóa JWKS: {e}")
+        raise TokenKhongHopLe(f"Thuật toán ký không được hỗ trợ: {algorithm}")
+
+    def verify(self, token: str) -> dict:
+        """Trả về claims nếu token hợp lệ, ngược lại ném `TokenKhongHopLe` / `KhongTheXacThucCucBo`."""
+        try:
+            algorithm = jwt.get_unverified_header(token).get("alg")
+        except jwt.DecodeError as e:
+            raise TokenKhongHopLe(f"Token không đúng định dạng JWT: {e}")
+
+        key = self._signing_key(token, algorithm)
+        try:
+            return jwt.decode(
+                token,
+                key,
+                algorithms=[algorithm],
+                audience=self.audience,
+                leeway=self.leeway,
+                options={"require": ["exp", "sub"]},
+            )
+        except jwt.InvalidTokenError as e:
+            raise TokenKhongHopLe(str(e))
+
+# --- CACHE TOKEN ĐÃ XÁC THỰC ---
+
+
+class VerifiedTokenCache:
+    """
+    Cache token -> user_id đã xác thực.
+    Mỗi mục hết hạn ở thời điểm sớm hơn giữa `exp` của token và `ttl` giây kể từ lúc lưu.
+    Khóa là SHA-256 của token để không giữ token gốc trong bộ nhớ.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 300):
+        self.ttl = ttl
+        self._cache = TLRUCache(maxsize=maxsize, ttu=self._expires_at, timer=time.time)
+        self._lock = threading.Lock()
+
+    def _expires_at(self, _key, value: tuple[str, float], now: float) -> float:
+        return min(value[1], now + self.ttl)
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> str | None:
+        with self._lock:
+            value = self._cache.get(self._key(token))
+        return value[0] if value else None
+
+    def put(self, token: str, user_id: str, exp: float) -> None:
+        if exp <= time.time():
+            return
+        with self._lock:
+            self._cache[self._key(token)] = (user_id, exp)
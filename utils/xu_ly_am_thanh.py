@@ -0,0 +1,199 @@
+# File: utils/xu_ly_am_thanh.py
+
+import audioop
+import io
+import shutil
+import subprocess
+import wave
+from dataclasses import dataclass
+from typing import Callable, Protocol
+
+import numpy as np
+
+# Định dạng chuẩn đưa vào bộ nhận dạng: PCM 16-bit, mono, 16 kHz.
+SAMPLE_RATE = 16_000
+SAMPLE_WIDTH = 2
+CHANNELS = 1
+
+# --- CÁC LỖI ---
+
+
+class AmThanhKhongHopLe(Exception):
+    """Không giải mã được file âm thanh."""
+
+
+class KhongNhanDangDuoc(Exception):
+    """Bộ nhận dạng không nghe ra lời nói nào."""
+
+
+class DichVuNhanDangLoi(Exception):
+    """Dịch vụ nhận dạng giọng nói lỗi / không truy cập được."""
+
+# --- GIẢI MÃ VỀ PCM 16 kHz MONO ---
+
+
+@dataclass
+class PreparedAudio:
+    pcm: bytes
+    sample_rate: int
+    original_ms: int   # Độ dài trước khi cắt khoảng lặng
+    speech_ms: int     # Độ dài phần có tiếng nói
+
+
+def _pcm_ms(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> int:
+    return len(pcm) * 1000 // (sample_rate * SAMPLE_WIDTH * CHANNELS)
+
+
+def _decode_wav(audio_bytes: bytes) -> bytes:
+    """WAV PCM: đọc thẳng từ bộ nhớ và đổi mẫu bằng audioop, không cần ffmpeg."""
+    with wave.open(io.BytesIO(audio_bytes)) as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+    if channels == 2:
+        frames = audioop.tomono(frames, width, 0.5, 0.5)
+    elif channels != 1:
+        raise AmThanhKhongHopLe(f"Không hỗ trợ WAV {channels} kênh.")
+    if width != SAMPLE_WIDTH:
+        frames = audioop.lin2lin(frames, width, SAMPLE_WIDTH)
+    if rate != SAMPLE_RATE:
+        frames, _ = audioop.ratecv(frames, SAMPLE_WIDTH, 1, rate, SAMPLE_RATE, None)
+    return frames
+
+
+def _decode_ffmpeg(audio_bytes: bytes) -> bytes:
+    """Các định dạng nén (m4a, mp3, ogg...): ffmpeg đọc từ stdin, xuất PCM thô ra stdout."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise AmThanhKhongHopLe("Không tìm thấy ffmpeg.")
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-acodec", "pcm_s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "pipe:1"],
+        input=audio_bytes, capture_output=True, check=False,
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise AmThanhKhongHopLe(result.stderr.decode("utf-8", "replace").strip() or "ffmpeg không xuất ra dữ liệu.")
+    return result.stdout
+
+
+def _decode_pydub(audio_bytes: bytes) -> bytes:
+    """Dự phòng cho container cần tua (vd m4a có `moov` ở cuối) mà ffmpeg không đọc được qua pipe."""
+    from pydub import AudioSegment
+
+    sound = AudioSegment.from_file(io.BytesIO(audio_bytes))
+    sound = sound.set_frame_rate(SAMPLE_RATE).set_channels(CHANNELS).set_sample_width(SAMPLE_WIDTH)
+    return sound.raw_data
+
+
+def decode_to_pcm(audio_bytes: bytes) -> bytes:
+    if audio_bytes[:4] == b"RIFF" and audio_bytes[8:12] == b"WAVE":
+        try:
+            return _decode_wav(audio_bytes)
+        except (wave.Error, EOFError, audioop.error):
+            pass  # WAV nén (ADPCM...) => để ffmpeg xử lý
+    try:
+        return _decode_ffmpeg(audio_bytes)
+    except AmThanhKhongHopLe:
+        try:
+            return _decode_pydub(audio_bytes)
+        except Exception as e:
+            raise AmThanhKhongHopLe(f"Không giải mã được âm thanh: {e}")
+
+# --- MÃ HÓA AUDIO TRẢ LỜI (gTTS -> OPUS) ---
+
+
+def opus_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def encode_opus(audio_bytes: bytes, bitrate: str = "24k") -> bytes:
+    """MP3 của gTTS -> Ogg/Opus mono cho giọng nói: nhỏ hơn MP3 cùng độ rõ."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        raise AmThanhKhongHopLe("Không tìm thấy ffmpeg.")
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-ac", "1", "-c:a", "libopus", "-b:a", bitrate, "-application", "voip", "-f", "ogg", "pipe:1"],
+        input=audio_bytes, capture_output=True, check=False,
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise AmThanhKhongHopLe(result.stderr.decode("utf-8", "replace").strip() or "ffmpeg không xuất ra dữ liệu.")
+    return result.stdout
+
+# --- CẮT KHOẢNG LẶNG (VAD theo năng lượng) ---
+
+
+def trim_silence(pcm: bytes, sample_rate: int = SAMPLE_RATE, frame_ms: int = 30,
+                 padding_ms: int = 200, threshold_db: float = 12.0) -> bytes:
+    """
+    Bỏ khoảng lặng ở đầu và cuối đoạn ghi âm.
+    Một khung (`frame_ms`) được coi là có tiếng nói khi năng lượng cao hơn nền nhiễu
+    (phân vị 10% năng lượng các khung) ít nhất `threshold_db`. Giữ thêm `padding_ms` mỗi đầu
+    để không cắt mất phụ âm đầu/cuối. Trả về b"" nếu không có khung nào có tiếng nói.
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame_len = sample_rate * frame_ms // 1000
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return pcm
+
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len).astype(np.float32)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1.0)
+    noise_floor = np.percentile(energy_db, 10)
+    # Ngưỡng tuyệt đối tối thiểu (~ -60 dBFS) để file toàn tiếng ồn nhỏ không bị coi là tiếng nói
+    voiced = np.flatnonzero(energy_db > max(noise_floor + threshold_db, 30.0))
+    if len(voiced) == 0:
+        return b""
+
+    pad = padding_ms // frame_ms
+    first = max(voiced[0] - pad, 0) * frame_len
+    last = min(voiced[-1] + 1 + pad, n_frames) * frame_len
+    return samples[first:last].tobytes()
+
+
+def prepare_audio(audio_bytes: bytes) -> PreparedAudio:
+    """Giải mã + cắt khoảng lặng. Hàm cấp module để chạy được trong ProcessPoolExecutor."""
+    pcm = decode_to_pcm(audio_bytes)
+    speech = trim_silence(pcm)
+    return PreparedAudio(pcm=speech, sample_rate=SAMPLE_RATE, original_ms=_pcm_ms(pcm), speech_ms=_pcm_ms(speech))
+
+# --- BỘ NHẬN DẠNG (có thể thay thế) ---
+
+
+class SpeechRecognizer(Protocol):
+    def recognize(self, audio: PreparedAudio, language: str) -> str:
+        """Trả về văn bản; ném `KhongNhanDangDuoc` / `DichVuNhanDangLoi` khi thất bại."""
+        ...
+
+
+class GoogleSpeechRecognizer:
+    """Google Web Speech API qua `speech_recognition`, nhận thẳng PCM (không tạo file WAV trung gian)."""
+
+    def __init__(self):
+        import speech_recognition as sr
+
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def recognize(self, audio: PreparedAudio, language: str) -> str:
+        audio_data = self._sr.AudioData(audio.pcm, audio.sample_rate, SAMPLE_WIDTH)
+        try:
+            return self._recognizer.recognize_google(audio_data, language=language)
+        except self._sr.UnknownValueError:
+            raise KhongNhanDangDuoc()
+        except self._sr.RequestError as e:
+            raise DichVuNhanDangLoi(str(e))
+
+
+_RECOGNIZERS: dict[str, Callable[[], SpeechRecognizer]] = {"google": GoogleSpeechRecognizer}
+
+
+def register_recognizer(name: str, factory: Callable[[], SpeechRecognizer]) -> None:
+    """Đăng ký một bộ nhận dạng khác (engine cục bộ, bản giả cho kiểm thử...)."""
+    _RECOGNIZERS[name] = factory
+
+
+def build_recognizer(name: str) -> SpeechRecognizer:
+    try:
+        return _RECOGNIZERS[name]()
+    except KeyError:
+        raise ValueError(f"Bộ nhận dạng giọng nói không hợp lệ: {name} (có: {', '.join(_RECOGNIZERS)})")